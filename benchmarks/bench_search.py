@@ -0,0 +1,355 @@
+#
+# This file is part of pleiades_search_api
+# by Tom Elliott for the Institute for the Study of the Ancient World
+# (c) Copyright 2024 by New York University
+# Licensed under the AGPL-3.0; see LICENSE.txt file.
+#
+"""
+Benchmark the search path offline against a local stand-in for /search_rss
+
+Run from the repository root:
+
+    python benchmarks/bench_search.py --output bench.json
+    python benchmarks/bench_search.py --compare bench.json
+
+Responses are served from fixtures: /search_rss responses named
+search_rss_<hits>.xml in the --fixtures directory (by default
+benchmarks/fixtures), or synthetic responses in the same format for sizes
+with no file there. The stand-in server answers any query whose Title is
+"hits-<n>" with the fixture for n hits. To refresh the fixtures from
+Pleiades itself (this makes real requests):
+
+    python benchmarks/bench_search.py --record --user-agent "$UA"
+"""
+
+from argparse import ArgumentParser
+import asyncio
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+from pathlib import Path
+import platform
+import statistics
+import sys
+from threading import Thread
+import time
+from urllib.parse import parse_qs, urlencode, urlparse
+from xml.sax.saxutils import escape
+
+from pleiades_search_api.async_search import AsyncSearchInterface
+from pleiades_search_api.rss import iter_rss_items
+from pleiades_search_api.search import Query, SearchInterface, encode_web_parameters
+
+DEFAULT_FIXTURES = Path(__file__).parent / "fixtures"
+DEFAULT_SIZES = [0, 1, 10, 50, 100]
+DEFAULT_REPEAT = 20
+DEFAULT_TOLERANCE = 0.25
+USER_AGENT = "pleiades_search_api_benchmarks/0.1 (+https://github.com/isawnyu/pleiades_search_api)"
+logger = logging.getLogger(Path(__file__).name)
+
+RSS_HEAD = """<?xml version="1.0" encoding="utf-8" ?>
+<rdf:RDF
+  xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+  xmlns:dc="http://purl.org/dc/elements/1.1/"
+  xmlns:syn="http://purl.org/rss/1.0/modules/syndication/"
+  xmlns="http://purl.org/rss/1.0/">
+<channel rdf:about="https://pleiades.stoa.org/search_rss">
+  <title>Pleiades: Search results</title>
+  <link>https://pleiades.stoa.org/search_rss</link>
+  <description>Search results</description>
+  <items><rdf:Seq>{seq}</rdf:Seq></items>
+</channel>
+"""
+RSS_ITEM = """<item rdf:about="https://pleiades.stoa.org/places/{pid}">
+  <title>{title}</title>
+  <link>https://pleiades.stoa.org/places/{pid}</link>
+  <description>{description}</description>
+  <dc:publisher>Pleiades</dc:publisher>
+  <dc:creator>Pleiades editors</dc:creator>
+  <dc:rights>Copyright (c) Pleiades</dc:rights>
+  <dc:subject>dare:ancient=1</dc:subject>
+  <dc:date>2024-01-01T00:00:00Z</dc:date>
+  <dc:type>Place</dc:type>
+</item>
+"""
+
+
+def synthetic_rss(hits: int):
+    """Return a /search_rss response body with the given number of items."""
+    pids = [str(295000 + i) for i in range(hits)]
+    seq = "".join(
+        f'<rdf:li rdf:resource="https://pleiades.stoa.org/places/{pid}"/>'
+        for pid in pids
+    )
+    items = [
+        RSS_ITEM.format(
+            pid=pid,
+            title=escape(f"Place {pid}"),
+            description=escape(
+                f"Place {pid} was an ancient settlement of Mauretania Caesariensis "
+                "with Punic origins & a Roman colony founded by Augustus."
+            ),
+        )
+        for pid in pids
+    ]
+    return (RSS_HEAD.format(seq=seq) + "".join(items) + "</rdf:RDF>\n").encode("utf-8")
+
+
+def load_fixtures(sizes, fixtures_dir=DEFAULT_FIXTURES):
+    fixtures = dict()
+    for size in sizes:
+        path = fixtures_dir / f"search_rss_{size}.xml"
+        if path.exists():
+            fixtures[size] = path.read_bytes()
+        else:
+            logger.warning(f"No fixture {path}; using a synthetic response.")
+            fixtures[size] = synthetic_rss(size)
+    return fixtures
+
+
+def record_fixtures(sizes, fixtures_dir, user_agent: str):
+    """Save /search_rss responses with the given numbers of hits from Pleiades."""
+    si = SearchInterface(user_agent=user_agent)
+    fixtures_dir.mkdir(parents=True, exist_ok=True)
+    for size in sizes:
+        q = Query()
+        if size:
+            q.set_parameter("feature_type", "settlement")  # thousands of hits
+        else:
+            q.set_parameter("title", "hits-0")  # none
+        page = urlencode({"b_start": 0, "b_size": max(size, 1)})
+        uri = si._search_uri(f"{q.compile().encoded}&{page}")
+        r = si.get(uri)
+        if r.status_code != 200:
+            raise RuntimeError(f"Could not get {uri}: HTTP {r.status_code}")
+        hits = len(list(iter_rss_items([r.content])))
+        if hits != size:
+            logger.warning(f"Asked {uri} for {size} hits but got {hits}.")
+        (fixtures_dir / f"search_rss_{size}.xml").write_bytes(r.content)
+
+
+class StandInServer:
+    """Serve fixtures as /search_rss responses from a background thread."""
+
+    def __init__(self, fixtures: dict):
+        fixtures = dict(fixtures)
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path == "/robots.txt":
+                    body = b"User-agent: *\nDisallow:\n"
+                    content_type = "text/plain"
+                elif url.path == "/search_rss":
+                    title = parse_qs(url.query).get("Title", ["hits-0"])[0]
+                    try:
+                        body = fixtures[int(title.split("-")[-1])]
+                    except (KeyError, ValueError):
+                        self.send_error(404)
+                        return
+                    content_type = "text/xml; charset=utf-8"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("Cache-Control", "no-store")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.netloc = "{}:{}".format(*self.server.server_address)
+        self._thread = Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def timed(func, repeat: int, ops: int = 1):
+    """Call func repeat times; return timing statistics in seconds per operation."""
+    samples = list()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) / ops)
+    samples.sort()
+    return {
+        "repeat": repeat,
+        "ops": ops,
+        "min": samples[0],
+        "median": statistics.median(samples),
+        "mean": statistics.mean(samples),
+        "p95": samples[min(len(samples) - 1, int(0.95 * len(samples)))],
+        "ops_per_second": (
+            1.0 / statistics.median(samples) if statistics.median(samples) else None
+        ),
+    }
+
+
+def title_query(size: int):
+    q = Query()
+    q.set_parameter("title", f"hits-{size}")
+    return q
+
+
+def complex_query():
+    q = Query()
+    q.set_parameter("text", ["Punic", "Phoenician"], "OR")
+    q.set_parameter("tag", ["Cybele", "Kybele", "Magna Mater"], "OR")
+    q.set_parameter("feature_type", ["sanctuary", "temple-2"], "AND")
+    q.set_parameter("bbox", (27.5, 35.75, 28.3, 36.5))
+    return q
+
+
+def run(sizes, repeat: int, fixtures: dict, batch: int):
+    results = list()
+
+    def record(name, size, stats):
+        logger.info(f"{name} [{size}]: median {stats['median'] * 1000:.3f} ms")
+        results.append(dict(name=name, size=size, **stats))
+
+    # query compilation
+    record("compile", None, timed(lambda: complex_query().compile(), repeat * 50))
+    q = complex_query()
+    record("parameters_for_web", None, timed(lambda: q.parameters_for_web, repeat * 50))
+    web_parameters = q.parameters_for_web
+    record(
+        "prep_params",
+        None,
+        timed(lambda: encode_web_parameters(**web_parameters), repeat * 50),
+    )
+
+    with StandInServer(fixtures) as server:
+        si = SearchInterface(
+            user_agent=USER_AGENT,
+            scheme="http",
+            netloc=server.netloc,
+            respect_robots_txt=False,
+            expire_after=0,
+        )
+        for size in sizes:
+            body = fixtures[size]
+            text = body.decode("utf-8")
+            record("parse_feedparser", size, timed(lambda: si._parse_rss(text), repeat))
+            record(
+                "parse_streaming",
+                size,
+                timed(lambda: list(iter_rss_items([body])), repeat),
+            )
+            query = title_query(size)
+            record("search_serial", size, timed(lambda: si.search(query), repeat))
+            queries = [title_query(size) for _ in range(batch)]
+            # distinct queries, so that search_many cannot merge them
+            for i, bq in enumerate(queries):
+                bq.set_parameter("description", f"batch{i}")
+            record(
+                "search_many",
+                size,
+                timed(
+                    lambda: list(si.search_many(queries, max_workers=4)),
+                    repeat,
+                    ops=batch,
+                ),
+            )
+            asi = AsyncSearchInterface(max_in_flight=4, search_interface=si)
+            record(
+                "search_async",
+                size,
+                timed(lambda: asyncio.run(asi.search_many(queries)), repeat, ops=batch),
+            )
+            asyncio.run(asi.close())
+    return results
+
+
+def compare(results: list, baseline: list, tolerance: float):
+    """Return descriptions of benchmarks that are slower than baseline by more than tolerance."""
+    previous = {(r["name"], r["size"]): r for r in baseline}
+    regressions = list()
+    for r in results:
+        try:
+            before = previous[(r["name"], r["size"])]["median"]
+        except KeyError:
+            continue
+        if before and r["median"] > before * (1.0 + tolerance):
+            regressions.append(
+                f"{r['name']} [{r['size']}]: median {r['median'] * 1000:.3f} ms "
+                f"vs {before * 1000:.3f} ms"
+            )
+    return regressions
+
+
+def package_version():
+    try:
+        from importlib.metadata import version
+
+        return version("pleiades_search_api")
+    except Exception:
+        return None
+
+
+def main(**kwargs):
+    sizes = [int(s) for s in kwargs["sizes"].split(",")]
+    fixtures_dir = Path(kwargs["fixtures"])
+    if kwargs["record"]:
+        record_fixtures(sizes, fixtures_dir, kwargs["user_agent"])
+        return 0
+    fixtures = load_fixtures(sizes, fixtures_dir)
+    results = run(sizes, kwargs["repeat"], fixtures, kwargs["batch"])
+    report = {
+        "meta": {
+            "package_version": package_version(),
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "platform": platform.platform(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "repeat": kwargs["repeat"],
+            "batch": kwargs["batch"],
+        },
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if kwargs["output"] is None:
+        print(output)
+    else:
+        Path(kwargs["output"]).write_text(output + "\n", encoding="utf-8")
+    if kwargs["compare"] is not None:
+        baseline = json.loads(Path(kwargs["compare"]).read_text(encoding="utf-8"))
+        regressions = compare(results, baseline["results"], kwargs["tolerance"])
+        for regression in regressions:
+            logger.error(f"Regression: {regression}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    ap = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--sizes", default=",".join(str(s) for s in DEFAULT_SIZES))
+    ap.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    ap.add_argument("--batch", type=int, default=20, help="queries per batch")
+    ap.add_argument(
+        "--fixtures", default=str(DEFAULT_FIXTURES), help="directory of responses"
+    )
+    ap.add_argument(
+        "--record",
+        action="store_true",
+        help="save responses from Pleiades to the fixtures directory and exit",
+    )
+    ap.add_argument("--user-agent", default=USER_AGENT, help="for --record")
+    ap.add_argument("--output", default=None, help="write JSON results to this file")
+    ap.add_argument("--compare", default=None, help="baseline JSON results file")
+    ap.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    ap.add_argument("--verbose", action="store_true")
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    sys.exit(main(**vars(args)))
@@ -0,0 +1,109 @@
+#
+# This file is part of pleiades_search_api
+# by Tom Elliott for the Institute for the Study of the Ancient World
+# (c) Copyright 2024 by New York University
+# Licensed under the AGPL-3.0; see LICENSE.txt file.
+#
+"""
+Defines the AsyncSearchInterface class: search Pleiades from asyncio code
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import logging
+from pleiades_search_api.search import PLEIADES_NETLOC, Query, SearchInterface
+from pleiades_search_api.web import DEFAULT_USER_AGENT, SessionTransport
+
+DEFAULT_MAX_IN_FLIGHT = 4
+logger = logging.getLogger(__name__)
+
+
+class AsyncSearchInterface:
+    """Run many Pleiades searches concurrently from a single event loop.
+
+    All requests go through the Web layer of a wrapped SearchInterface, whose
+    transport is called from a small fixed pool of worker threads; no more
+    than max_in_flight requests are outstanding at any time. By default the
+    SearchInterface uses a web.SessionTransport, which keeps connections to
+    Pleiades alive between requests and enforces robots.txt and crawl-delay
+    across all the threads. A search_interface given instead must have a
+    transport that is safe to use from several threads at once, as
+    SessionTransport is.
+    """
+
+    def __init__(
+        self,
+        user_agent=DEFAULT_USER_AGENT,
+        max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+        search_interface: SearchInterface = None,
+    ):
+        if max_in_flight < 1:
+            raise ValueError(
+                f"max_in_flight must be a positive integer (got {max_in_flight})."
+            )
+        if search_interface is None:
+            transport = SessionTransport(
+                PLEIADES_NETLOC, user_agent=user_agent, pool_maxsize=max_in_flight
+            )
+            search_interface = SearchInterface(
+                user_agent=user_agent, transport=transport
+            )
+        self.search_interface = search_interface
+        self.max_in_flight = max_in_flight
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_in_flight, thread_name_prefix="pleiades_search"
+        )
+        self._semaphore = None
+        self._semaphore_loop = None
+
+    @property
+    def web(self):
+        """The politeness-aware web client shared by all requests."""
+        return self.search_interface.web
+
+    async def search(self, query: Query, timeout: float = None, deadline=None):
+        """Search Pleiades for the query (a Query or CompiledQuery).
+
+        As SearchInterface.search, with timeout and deadline bounding the search
+        once it has its turn to run.
+        """
+        async with self._in_flight():
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._executor,
+                partial(
+                    self.search_interface.search,
+                    query,
+                    timeout=timeout,
+                    deadline=deadline,
+                ),
+            )
+
+    async def search_many(self, queries, timeout: float = None, deadline=None):
+        """Search Pleiades for each of the queries; results are in query order.
+
+        timeout is a budget for each search; one deadline bounds them all.
+        """
+        return await asyncio.gather(
+            *[self.search(q, timeout, deadline) for q in queries]
+        )
+
+    async def close(self):
+        """Release the worker threads, waiting for them without blocking the loop."""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, partial(self._executor.shutdown, wait=True))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    def _in_flight(self):
+        # a semaphore belongs to the event loop that first uses it
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+            self._semaphore_loop = loop
+        return self._semaphore
@@ -0,0 +1,576 @@
+#
+# This file is part of pleiades_search_api
+# by Tom Elliott for the Institute for the Study of the Ancient World
+# (c) Copyright 2024 by New York University
+# Licensed under the AGPL-3.0; see LICENSE.txt file.
+#
+"""
+Caches for parsed search results
+"""
+
+from collections import OrderedDict
+import json
+import logging
+import os
+from pathlib import Path
+from pleiades_search_api.deadline import DeadlineExceeded
+from pleiades_search_api.results import decode_results, encode_results
+from pleiades_search_api.search import (
+    BBOX_SHAVE,
+    MAX_HITS,
+    hit_extent,
+    search_rss_uri,
+)
+import sqlite3
+from threading import Lock, get_ident
+import time
+from uuid import uuid4
+
+DEFAULT_LEASE = 30.0  # seconds a single-flight fetch may hold its key
+DEFAULT_MAXSIZE = 1024
+DEFAULT_POLL = 0.05  # seconds between checks while waiting on another fetch
+DEFAULT_TTL = 24 * 60 * 60  # seconds
+SQLITE_TIMEOUT = 60.0  # seconds to wait for another connection's lock
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """Bounded in-memory cache with least-recently-used eviction and expiry."""
+
+    def __init__(self, maxsize: int = DEFAULT_MAXSIZE, ttl: float = DEFAULT_TTL):
+        if maxsize < 1:
+            raise ValueError(f"maxsize must be a positive integer (got {maxsize}).")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key: str):
+        """Return the value cached for key, or None."""
+        with self._lock:
+            try:
+                expires, value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            if expires is not None and expires < time.time():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: str, value):
+        """Cache value for key."""
+        expires = None if self.ttl is None else time.time() + self.ttl
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Remove everything from the cache."""
+        with self._lock:
+            self._data.clear()
+
+    @property
+    def stats(self):
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class DiskCache:
+    """Persistent cache of JSON-serializable values in a SQLite file."""
+
+    def __init__(self, path, ttl: float = DEFAULT_TTL):
+        self.path = Path(path)
+        self.ttl = ttl
+        self._lock = Lock()
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS results "
+                "(key TEXT PRIMARY KEY, expires REAL, value TEXT NOT NULL)"
+            )
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def get(self, key: str):
+        """Return the value cached for key, or None."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT expires, value FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            expires, value = row
+            if expires is not None and expires < time.time():
+                with self._db:
+                    self._db.execute("DELETE FROM results WHERE key = ?", (key,))
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(value)
+
+    def put(self, key: str, value):
+        """Cache value for key."""
+        expires = None if self.ttl is None else time.time() + self.ttl
+        value = json.dumps(value, ensure_ascii=False)
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO results (key, expires, value) VALUES (?, ?, ?)",
+                (key, expires, value),
+            )
+
+    def clear(self):
+        """Remove everything from the cache."""
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM results")
+
+    @property
+    def stats(self):
+        return {
+            "size": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "expirations": self.expirations,
+        }
+
+
+class SharedCache:
+    """Cache of search results shared by every process on a host, in a SQLite WAL file.
+
+    Results are stored in the compact binary encoding of
+    results.encode_results. get_or_fetch gives single-flight misses: when
+    several threads or processes miss on the same key at once, one takes a
+    lease on the key and fetches, and the others wait for its result. A lease
+    lapses after lease seconds, so a crashed or stuck fetcher does not block
+    the others for longer than that. The cache can be made before worker
+    processes are forked: each process opens its own connection on first
+    use.
+    """
+
+    def __init__(
+        self,
+        path,
+        ttl: float = DEFAULT_TTL,
+        lease: float = DEFAULT_LEASE,
+        poll: float = DEFAULT_POLL,
+    ):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.lease = lease
+        self.poll = poll
+        self._lock = Lock()
+        self._db = None
+        self._pid = None
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.fetches = 0  # misses this process fetched
+        self.waits = 0  # misses this process waited on another to fetch
+
+    def __len__(self):
+        with self._lock:
+            return self._connect().execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def get(self, key: str):
+        """Return the results cached for key, or None."""
+        return self._get(key)
+
+    def _get(self, key: str, count: bool = True):
+        """Return the results cached for key, or None, counting a hit or miss if count."""
+        with self._lock:
+            db = self._connect()
+            row = db.execute(
+                "SELECT expires, value FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and row[0] is not None and row[0] < time.time():
+                db.execute(
+                    "DELETE FROM results WHERE key = ? AND expires = ?", (key, row[0])
+                )
+                self.expirations += 1
+                row = None
+            if count:
+                if row is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+        return None if row is None else decode_results(row[1])
+
+    def put(self, key: str, value):
+        """Cache results for key."""
+        expires = None if self.ttl is None else time.time() + self.ttl
+        value = encode_results(value)
+        with self._lock:
+            self._connect().execute(
+                "INSERT OR REPLACE INTO results (key, expires, value) VALUES (?, ?, ?)",
+                (key, expires, value),
+            )
+
+    def get_or_fetch(self, key: str, fetch, deadline=None):
+        """Return the results cached for key, or fetch, cache and return them.
+
+        fetch is called with no arguments, by only one caller at a time for
+        each key (across processes); other callers wait for its results, but
+        raise deadline.DeadlineExceeded if deadline (a deadline.Deadline)
+        passes while they wait. If fetch raises, the key is released and a
+        waiting caller fetches instead.
+        """
+        owner = f"{os.getpid()}:{get_ident()}:{uuid4().hex}"
+        waited = False
+        value = self.get(key)
+        while True:
+            if value is not None:
+                return value
+            if self._acquire(key, owner):
+                break
+            if not waited:
+                waited = True
+                self.waits += 1
+            if deadline is not None and deadline.remaining() <= self.poll:
+                raise DeadlineExceeded(f"Timed out waiting for another fetch of {key}")
+            time.sleep(self.poll)
+            value = self._get(key, count=False)  # the miss is already counted
+        try:
+            # the key's last holder may have finished between get and acquire
+            value = self._get(key, count=False)
+            if value is None:
+                self.fetches += 1
+                value = fetch()
+                self.put(key, value)
+            return value
+        finally:
+            self._release(key, owner)
+
+    def clear(self):
+        """Remove everything from the cache."""
+        with self._lock:
+            db = self._connect()
+            db.execute("DELETE FROM results")
+            db.execute("DELETE FROM leases")
+
+    @property
+    def stats(self):
+        return {
+            "size": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "expirations": self.expirations,
+            "fetches": self.fetches,
+            "waits": self.waits,
+        }
+
+    def _connect(self):
+        """Return this process's connection, opening it if need be (call under lock)."""
+        if self._db is None or self._pid != os.getpid():
+            # a connection inherited across fork must not be used
+            db = sqlite3.connect(
+                str(self.path),
+                timeout=SQLITE_TIMEOUT,
+                isolation_level=None,
+                check_same_thread=False,
+            )
+            _use_wal(db)
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS results "
+                "(key TEXT PRIMARY KEY, expires REAL, value BLOB NOT NULL)"
+            )
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS leases "
+                "(key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL)"
+            )
+            self._db = db
+            self._pid = os.getpid()
+        return self._db
+
+    def _acquire(self, key: str, owner: str):
+        """Take the lease on key for owner; return False if someone else holds it."""
+        now = time.time()
+        with self._lock:
+            db = self._connect()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                db.execute(
+                    "DELETE FROM leases WHERE key = ? AND expires < ?", (key, now)
+                )
+                taken = db.execute(
+                    "INSERT OR IGNORE INTO leases (key, owner, expires) VALUES (?, ?, ?)",
+                    (key, owner, now + self.lease),
+                ).rowcount
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return taken == 1
+
+    def _release(self, key: str, owner: str):
+        with self._lock:
+            self._connect().execute(
+                "DELETE FROM leases WHERE key = ? AND owner = ?", (key, owner)
+            )
+
+
+class ResultCache:
+    """Two-tier cache of search results: in-memory LRU in front of an optional disk tier.
+
+    Values found only on disk are promoted to memory. Either tier may be None.
+    """
+
+    def __init__(self, memory=None, disk=None):
+        if memory is None and disk is None:
+            memory = LRUCache()
+        self.memory = memory
+        self.disk = disk
+
+    def get(self, key: str):
+        """Return the results cached for key, or None."""
+        if self.memory is not None:
+            value = self.memory.get(key)
+            if value is not None:
+                return value
+        if self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                if self.memory is not None:
+                    self.memory.put(key, value)
+                return value
+        return None
+
+    def get_or_fetch(self, key: str, fetch, deadline=None):
+        """Return the results cached for key, or fetch and cache them.
+
+        With a disk tier that has get_or_fetch (SharedCache), misses are
+        single-flight across processes (see SharedCache.get_or_fetch).
+        """
+        if self.memory is not None:
+            value = self.memory.get(key)
+            if value is not None:
+                return value
+        if self.disk is None:
+            value = fetch()
+        elif hasattr(self.disk, "get_or_fetch"):
+            value = self.disk.get_or_fetch(key, fetch, deadline)
+        else:
+            value = self.disk.get(key)
+            if value is None:
+                value = fetch()
+                self.disk.put(key, value)
+        if self.memory is not None:
+            self.memory.put(key, value)
+        return value
+
+    def put(self, key: str, value):
+        """Cache results for key in every tier."""
+        if self.memory is not None:
+            self.memory.put(key, value)
+        if self.disk is not None:
+            self.disk.put(key, value)
+
+    def clear(self):
+        """Remove everything from every tier."""
+        for tier in [self.memory, self.disk]:
+            if tier is not None:
+                tier.clear()
+
+    @property
+    def stats(self):
+        return {
+            "memory": None if self.memory is None else self.memory.stats,
+            "disk": None if self.disk is None else self.disk.stats,
+        }
+
+
+class SpatialCache:
+    """Answer bbox searches from cached results for boxes that contain them.
+
+    Only complete results are kept: those under the MAX_HITS cap (or marked as
+    not truncated, as search_exhaustive does) whose hits all have coordinates,
+    and not marked with a "status" other than "complete" (as bounded searches
+    that timed out are). Error responses never reach the cache: searches
+    raise on them. Hits in /search_rss responses usually have no coordinates,
+    so put can be given a function to locate them (SearchInterface uses the
+    places' JSON documents).
+    The cached query boxes are indexed with an SQLite R-tree. A query whose box
+    lies inside a cached box and whose other parameters are the same is
+    answered by filtering the cached hits against the smaller box.
+    """
+
+    def __init__(self, maxsize: int = DEFAULT_MAXSIZE):
+        if maxsize < 1:
+            raise ValueError(f"maxsize must be a positive integer (got {maxsize}).")
+        self.maxsize = maxsize
+        self._lock = Lock()
+        self._db = sqlite3.connect(":memory:", check_same_thread=False)
+        self._db.execute(
+            "CREATE VIRTUAL TABLE boxes USING rtree(pk, minx, maxx, miny, maxy)"
+        )
+        self._entries = OrderedDict()  # pk -> (key, bounds, hits, extents)
+        self._next_pk = 1
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.rejections = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, query):
+        """Return results for a bbox query from a cached enclosing search, or None."""
+        try:
+            key, bounds = self._split(query)
+        except KeyError:
+            return None
+        with self._lock:
+            # the R-tree rounds outward, so confirm containment exactly
+            candidates = self._db.execute(
+                "SELECT pk FROM boxes WHERE minx <= ? AND maxx >= ? AND miny <= ? AND maxy >= ?",
+                (bounds[0], bounds[2], bounds[1], bounds[3]),
+            ).fetchall()
+            for (pk,) in candidates:
+                entry_key, entry_bounds, hits, extents = self._entries[pk]
+                if entry_key != key or not _contains(entry_bounds, bounds):
+                    continue
+                self._entries.move_to_end(pk)
+                self.hits += 1
+                break
+            else:
+                self.misses += 1
+                return None
+        return {
+            "query": search_rss_uri(query.compile().encoded),
+            "hits": [
+                hit for hit, extent in zip(hits, extents) if _intersects(extent, bounds)
+            ],
+        }
+
+    def put(self, query, results: dict, locate=None):
+        """Cache complete results of a bbox query; return True if they were kept.
+
+        locate, if given, is called with a list of the hits that have no
+        coordinates of their own and returns the extent (see hit_extent) of
+        each, or None where it cannot be found.
+        """
+        try:
+            key, bounds = self._split(query)
+        except KeyError:
+            return False
+        hits = results["hits"]
+        truncated = results.get("truncated", len(hits) >= MAX_HITS)
+        incomplete = results.get("status", "complete") != "complete"
+        extents = list()
+        if not (truncated or incomplete):
+            extents = [hit_extent(hit) for hit in hits]
+            missing = [i for i, extent in enumerate(extents) if extent is None]
+            if missing and locate is not None:
+                located = locate([hits[i] for i in missing])
+                for i, extent in zip(missing, located):
+                    extents[i] = extent
+        if truncated or incomplete or None in extents:
+            self.rejections += 1
+            return False
+        with self._lock:
+            pk = self._next_pk
+            self._next_pk += 1
+            self._entries[pk] = (key, bounds, list(hits), extents)
+            self._db.execute(
+                "INSERT INTO boxes (pk, minx, maxx, miny, maxy) VALUES (?, ?, ?, ?, ?)",
+                (pk, bounds[0], bounds[2], bounds[1], bounds[3]),
+            )
+            self.stores += 1
+            while len(self._entries) > self.maxsize:
+                old_pk, _ = self._entries.popitem(last=False)
+                self._db.execute("DELETE FROM boxes WHERE pk = ?", (old_pk,))
+                self.evictions += 1
+        return True
+
+    def clear(self):
+        """Remove everything from the cache."""
+        with self._lock:
+            self._entries.clear()
+            self._db.execute("DELETE FROM boxes")
+
+    @property
+    def stats(self):
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "rejections": self.rejections,
+            "evictions": self.evictions,
+        }
+
+    def _split(self, query):
+        """Return the canonical key of a query's other parameters and its searched box.
+
+        Raises KeyError if the query has no bbox.
+        """
+        bounds, _ = query.parameters["bbox"]
+        rest = query.copy()
+        rest.remove_parameter("bbox")
+        # Pleiades searches the shaved box, so compare shaved boxes
+        shaved = (
+            bounds[0] + BBOX_SHAVE,
+            bounds[1] + BBOX_SHAVE,
+            bounds[2] - BBOX_SHAVE,
+            bounds[3] - BBOX_SHAVE,
+        )
+        return rest.canonical_key, shaved
+
+
+def _contains(outer: tuple, inner: tuple):
+    return (
+        outer[0] <= inner[0]
+        and outer[1] <= inner[1]
+        and outer[2] >= inner[2]
+        and outer[3] >= inner[3]
+    )
+
+
+def _intersects(a: tuple, b: tuple):
+    return a[0] <= b[2] and a[2] >= b[0] and a[1] <= b[3] and a[3] >= b[1]
+
+
+def _use_wal(db):
+    """Switch a database to write-ahead logging.
+
+    SQLite does not wait out the lock the switch needs, so connections
+    opening a new database together have to retry.
+    """
+    give_up = time.monotonic() + SQLITE_TIMEOUT
+    while True:
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            return
+        except sqlite3.OperationalError:
+            if time.monotonic() >= give_up:
+                raise
+            time.sleep(0.01)
@@ -0,0 +1,290 @@
+#
+# This file is part of pleiades_search_api
+# by Tom Elliott for the Institute for the Study of the Ancient World
+# (c) Copyright 2024 by New York University
+# Licensed under the AGPL-3.0; see LICENSE.txt file.
+#
+"""
+Run searches in bulk: queries in as JSON lines, results out as JSON lines
+
+Each input line is a JSON object whose keys are Query parameter names
+(bbox, description, feature_type, tag, text, title). A value is either the
+parameter value itself or an object {"value": ..., "operator": "AND"|"OR"}.
+An optional "id" is copied to the output. Each output line holds the input
+"line" number (starting at 1), the "id" if given, and the search "query" URI
+and "hits", or an "error".
+"""
+
+from argparse import ArgumentParser
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+import json
+import logging
+import os
+from pathlib import Path
+from pleiades_search_api.ratelimit import RateLimiter
+from pleiades_search_api.search import (
+    DEFAULT_MAX_WORKERS,
+    PLEIADES_NETLOC,
+    Query,
+    SearchInterface,
+)
+from pleiades_search_api.web import DEFAULT_USER_AGENT, SessionTransport
+import sys
+
+DEFAULT_CHECKPOINT_EVERY = 100
+logger = logging.getLogger(__name__)
+_search_interface = None  # one per process, made by _init_worker
+
+
+def parse_query(record: dict):
+    """Return a Query for the parameters in a decoded input line."""
+    q = Query()
+    for name, value in record.items():
+        if name == "id":
+            continue
+        operator = None
+        if isinstance(value, dict):
+            operator = value.get("operator")
+            value = value["value"]
+        if name == "bbox":
+            value = tuple(value)
+        q.set_parameter(name, value, operator)
+    return q
+
+
+def search_line(line_number: int, text: str):
+    """Run the search on one input line; return the output record."""
+    result = {"line": line_number}
+    try:
+        record = json.loads(text)
+        if "id" in record:
+            result["id"] = record["id"]
+        results = _search_interface.search(parse_query(record))
+    except Exception as err:
+        result["error"] = f"{err.__class__.__name__}: {err}"
+    else:
+        result["query"] = results["query"]
+        result["hits"] = results["hits"]
+    return result
+
+
+def _init_worker(search_kwargs: dict, rate_limit_file=None):
+    global _search_interface
+    if rate_limit_file is not None:
+        search_kwargs = dict(search_kwargs)
+        search_kwargs["transport"] = SessionTransport(
+            PLEIADES_NETLOC,
+            user_agent=search_kwargs.get("user_agent", DEFAULT_USER_AGENT),
+            rate_limiter=RateLimiter(path=rate_limit_file),
+        )
+    _search_interface = SearchInterface(**search_kwargs)
+
+
+class Checkpoint:
+    """Record which input lines have been written, so an interrupted run can resume.
+
+    Lines are written at least once: after a crash, lines written since the
+    last save are run and written again.
+    """
+
+    def __init__(self, path=None):
+        self.path = None if path is None else Path(path)
+        self.done = 0  # every line up to and including this one is written
+        self.extra = set()  # lines written beyond done
+        if self.path is not None and self.path.exists():
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+            self.done = data["done"]
+            self.extra = set(data["extra"])
+
+    def __contains__(self, line_number: int):
+        return line_number <= self.done or line_number in self.extra
+
+    def add(self, line_number: int):
+        self.extra.add(line_number)
+        while self.done + 1 in self.extra:
+            self.done += 1
+            self.extra.remove(self.done)
+
+    def save(self):
+        if self.path is None:
+            return
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(
+            json.dumps({"done": self.done, "extra": sorted(self.extra)}),
+            encoding="utf-8",
+        )
+        os.replace(str(tmp), str(self.path))
+
+
+def run(
+    lines,
+    output,
+    workers: int = None,
+    processes: int = 0,
+    ordered: bool = True,
+    checkpoint: Checkpoint = None,
+    checkpoint_every: int = DEFAULT_CHECKPOINT_EVERY,
+    rate_limit_file=None,
+    **search_kwargs,
+):
+    """Search for each input line, writing a JSON line for each to output.
+
+    Searches are run on that many worker threads (DEFAULT_MAX_WORKERS if
+    not given). No more than twice as many searches as there are workers are
+    in flight (or waiting to be written, in order) at any time, so memory use
+    does not grow with the input. With processes, searches are run in that
+    many worker processes instead, each running one search at a time, and
+    giving workers as well is a ValueError; each process has its own
+    SearchInterface, and its own crawl-delay, unless a rate_limit_file is
+    given: all requests are then paced by one ratelimit.RateLimiter whose
+    state is shared through that file.
+    """
+    if processes and workers is not None:
+        raise ValueError(
+            "Give workers (threads) or processes, not both: "
+            "each worker process runs one search at a time."
+        )
+    if workers is None:
+        workers = DEFAULT_MAX_WORKERS
+    if checkpoint is None:
+        checkpoint = Checkpoint()
+    if processes:
+        executor = ProcessPoolExecutor(
+            max_workers=processes,
+            initializer=_init_worker,
+            initargs=(search_kwargs, rate_limit_file),
+        )
+        window = 2 * processes
+    else:
+        _init_worker(search_kwargs, rate_limit_file)
+        executor = ThreadPoolExecutor(max_workers=workers)
+        window = 2 * workers
+    pending = dict()  # future -> line number
+    finished = dict()  # line number -> result, waiting to be written in order
+    order = list()  # line numbers submitted, oldest first (ordered output only)
+    since_save = 0
+    inputs = enumerate(lines, start=1)
+    exhausted = False
+    with executor:
+        while True:
+            while not exhausted and len(pending) + len(finished) < window:
+                try:
+                    line_number, text = next(inputs)
+                except StopIteration:
+                    exhausted = True
+                    break
+                if line_number in checkpoint:
+                    continue
+                if not text.strip():
+                    checkpoint.add(line_number)
+                    continue
+                future = executor.submit(search_line, line_number, text)
+                pending[future] = line_number
+                if ordered:
+                    order.append(line_number)
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            ready = list()
+            for future in done:
+                finished[pending.pop(future)] = future.result()
+            if ordered:
+                while order and order[0] in finished:
+                    ready.append(finished.pop(order.pop(0)))
+            else:
+                ready = list(finished.values())
+                finished.clear()
+            for result in ready:
+                output.write(json.dumps(result, ensure_ascii=False) + "\n")
+                checkpoint.add(result["line"])
+            since_save += len(ready)
+            if since_save >= checkpoint_every:
+                output.flush()
+                checkpoint.save()
+                since_save = 0
+    output.flush()
+    checkpoint.save()
+
+
+def main(argv=None):
+    ap = ArgumentParser(prog="pleiades-search", description=__doc__.strip())
+    ap.add_argument("input", nargs="?", default="-", help="JSONL file (default stdin)")
+    ap.add_argument("-o", "--output", default="-", help="JSONL file (default stdout)")
+    ap.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=None,
+        help=f"threads (default {DEFAULT_MAX_WORKERS}; not with --processes)",
+    )
+    ap.add_argument(
+        "-p",
+        "--processes",
+        type=int,
+        default=0,
+        help="worker processes instead of threads, each running one search at a "
+        "time (not with --workers)",
+    )
+    ap.add_argument(
+        "--unordered", action="store_true", help="write results as they complete"
+    )
+    ap.add_argument("--checkpoint", default=None, help="file for resuming a run")
+    ap.add_argument("--checkpoint-every", type=int, default=DEFAULT_CHECKPOINT_EVERY)
+    ap.add_argument(
+        "--rate-limit-file",
+        default=None,
+        help="share an adaptive rate limit among all workers through this file",
+    )
+    ap.add_argument("--user-agent", default=None)
+    ap.add_argument("--verbose", action="store_true")
+    args = ap.parse_args(argv)
+    if args.processes and args.workers is not None:
+        ap.error("give --workers or --processes, not both")
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    search_kwargs = dict()
+    if args.user_agent is not None:
+        search_kwargs["user_agent"] = args.user_agent
+    checkpoint = Checkpoint(args.checkpoint)
+    if args.input == "-":
+        infile = sys.stdin
+    else:
+        infile = open(args.input, encoding="utf-8")
+    if args.output == "-":
+        outfile = sys.stdout
+    else:
+        # a resumed run adds to what the interrupted run wrote
+        outfile = open(
+            args.output,
+            "a" if checkpoint.done or checkpoint.extra else "w",
+            encoding="utf-8",
+        )
+    try:
+        run(
+            infile,
+            outfile,
+            workers=args.workers,
+            processes=args.processes,
+            ordered=not args.unordered,
+            checkpoint=checkpoint,
+            checkpoint_every=args.checkpoint_every,
+            rate_limit_file=args.rate_limit_file,
+            **search_kwargs,
+        )
+    except KeyboardInterrupt:
+        outfile.flush()
+        checkpoint.save()
+        return 130
+    finally:
+        for f in (infile, outfile):
+            if f not in (sys.stdin, sys.stdout):
+                f.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+#
+# This file is part of pleiades_search_api
+# by Tom Elliott for the Institute for the Study of the Ancient World
+# (c) Copyright 2024 by New York University
+# Licensed under the AGPL-3.0; see LICENSE.txt file.
+#
+"""
+Deadlines, jittered retries and hedged requests for bounding search latency
+"""
+
+from collections import deque
+import logging
+import random
+from threading import Lock
+import time
+
+DEFAULT_BACKOFF = 0.1  # seconds before the first retry (at most)
+DEFAULT_HEDGE_PERCENTILE = 95.0
+DEFAULT_HEDGE_WINDOW = 200  # latencies remembered
+DEFAULT_MAX_BACKOFF = 2.0
+DEFAULT_MIN_SAMPLES = 20
+DEFAULT_RETRIES = 2
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+logger = logging.getLogger(__name__)
+
+
+class DeadlineExceeded(TimeoutError):
+    """The time budget for a search ran out."""
+
+
+class Deadline:
+    """A point in time by which work has to be done.
+
+    One deadline can be shared by many searches (e.g. a whole batch), each of
+    which may also have a shorter budget of its own (see within).
+    """
+
+    def __init__(self, seconds: float):
+        self.expires = time.monotonic() + seconds
+
+    def remaining(self):
+        """Seconds left (never negative)."""
+        return max(0.0, self.expires - time.monotonic())
+
+    @property
+    def expired(self):
+        return time.monotonic() >= self.expires
+
+    def within(self, seconds: float = None):
+        """Return the earlier of this deadline and one seconds from now."""
+        if seconds is None or self.remaining() <= seconds:
+            return self
+        return Deadline(seconds)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.remaining():.3f} s left)"
+
+
+def make_deadline(seconds: float = None, deadline: Deadline = None):
+    """Return the earlier of seconds from now and deadline; either may be None."""
+    if deadline is None:
+        return None if seconds is None else Deadline(seconds)
+    return deadline.within(seconds)
+
+
+class RetryPolicy:
+    """Which failures to retry, how often, and how long to back off in between.
+
+    Requests raising one of exceptions (by default the requests library's
+    ConnectionError and Timeout) or answered with one of statuses are
+    retried up to retries times; a PermissionError (such as a robots.txt
+    disallow) is never retried. Before retry n (from 0)
+    the caller sleeps for a random time between 0 and
+    min(max_backoff, backoff * 2 ** n) ("full jitter"), so that clients
+    failing together do not retry together.
+    """
+
+    def __init__(
+        self,
+        retries: int = DEFAULT_RETRIES,
+        backoff: float = DEFAULT_BACKOFF,
+        max_backoff: float = DEFAULT_MAX_BACKOFF,
+        statuses=RETRY_STATUSES,
+        exceptions=None,
+    ):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.statuses = frozenset(statuses)
+        self._exceptions = None if exceptions is None else tuple(exceptions)
+
+    @property
+    def exceptions(self):
+        """The exception classes to retry."""
+        if self._exceptions is None:
+            # requests is slow to import, so it is not imported until needed
+            from requests import ConnectionError, Timeout
+
+            self._exceptions = (ConnectionError, Timeout)
+        return self._exceptions
+
+    def delay(self, attempt: int):
+        """Return the seconds to wait before retry number attempt (from 0)."""
+        return random.uniform(0.0, min(self.max_backoff, self.backoff * 2**attempt))
+
+
+NO_RETRY = RetryPolicy(retries=0)
+
+
+class Hedge:
+    """When to send a duplicate of a request that is taking too long.
+
+    A hedged request is sent once the first has been outstanding for longer
+    than the given percentile of recent request latencies (but no sooner
+    than min_delay); whichever response comes first is used. Until
+    min_samples latencies have been seen, requests are not hedged.
+    """
+
+    def __init__(
+        self,
+        percentile: float = DEFAULT_HEDGE_PERCENTILE,
+        min_samples: int = DEFAULT_MIN_SAMPLES,
+        window: int = DEFAULT_HEDGE_WINDOW,
+        min_delay: float = 0.0,
+    ):
+        if not 0.0 < percentile <= 100.0:
+            raise ValueError(f"percentile must be in (0, 100] (got {percentile}).")
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self._latencies = deque(maxlen=window)
+        self._lock = Lock()
+
+    def observe(self, seconds: float):
+        """Remember the latency of a completed request."""
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def delay(self):
+        """Return the seconds after which to hedge, or None if not (yet) hedging."""
+        with self._lock:
+            if len(self._latencies) < max(1, self.min_samples):
+                return None
+            latencies = sorted(self._latencies)
+        i = min(len(latencies) - 1, int(len(latencies) * self.percentile / 100.0))
+        return max(self.min_delay, latencies[i])
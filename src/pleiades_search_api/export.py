@@ -0,0 +1,281 @@
+#
+# This file is part of pleiades_search_api
+# by Tom Elliott for the Institute for the Study of the Ancient World
+# (c) Copyright 2024 by New York University
+# Licensed under the AGPL-3.0; see LICENSE.txt file.
+#
+"""
+Stream search hits to Arrow IPC, Parquet and newline-delimited GeoJSON files
+"""
+
+import json
+import logging
+from pathlib import Path
+
+DEFAULT_ROW_GROUP_SIZE = 10000
+QUERY_METADATA_KEY = "query"
+logger = logging.getLogger(__name__)
+
+
+class HitWriter:
+    """Write hits to a file a row group at a time.
+
+    Hits are taken from results dictionaries (write), from the (query,
+    results) tuples yielded by SearchInterface.search_many (write_many), or
+    from any iterable of hits, such as iter_search or paginate (write_hits).
+    No more than row_group_size hits are held before being written out. Each
+    row records the URI of the query it came from. Use as a context manager,
+    or call close when done.
+    """
+
+    def __init__(self, path, row_group_size: int = DEFAULT_ROW_GROUP_SIZE):
+        if row_group_size < 1:
+            raise ValueError(
+                f"row_group_size must be a positive integer (got {row_group_size})."
+            )
+        self.path = Path(path)
+        self.row_group_size = row_group_size
+        self.rows = 0  # hits written so far
+        self.query = None  # the query URI, while every hit has come from one query
+        self._started = False
+        self._buffer = list()  # (query, hit) tuples
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, results):
+        """Write the hits in a results dictionary (or results.ResultSet)."""
+        self.write_hits(results["hits"], results["query"])
+
+    def write_many(self, searches):
+        """Write the hits from each results dictionary or (query, results) tuple."""
+        for results in searches:
+            if isinstance(results, tuple):
+                results = results[1]
+            self.write(results)
+
+    def write_hits(self, hits, query: str = None):
+        """Write hits from an iterable, recording query as their query URI."""
+        if not self._started:
+            self.query = query
+            self._started = True
+        elif query != self.query:
+            self.query = None
+        for hit in hits:
+            self._buffer.append((query, hit))
+            if len(self._buffer) >= self.row_group_size:
+                self.flush()
+
+    def flush(self):
+        """Write out any buffered hits."""
+        if self._buffer:
+            self.rows += self._write_rows(self._buffer)
+            self._buffer = list()
+
+    def close(self):
+        """Write out any buffered hits and finish the file."""
+        self.flush()
+        self._close()
+
+    def _write_rows(self, rows: list):
+        """Write (query, hit) rows; return the number of hits written."""
+        raise NotImplementedError()
+
+    def _close(self):
+        raise NotImplementedError()
+
+
+class ArrowWriter(HitWriter):
+    """Write hits to an Arrow IPC file (or, with stream, an Arrow IPC stream).
+
+    Columns are id (int64), uri, title, summary, modified (string),
+    longitude, latitude (float64, from reprPoint), bbox (four float64s) and
+    query (dictionary-encoded string); missing values are null. Each row
+    group is written as one record batch. If every hit comes from one
+    search, pass its URI as query: it is then also kept in the schema's
+    metadata under "query", and is the query write_hits assumes. Needs
+    pyarrow.
+    """
+
+    def __init__(
+        self,
+        path,
+        row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+        stream: bool = False,
+        query: str = None,
+    ):
+        import pyarrow
+
+        super().__init__(path, row_group_size)
+        self.stream = stream
+        self._pa = pyarrow
+        self._schema = _arrow_schema(pyarrow)
+        self._query = query
+        if query is not None:
+            self._schema = self._schema.with_metadata({QUERY_METADATA_KEY: query})
+        self._writer = None
+
+    def write_hits(self, hits, query: str = None):
+        if self._query is not None:
+            if query is None:
+                query = self._query
+            elif query != self._query:
+                raise ValueError(
+                    f"This writer is for hits from {self._query} (got {query})."
+                )
+        super().write_hits(hits, query)
+
+    def _open(self):
+        ipc = self._pa.ipc
+        if self.stream:
+            return ipc.new_stream(str(self.path), self._schema)
+        return ipc.new_file(str(self.path), self._schema)
+
+    def _write_rows(self, rows: list):
+        if self._writer is None:
+            self._writer = self._open()
+        self._writer.write_batch(_record_batch(self._pa, self._schema, rows))
+        return len(rows)
+
+    def _close(self):
+        if self._writer is None:
+            self._writer = self._open()  # an empty file still has the schema
+        self._writer.close()
+
+
+class ParquetWriter(ArrowWriter):
+    """Write hits to a Parquet file, with the same columns as ArrowWriter.
+
+    Each row group is written as one Parquet row group. If every hit came
+    from the same query, its URI is also kept in the file's key-value
+    metadata under "query", whether or not it was given up front. Needs
+    pyarrow.
+    """
+
+    def __init__(
+        self,
+        path,
+        row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+        compression: str = "zstd",
+        query: str = None,
+    ):
+        import pyarrow.parquet
+
+        super().__init__(path, row_group_size, query=query)
+        self.compression = compression
+        self._pq = pyarrow.parquet
+
+    def _open(self):
+        return self._pq.ParquetWriter(
+            str(self.path), self._schema, compression=self.compression
+        )
+
+    def _write_rows(self, rows: list):
+        if self._writer is None:
+            self._writer = self._open()
+        batch = _record_batch(self._pa, self._schema, rows)
+        self._writer.write_table(
+            self._pa.Table.from_batches([batch]), row_group_size=len(rows)
+        )
+        return len(rows)
+
+    def _close(self):
+        if self._writer is None:
+            self._writer = self._open()
+        if self.query is not None and self._query is None:
+            self._writer.add_key_value_metadata({QUERY_METADATA_KEY: self.query})
+        self._writer.close()
+
+
+class GeoJSONSeqWriter(HitWriter):
+    """Write hits with coordinates as newline-delimited GeoJSON Features.
+
+    The geometry is a Point at the hit's reprPoint or, failing that, the
+    Polygon of its bbox; a bbox is also given as the Feature's bbox. Hits
+    without coordinates are not written, but counted in skipped. Properties
+    are id, uri, title, summary, modified (if known) and query.
+    """
+
+    def __init__(self, path, row_group_size: int = DEFAULT_ROW_GROUP_SIZE):
+        super().__init__(path, row_group_size)
+        self.skipped = 0
+        self._file = open(str(self.path), "w", encoding="utf-8")
+
+    def _write_rows(self, rows: list):
+        lines = list()
+        for query, hit in rows:
+            feature = geojson_feature(hit, query)
+            if feature is None:
+                self.skipped += 1
+            else:
+                lines.append(json.dumps(feature, ensure_ascii=False) + "\n")
+        self._file.writelines(lines)
+        return len(lines)
+
+    def _close(self):
+        self._file.close()
+
+
+def geojson_feature(hit, query: str = None):
+    """Return a GeoJSON Feature for a hit, or None if it has no coordinates."""
+    point = hit.get("reprPoint")
+    bbox = hit.get("bbox")
+    if point is not None:
+        geometry = {"type": "Point", "coordinates": list(point)}
+    elif bbox is not None:
+        minx, miny, maxx, maxy = bbox
+        geometry = {
+            "type": "Polygon",
+            "coordinates": [
+                [[minx, miny], [maxx, miny], [maxx, maxy], [minx, maxy], [minx, miny]]
+            ],
+        }
+    else:
+        return None
+    properties = {k: hit.get(k) for k in ("id", "uri", "title", "summary")}
+    if hit.get("modified"):
+        properties["modified"] = hit["modified"]
+    properties["query"] = query
+    feature = {"type": "Feature", "id": hit["id"], "geometry": geometry}
+    if bbox is not None:
+        feature["bbox"] = list(bbox)
+    feature["properties"] = properties
+    return feature
+
+
+def _arrow_schema(pa):
+    return pa.schema(
+        [
+            ("id", pa.int64()),
+            ("uri", pa.string()),
+            ("title", pa.string()),
+            ("summary", pa.string()),
+            ("modified", pa.string()),
+            ("longitude", pa.float64()),
+            ("latitude", pa.float64()),
+            ("bbox", pa.list_(pa.float64(), 4)),
+            ("query", pa.dictionary(pa.int32(), pa.string())),
+        ]
+    )
+
+
+def _record_batch(pa, schema, rows: list):
+    """Return a record batch for (query, hit) rows."""
+    columns = {name: list() for name in schema.names}
+    for query, hit in rows:
+        columns["id"].append(int(hit["id"]))
+        for k in ("uri", "title", "summary"):
+            columns[k].append(hit.get(k))
+        columns["modified"].append(hit.get("modified"))
+        point = hit.get("reprPoint")
+        columns["longitude"].append(None if point is None else point[0])
+        columns["latitude"].append(None if point is None else point[1])
+        bbox = hit.get("bbox")
+        columns["bbox"].append(None if bbox is None else list(bbox))
+        columns["query"].append(query)
+    return pa.record_batch(
+        [pa.array(columns[f.name], type=f.type) for f in schema], schema=schema
+    )
@@ -0,0 +1,282 @@
+#
+# This file is part of pleiades_search_api
+# by Tom Elliott for the Institute for the Study of the Ancient World
+# (c) Copyright 2024 by New York University
+# Licensed under the AGPL-3.0; see LICENSE.txt file.
+#
+"""
+Defines the LocalSearchInterface class: search a local copy of the Pleiades data
+"""
+
+import csv
+import gzip
+import json
+import logging
+from pathlib import Path
+import re
+import sqlite3
+from pleiades_search_api.search import (
+    BBOX_SHAVE,
+    Query,
+    search_rss_uri,
+)
+
+PLACE_URI_BASE = "https://pleiades.stoa.org/places/"
+logger = logging.getLogger(__name__)
+
+rx_markup = re.compile(r"<[^>]+>")
+rx_word = re.compile(r'"([^"]*)"?|[^\s"()]+')  # a quoted phrase, or a word
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS places (
+    pk INTEGER PRIMARY KEY,
+    id TEXT UNIQUE NOT NULL,
+    uri TEXT NOT NULL,
+    title TEXT NOT NULL,
+    description TEXT NOT NULL,
+    repr_point TEXT,
+    bbox TEXT
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS places_fts USING fts5(title, description, text);
+CREATE VIRTUAL TABLE IF NOT EXISTS places_rtree USING rtree(pk, minx, maxx, miny, maxy);
+CREATE TABLE IF NOT EXISTS place_tags (pk INTEGER NOT NULL, tag TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS place_tags_tag ON place_tags (tag, pk);
+CREATE TABLE IF NOT EXISTS place_feature_types (
+    pk INTEGER NOT NULL,
+    feature_type TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS place_feature_types_feature_type
+    ON place_feature_types (feature_type, pk);
+"""
+
+
+class LocalSearchInterface:
+    """Answer Query objects from a Pleiades places dump loaded into SQLite.
+
+    Title, description and full text are searched with FTS5, bounding boxes
+    with an R-tree, and tags and feature types with indexed tables. Results have
+    the same {"query", "hits"} shape as SearchInterface.search(), where "query"
+    is the URI the same search would use on the Pleiades website. No network
+    access is needed and there is no cap on the number of hits.
+    """
+
+    def __init__(self, path=":memory:"):
+        self.path = path
+        self.db = sqlite3.connect(str(path), check_same_thread=False)
+        self.db.executescript(SCHEMA)
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM places").fetchone()[0]
+
+    def load(self, path):
+        """Load a Pleiades places dump in JSON or CSV format (optionally gzipped)."""
+        path = Path(path)
+        suffixes = [s.lower() for s in path.suffixes]
+        opener = gzip.open if suffixes and suffixes[-1] == ".gz" else open
+        if ".json" in suffixes:
+            with opener(path, "rt", encoding="utf-8") as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                try:
+                    places = data["@graph"]
+                except KeyError:
+                    places = [data]
+            else:
+                places = data
+            return self.load_places(places)
+        elif ".csv" in suffixes:
+            with opener(path, "rt", encoding="utf-8", newline="") as f:
+                return self.load_places(
+                    self._place_from_csv_row(row) for row in csv.DictReader(f)
+                )
+        raise ValueError(f"Unsupported dump format for {path}. Expected JSON or CSV.")
+
+    def load_places(self, places):
+        """Load place dictionaries shaped like Pleiades place JSON; return the count."""
+        count = 0
+        with self.db:
+            for place in places:
+                self._load_place(place)
+                count += 1
+        logger.debug(f"Loaded {count} places into {self.path}")
+        return count
+
+    def search(self, query: Query):
+        """Search the local data for the query."""
+        clauses = list()
+        args = list()
+        fts = list()
+        for name, (value, operator) in sorted(query.parameters.items()):
+            if name == "bbox":
+                clauses.append(
+                    "places.pk IN (SELECT pk FROM places_rtree "
+                    "WHERE minx <= ? AND maxx >= ? AND miny <= ? AND maxy >= ?)"
+                )
+                args.extend(
+                    [
+                        value[2] - BBOX_SHAVE,
+                        value[0] + BBOX_SHAVE,
+                        value[3] - BBOX_SHAVE,
+                        value[1] + BBOX_SHAVE,
+                    ]
+                )
+            elif name in {"tag", "feature_type"}:
+                table, column = {
+                    "tag": ("place_tags", "tag"),
+                    "feature_type": ("place_feature_types", "feature_type"),
+                }[name]
+                values = [value] if isinstance(value, str) else value
+                if operator == "AND":
+                    groups = [[v] for v in values]
+                else:
+                    groups = [values]
+                for group in groups:
+                    marks = ", ".join(["?"] * len(group))
+                    clauses.append(
+                        f"places.pk IN (SELECT pk FROM {table} WHERE {column} IN ({marks}))"
+                    )
+                    args.extend(group)
+            else:
+                expression = self._fts_expression(value, operator)
+                if name == "text":
+                    fts.append(f"({expression})")
+                else:
+                    fts.append(f"{name} : ({expression})")
+        if fts:
+            clauses.append(
+                "places.pk IN (SELECT rowid FROM places_fts WHERE places_fts MATCH ?)"
+            )
+            args.append(" AND ".join(fts))
+        sql = "SELECT id, uri, title, description, repr_point, bbox FROM places"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY title, id"
+        hits = list()
+        for pid, uri, title, description, repr_point, bbox in self.db.execute(
+            sql, args
+        ):
+            hit = {"id": pid, "uri": uri, "title": title, "summary": description}
+            if repr_point is not None:
+                hit["reprPoint"] = json.loads(repr_point)
+            if bbox is not None:
+                hit["bbox"] = json.loads(bbox)
+            hits.append(hit)
+        uri = search_rss_uri(query.compile().encoded)
+        return {"query": uri, "hits": hits}
+
+    def _fts_expression(self, value, operator):
+        """Translate a Pleiades text search value into an FTS5 query expression.
+
+        Quoted text is searched as a phrase. Raises ValueError if there is
+        nothing to search for, or a NOT with no term before it.
+        """
+        if isinstance(value, list):
+            joiner = f" {operator} " if operator in {"AND", "OR"} else " AND "
+            return joiner.join([f"({self._fts_expression(v, None)})" for v in value])
+        terms = list()
+        for match in rx_word.finditer(value):
+            word = match.group(0)
+            phrase = match.group(1)
+            if phrase is None and word in {"AND", "OR", "NOT"}:
+                if terms and terms[-1] not in {"AND", "OR", "NOT"}:
+                    terms.append(word)
+                elif word == "NOT" and terms and terms[-1] == "AND":
+                    terms[-1] = "NOT"  # FTS5 spells "a AND NOT b" as "a NOT b"
+                elif word == "NOT":
+                    # FTS5 has no unary NOT, and dropping it would invert the search
+                    raise ValueError(f"NOT without a term before it in {repr(value)}.")
+                continue
+            if phrase is not None and not phrase.split():
+                continue
+            if terms and terms[-1] not in {"AND", "OR", "NOT"}:
+                terms.append("AND")
+            if phrase is not None:
+                terms.append('"{}"'.format(" ".join(phrase.split())))
+            elif word.endswith("*") and len(word) > 1:
+                terms.append('"{}" *'.format(word.rstrip("*").replace('"', '""')))
+            else:
+                terms.append('"{}"'.format(word.replace('"', '""')))
+        while terms and terms[-1] in {"AND", "OR", "NOT"}:
+            terms.pop()
+        if not terms:
+            raise ValueError(f"No searchable terms in {repr(value)}.")
+        return " ".join(terms)
+
+    def _load_place(self, place: dict):
+        pid = str(place["id"])
+        uri = place.get("uri") or PLACE_URI_BASE + pid
+        title = place.get("title") or ""
+        description = place.get("description") or ""
+        repr_point = place.get("reprPoint")
+        bbox = place.get("bbox")
+        previous = self.db.execute(
+            "SELECT pk FROM places WHERE id = ?", (pid,)
+        ).fetchone()
+        if previous is not None:
+            for table in [
+                "places_rtree",
+                "place_tags",
+                "place_feature_types",
+                "places",
+            ]:
+                self.db.execute(f"DELETE FROM {table} WHERE pk = ?", previous)
+            self.db.execute("DELETE FROM places_fts WHERE rowid = ?", previous)
+        cur = self.db.execute(
+            "INSERT INTO places "
+            "(id, uri, title, description, repr_point, bbox) VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                pid,
+                uri,
+                title,
+                description,
+                None if repr_point is None else json.dumps(list(repr_point)),
+                None if bbox is None else json.dumps(list(bbox)),
+            ),
+        )
+        pk = cur.lastrowid
+        text = [title, description, rx_markup.sub(" ", place.get("details") or "")]
+        for name in place.get("names") or []:
+            for k in ["romanized", "attested"]:
+                if name.get(k):
+                    text.append(name[k])
+        self.db.execute(
+            "INSERT INTO places_fts (rowid, title, description, text) VALUES (?, ?, ?, ?)",
+            (pk, title, description, " ".join(text)),
+        )
+        if bbox is not None:
+            self.db.execute(
+                "INSERT INTO places_rtree (pk, minx, maxx, miny, maxy) VALUES (?, ?, ?, ?, ?)",
+                (pk, bbox[0], bbox[2], bbox[1], bbox[3]),
+            )
+        self.db.executemany(
+            "INSERT INTO place_tags (pk, tag) VALUES (?, ?)",
+            [(pk, tag) for tag in set(place.get("subject") or [])],
+        )
+        self.db.executemany(
+            "INSERT INTO place_feature_types (pk, feature_type) VALUES (?, ?)",
+            [(pk, ft) for ft in set(place.get("placeTypes") or [])],
+        )
+
+    def _place_from_csv_row(self, row: dict):
+        """Convert a row of the Pleiades places CSV dump to the JSON place shape."""
+        place = {
+            "id": row["id"],
+            "title": row.get("title", ""),
+            "description": row.get("description", ""),
+            "subject": _split_csv_list(row.get("tags") or row.get("subject")),
+            "placeTypes": _split_csv_list(row.get("featureTypes")),
+        }
+        if row.get("uri"):
+            place["uri"] = row["uri"]
+        bbox = _split_csv_list(row.get("bbox"))
+        precision = row.get("locationPrecision", "precise") or "precise"
+        if len(bbox) == 4 and precision == "precise":
+            place["bbox"] = [float(v) for v in bbox]
+            if row.get("reprLong") and row.get("reprLat"):
+                place["reprPoint"] = [float(row["reprLong"]), float(row["reprLat"])]
+        return place
+
+
+def _split_csv_list(value):
+    if not value:
+        return list()
+    return [v.strip() for v in value.split(",") if v.strip()]
@@ -0,0 +1,167 @@
+#
+# This file is part of pleiades_search_api
+# by Tom Elliott for the Institute for the Study of the Ancient World
+# (c) Copyright 2024 by New York University
+# Licensed under the AGPL-3.0; see LICENSE.txt file.
+#
+"""
+Counters, latency histograms and hooks for instrumenting searches
+"""
+
+from bisect import bisect_left
+from contextlib import nullcontext
+import logging
+from threading import Lock
+import time
+
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)  # upper bounds in seconds; anything slower lands in a final overflow bucket
+NO_PHASE = nullcontext()
+logger = logging.getLogger(__name__)
+
+
+def phase(metrics, name: str):
+    """Return a context manager timing a phase, or a shared no-op if metrics is None."""
+    if metrics is None:
+        return NO_PHASE
+    return metrics.phase(name)
+
+
+class Histogram:
+    """Latency histogram with fixed bucket upper bounds."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def quantile(self, q: float):
+        """Estimate a quantile (0 to 1) as the upper bound of the bucket it falls in."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return self.buckets[i] if i < len(self.buckets) else self.max
+        return self.max
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min,
+            "max": self.max,
+            "mean": self.sum / self.count if self.count else None,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "buckets": {
+                str(bound): n for bound, n in zip(self.buckets + ("inf",), self.counts)
+            },
+        }
+
+
+class Metrics:
+    """Thread-safe counters and latency histograms, with optional hooks.
+
+    Hooks are callables taking (kind, name, value), where kind is "count" or
+    "observe"; they are called for every update, after it has been recorded.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counters = dict()
+        self.histograms = dict()
+        self.hooks = list()
+        self._lock = Lock()
+
+    def add_hook(self, hook):
+        """Register a callable to be told about every update."""
+        self.hooks.append(hook)
+
+    def count(self, name: str, n=1):
+        """Add n to the named counter."""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+        if self.hooks:
+            self._call_hooks("count", name, n)
+
+    def observe(self, name: str, seconds: float):
+        """Record a duration in the named histogram."""
+        with self._lock:
+            try:
+                histogram = self.histograms[name]
+            except KeyError:
+                histogram = self.histograms[name] = Histogram(self.buckets)
+            histogram.observe(seconds)
+        if self.hooks:
+            self._call_hooks("observe", name, seconds)
+
+    def phase(self, name: str):
+        """Return a context manager that records its duration in the named histogram."""
+        return _Phase(self, name)
+
+    def snapshot(self):
+        """Return a dictionary of the current counters and histogram summaries."""
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "histograms": {k: h.snapshot() for k, h in self.histograms.items()},
+            }
+
+    def reset(self):
+        """Forget all counters and histograms (hooks are kept)."""
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def _call_hooks(self, kind, name, value):
+        for hook in self.hooks:
+            try:
+                hook(kind, name, value)
+            except Exception:
+                logger.exception(f"Metrics hook {hook!r} failed")
+
+
+class _Phase:
+    __slots__ = ("metrics", "name", "start")
+
+    def __init__(self, metrics: Metrics, name: str):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+        return False
@@ -0,0 +1,171 @@
+#
+# This file is part of pleiades_search_api
+# by Tom Elliott for the Institute for the Study of the Ancient World
+# (c) Copyright 2024 by New York University
+# Licensed under the AGPL-3.0; see LICENSE.txt file.
+#
+"""
+Re-run saved queries, reporting only the hits that changed since the last run
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha1
+import json
+import logging
+from pathlib import Path
+from pleiades_search_api.search import DEFAULT_MAX_WORKERS, Query, SearchInterface
+
+logger = logging.getLogger(__name__)
+
+
+class QueryMonitor:
+    """Watch saved queries and report added, removed and changed hits.
+
+    For each query the monitor keeps the HTTP validators (ETag and
+    Last-Modified) of the last response, a fingerprint of its body and the
+    hits it held. Re-runs send conditional requests: a 304 response, or a
+    body with the same fingerprint, is reported as unchanged without being
+    parsed. State is kept in a JSON file if a path is given.
+    """
+
+    def __init__(self, search_interface: SearchInterface = None, path=None, **kwargs):
+        """Pass a SearchInterface to share, or keyword arguments to make one."""
+        if search_interface is None:
+            search_interface = SearchInterface(**kwargs)
+        self.search_interface = search_interface
+        self.path = None if path is None else Path(path)
+        self.watches = dict()  # name -> state
+        if self.path is not None and self.path.exists():
+            self.load()
+
+    def watch(self, name: str, query: Query):
+        """Save a query under a name, forgetting any earlier results for that name."""
+        parameters = dict()
+        for k, (value, operator) in query.parameters.items():
+            parameters[k] = [
+                list(value) if isinstance(value, tuple) else value,
+                operator,
+            ]
+        self.watches[name] = {
+            "parameters": parameters,
+            "etag": None,
+            "last_modified": None,
+            "fingerprint": None,
+            "hits": None,
+        }
+
+    def unwatch(self, name: str):
+        """Stop watching the named query."""
+        del self.watches[name]
+
+    def query(self, name: str):
+        """Return the named query."""
+        q = Query()
+        for k, (value, operator) in self.watches[name]["parameters"].items():
+            if k == "bbox":
+                value = tuple(value)
+            q.set_parameter(k, value, operator)
+        return q
+
+    def check(self, name: str):
+        """Re-run the named query and return what changed since the last run.
+
+        The report has the query "name", its "uri", a "status" ("new" on the
+        first run, then "changed" or "unchanged") and lists of "added",
+        "removed" and "changed" hits (for changed hits, their new version).
+        """
+        report = self._update(name, self._fetch(name))
+        if self.path is not None:
+            self.save()
+        return report
+
+    def check_all(self, max_workers: int = DEFAULT_MAX_WORKERS):
+        """Re-run every saved query, yielding a report for each (see check).
+
+        A query that cannot be checked does not stop the others: its report
+        has the status "error" and the reason as "error". The state is saved
+        even if not every report is read.
+        """
+        names = list(self.watches)
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = [executor.submit(self._fetch, name) for name in names]
+                for name, future in zip(names, futures):
+                    try:
+                        report = self._update(name, future.result())
+                    except (OSError, RuntimeError) as err:
+                        logger.warning(f"Could not check {name}: {err}")
+                        report = self._report(name, self._uri(name), "error")
+                        report["error"] = str(err)
+                    yield report
+        finally:
+            if self.path is not None:
+                self.save()
+
+    def load(self):
+        """Read saved queries and their state from the JSON file."""
+        self.watches = json.loads(self.path.read_text(encoding="utf-8"))
+
+    def save(self):
+        """Write saved queries and their state to the JSON file."""
+        self.path.write_text(
+            json.dumps(self.watches, ensure_ascii=False), encoding="utf-8"
+        )
+
+    def _fetch(self, name: str):
+        """Make a conditional request for the named query; return (uri, response)."""
+        si = self.search_interface
+        state = self.watches[name]
+        uri = self._uri(name)
+        headers = dict()
+        if state["hits"] is not None:
+            if state["etag"]:
+                headers["If-None-Match"] = state["etag"]
+            if state["last_modified"]:
+                headers["If-Modified-Since"] = state["last_modified"]
+        return uri, si.get(uri, headers=headers or None)
+
+    def _uri(self, name: str):
+        return self.search_interface._search_uri(self.query(name).compile().encoded)
+
+    def _report(self, name: str, uri: str, status: str):
+        return {
+            "name": name,
+            "uri": uri,
+            "status": status,
+            "added": [],
+            "removed": [],
+            "changed": [],
+        }
+
+    def _update(self, name: str, fetched):
+        uri, r = fetched
+        state = self.watches[name]
+        report = self._report(name, uri, "unchanged")
+        if r.status_code == 304:
+            return report
+        if r.status_code != 200:
+            raise RuntimeError(f"Could not get {uri}: HTTP {r.status_code}")
+        fingerprint = sha1(r.content).hexdigest()
+        first = state["hits"] is None
+        state["etag"] = r.headers.get("ETag")
+        state["last_modified"] = r.headers.get("Last-Modified")
+        if fingerprint == state["fingerprint"]:
+            return report
+        hits = {hit["id"]: hit for hit in self.search_interface._parse_rss(r.text)}
+        previous = state["hits"] or dict()
+        report["status"] = "new" if first else "changed"
+        for pid, hit in hits.items():
+            try:
+                before = previous[pid]
+            except KeyError:
+                report["added"].append(hit)
+            else:
+                if before != hit:
+                    report["changed"].append(hit)
+        report["removed"] = [hit for pid, hit in previous.items() if pid not in hits]
+        if not (first or report["added"] or report["removed"] or report["changed"]):
+            report["status"] = "unchanged"
+        state["fingerprint"] = fingerprint
+        state["hits"] = hits
+        return report
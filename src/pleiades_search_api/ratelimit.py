@@ -0,0 +1,189 @@
+#
+# This file is part of pleiades_search_api
+# by Tom Elliott for the Institute for the Study of the Ancient World
+# (c) Copyright 2024 by New York University
+# Licensed under the AGPL-3.0; see LICENSE.txt file.
+#
+"""
+Adaptive token-bucket rate limiting, shared by threads and processes
+"""
+
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+import json
+import logging
+from pathlib import Path
+from threading import Lock
+import time
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+DEFAULT_DECREASE = 0.5
+DEFAULT_INCREASE = 0.05  # requests per second, per successful request
+DEFAULT_MIN_RATE = 0.05  # requests per second
+THROTTLE_STATUSES = {429, 503}
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """Token bucket with an AIMD-adjusted rate, optionally shared through a file.
+
+    Callers take a token with acquire() before each request, and tell the
+    limiter how it went with record(). The rate (requests per second) is
+    increased by increase after each successful request, up to max_rate, and
+    multiplied by decrease (at most once per request interval) after a 429
+    or 503 response or a response slower than latency_target. A Retry-After
+    header (seconds or an HTTP date) holds back all requests for that long.
+
+    If max_rate is not given it is seeded (see seed) from the crawl-delay in
+    robots.txt, so the limiter never goes faster than the site asks. With a
+    path, the bucket's state is kept in that file and shared, under an
+    exclusive lock, by every limiter (in any process) using the same path;
+    without one, it is shared by the threads using this limiter.
+    """
+
+    def __init__(
+        self,
+        max_rate: float = None,
+        burst: float = 1.0,
+        min_rate: float = DEFAULT_MIN_RATE,
+        increase: float = DEFAULT_INCREASE,
+        decrease: float = DEFAULT_DECREASE,
+        latency_target: float = None,
+        path=None,
+    ):
+        if not 0.0 < decrease < 1.0:
+            raise ValueError(f"decrease must be between 0 and 1 (got {decrease}).")
+        self.max_rate = max_rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_target = latency_target
+        self.path = None if path is None else Path(path)
+        if self.path is not None and fcntl is None:
+            logger.warning(
+                "File locking is not available on this platform; "
+                f"{self.path} is not shared with other processes."
+            )
+        self._lock = Lock()
+        self._state = None
+
+    @property
+    def rate(self):
+        """The current rate in requests per second (None until seeded)."""
+        with self._locked() as state:
+            return state["rate"]
+
+    def seed(self, crawl_delay: float):
+        """Set max_rate from a crawl-delay (seconds) if it has not been given."""
+        if self.max_rate is None:
+            self.max_rate = float("inf") if crawl_delay <= 0 else 1.0 / crawl_delay
+        with self._locked() as state:
+            self._start(state)
+
+    def acquire(self):
+        """Take a token, sleeping until one is available; return the seconds slept."""
+        if self.max_rate is None:
+            raise RuntimeError("RateLimiter needs a max_rate or a seed().")
+        with self._locked() as state:
+            self._start(state)
+            if state["rate"] == float("inf"):
+                return 0.0
+            self._refill(state)
+            # take the token now, even if it has yet to accrue, so that
+            # waiting callers are served in turn
+            wait = (
+                0.0
+                if state["tokens"] >= 1.0
+                else (1.0 - state["tokens"]) / state["rate"]
+            )
+            state["tokens"] -= 1.0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def record(self, status: int, latency: float, retry_after=None):
+        """Adjust the rate after a response with status that took latency seconds."""
+        with self._locked() as state:
+            if state["rate"] is None or state["rate"] == float("inf"):
+                return
+            self._refill(state)
+            now = time.time()
+            slow = self.latency_target is not None and latency > self.latency_target
+            if status in THROTTLE_STATUSES or slow:
+                if now - state["decreased"] >= 1.0 / state["rate"]:
+                    state["rate"] = max(self.min_rate, state["rate"] * self.decrease)
+                    state["decreased"] = now
+                    logger.info(
+                        f"Slowing to {state['rate']:.3f} requests/s "
+                        f"(HTTP {status}, {latency:.2f} s)"
+                    )
+                if status in THROTTLE_STATUSES:
+                    state["tokens"] = min(state["tokens"], 0.0)
+                    seconds = _retry_after_seconds(retry_after)
+                    if seconds:
+                        state["tokens"] = min(state["tokens"], -seconds * state["rate"])
+            elif status < 400:
+                state["rate"] = min(self.max_rate, state["rate"] + self.increase)
+
+    def _start(self, state: dict):
+        """Start a new bucket full, at max_rate."""
+        if state["rate"] is None:
+            state["rate"] = self.max_rate
+            state["tokens"] = self.burst
+            state["updated"] = time.time()
+
+    def _refill(self, state: dict):
+        now = time.time()
+        state["tokens"] = min(
+            self.burst, state["tokens"] + (now - state["updated"]) * state["rate"]
+        )
+        state["updated"] = now
+
+    @contextmanager
+    def _locked(self):
+        """Yield the bucket's state for reading and updating, under lock."""
+        with self._lock:
+            if self.path is None:
+                if self._state is None:
+                    self._state = _new_state()
+                yield self._state
+                return
+            with open(str(self.path), "a+", encoding="utf-8") as f:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.seek(0)
+                    text = f.read()
+                    state = json.loads(text) if text.strip() else _new_state()
+                    yield state
+                    f.seek(0)
+                    f.truncate()
+                    f.write(json.dumps(state))
+                    f.flush()
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _new_state():
+    return {"rate": None, "tokens": 0.0, "updated": time.time(), "decreased": 0.0}
+
+
+def _retry_after_seconds(value):
+    """Return the seconds to wait given a Retry-After header value, or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
@@ -0,0 +1,227 @@
+#
+# This file is part of pleiades_search_api
+# by Tom Elliott for the Institute for the Study of the Ancient World
+# (c) Copyright 2024 by New York University
+# Licensed under the AGPL-3.0; see LICENSE.txt file.
+#
+"""
+Reconcile place names against Pleiades, answering from a local index where possible
+"""
+
+from collections import Counter
+from itertools import islice
+import logging
+from pleiades_search_api.search import DEFAULT_MAX_WORKERS, Query, SearchInterface
+from pleiades_search_api.text import normtext
+import unicodedata
+
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_MIN_SIMILARITY = 0.5
+MAX_CANDIDATES = 10
+logger = logging.getLogger(__name__)
+
+
+def name_key(name: str):
+    """Normalize a name for matching: normtext, casefolded, without diacritics."""
+    decomposed = unicodedata.normalize("NFKD", normtext(name).casefold())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def trigrams(key: str):
+    """Return the set of character trigrams of a normalized name, padded at the ends."""
+    padded = f"  {key} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+class Reconciler:
+    """Match place names to Pleiades places from a local index of titles and names.
+
+    Names are looked up by exact normalized match, then by trigram
+    similarity. Names the index cannot answer exactly are searched on
+    Pleiades by title, in batches through SearchInterface.search_many, and
+    what comes back (including "no hits") is added to the index, so repeated
+    and related names are answered locally.
+    """
+
+    def __init__(
+        self,
+        search_interface: SearchInterface = None,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        min_similarity: float = DEFAULT_MIN_SIMILARITY,
+        **kwargs,
+    ):
+        """Pass a SearchInterface to share, or keyword arguments to make one."""
+        if search_interface is None:
+            search_interface = SearchInterface(**kwargs)
+        if batch_size < 1:
+            raise ValueError(
+                f"batch_size must be a positive integer (got {batch_size})."
+            )
+        self.search_interface = search_interface
+        self.max_workers = max_workers
+        self.batch_size = batch_size
+        self.min_similarity = min_similarity
+        self.places = dict()  # place id -> {"id", "uri", "title"}
+        self.names = dict()  # name key -> set of place ids
+        self.trigrams = dict()  # trigram -> set of name keys
+        self.searched = dict()  # name key -> ids of the matches a search found
+        self.local_answers = 0
+        self.searches = 0
+
+    def __len__(self):
+        return len(self.places)
+
+    def add(self, hit: dict, names=None):
+        """Index a hit (or place) under its title and any other names.
+
+        Names are taken from names, or else from the hit's "names" (as added by
+        SearchInterface.enrich_hits).
+        """
+        pid = hit["id"]
+        self.places[pid] = {
+            "id": pid,
+            "uri": hit.get("uri", f"https://pleiades.stoa.org/places/{pid}"),
+            "title": hit["title"],
+        }
+        if names is None:
+            names = hit.get("names") or []
+        for name in [hit["title"]] + list(names):
+            key = name_key(name)
+            if not key:
+                continue
+            try:
+                self.names[key].add(pid)
+            except KeyError:
+                self.names[key] = {pid}
+                for trigram in trigrams(key):
+                    self.trigrams.setdefault(trigram, set()).add(key)
+
+    def add_places(self, places):
+        """Index place JSON documents (as in the Pleiades data dumps)."""
+        for place in places:
+            names = list()
+            for name in place.get("names") or []:
+                for k in ["romanized", "attested"]:
+                    names.extend(n for n in (name.get(k) or "").split(",") if n.strip())
+            self.add(place, names)
+
+    def match(self, name: str):
+        """Return matches for a name from the local index only (best first)."""
+        key = name_key(name)
+        try:
+            return self._matches(self.names[key], key)
+        except KeyError:
+            return self._similar(key)
+
+    def reconcile(self, names):
+        """Reconcile names, yielding (name, result) tuples in the order given.
+
+        Each result is a dictionary with the "matches" (dictionaries of place
+        id, uri, title and similarity score, best first) and their "source":
+        "index" for an exact local match, "search" if the name was searched
+        on Pleiades (now or before), "similar" for local candidates found by
+        similarity once a search found nothing, or None if nothing matched.
+        Names are read lazily, batch_size at a time.
+        """
+        names = iter(names)
+        while True:
+            batch = list(islice(names, self.batch_size))
+            if not batch:
+                return
+            keys = [name_key(name) for name in batch]
+            misses = dict()  # name key -> name to search for
+            for name, key in zip(batch, keys):
+                if key and key not in self.names and key not in self.searched:
+                    misses.setdefault(key, normtext(name))
+            if misses:
+                self._search(misses)
+            for name, key in zip(batch, keys):
+                yield name, self._result(key, key in misses)
+
+    @property
+    def stats(self):
+        return {
+            "places": len(self.places),
+            "names": len(self.names),
+            "searched": len(self.searched),
+            "local_answers": self.local_answers,
+            "searches": self.searches,
+        }
+
+    def _result(self, key: str, searched: bool = False):
+        """Return the result for a name key (searched: it was just searched)."""
+        if not key:
+            return {"matches": [], "source": None}
+        if not searched:
+            self.local_answers += 1
+            if key in self.names:
+                return {
+                    "matches": self._matches(self.names[key], key),
+                    "source": "index",
+                }
+        ids = self.names.get(key, set()) | set(self.searched.get(key, ()))
+        if ids:
+            return {"matches": self._matches(ids, key), "source": "search"}
+        matches = self._similar(key)
+        return {"matches": matches, "source": "similar" if matches else None}
+
+    def _search(self, misses: dict):
+        """Search Pleiades by title for names and index what comes back."""
+        queries = dict()
+        for key, name in misses.items():
+            q = Query()
+            q.set_parameter("title", name)
+            queries[q] = key
+        for q, results in self.search_interface.search_many(
+            queries, max_workers=self.max_workers
+        ):
+            key = queries[q]
+            self.searches += 1
+            ids = list()
+            for hit in results["hits"]:
+                self.add(hit)
+                # a title search also finds titles that merely contain the name
+                if _similarity(trigrams(key), trigrams(name_key(hit["title"]))) >= (
+                    self.min_similarity
+                ):
+                    ids.append(hit["id"])
+            self.searched[key] = ids
+
+    def _matches(self, ids, key: str):
+        """Return the places for ids, scored by name (1.0) or title similarity."""
+        target = trigrams(key)
+        exact = self.names.get(key, ())
+        matches = list()
+        for pid in ids:
+            place = self.places[pid]
+            if pid in exact:
+                score = 1.0
+            else:
+                score = _similarity(target, trigrams(name_key(place["title"])))
+            matches.append(dict(place, score=score))
+        matches.sort(key=lambda m: (-m["score"], m["title"]))
+        return matches
+
+    def _similar(self, key: str):
+        """Return places with names similar to key, by trigram (Jaccard) similarity."""
+        target = trigrams(key)
+        counts = Counter()
+        for trigram in target:
+            counts.update(self.trigrams.get(trigram, ()))
+        scores = dict()
+        for candidate, shared in counts.most_common(MAX_CANDIDATES * 10):
+            score = shared / (len(target) + len(trigrams(candidate)) - shared)
+            if score < self.min_similarity:
+                continue
+            for pid in self.names[candidate]:
+                scores[pid] = max(score, scores.get(pid, 0.0))
+        matches = [dict(self.places[pid], score=score) for pid, score in scores.items()]
+        matches.sort(key=lambda m: (-m["score"], m["title"]))
+        return matches[:MAX_CANDIDATES]
+
+
+def _similarity(a: set, b: set):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
@@ -0,0 +1,402 @@
+#
+# This file is part of pleiades_search_api
+# by Tom Elliott for the Institute for the Study of the Ancient World
+# (c) Copyright 2024 by New York University
+# Licensed under the AGPL-3.0; see LICENSE.txt file.
+#
+"""
+Compact, column-backed search results
+"""
+
+from array import array
+from collections.abc import Mapping, Sequence
+import json
+import logging
+import math
+import struct
+import sys
+import zlib
+
+ENCODING_VERSION = 1  # of encode_results
+PLACES_URI = "https://pleiades.stoa.org/places/"
+logger = logging.getLogger(__name__)
+
+# flags and layouts for encode_results
+_ID_STR = 1  # id is not a plain integer, so stored as a string
+_URI = 2  # uri is the usual place URI for the id
+_TITLE = 4
+_SUMMARY = 8
+_POINT = 16
+_BBOX = 32
+_MODIFIED = 64
+_EXTRA = 128  # other fields, stored as JSON
+_HEADER = struct.Struct("<BI")
+_HIT = struct.Struct("<QB")
+_LENGTH = struct.Struct("<I")
+_POINT_STRUCT = struct.Struct("<2d")
+_BBOX_STRUCT = struct.Struct("<4d")
+_STRING_FIELDS = ((_TITLE, "title"), (_SUMMARY, "summary"), (_MODIFIED, "modified"))
+_COORDINATE_FIELDS = (
+    (_POINT, "reprPoint", _POINT_STRUCT),
+    (_BBOX, "bbox", _BBOX_STRUCT),
+)
+
+
+class Hit(Mapping):
+    """A single search hit with an integer id, readable like a hit dictionary.
+
+    hit["id"] is the id as a string, as in hit dictionaries; hit.id is the
+    integer. Fields other than id, uri, title and summary (reprPoint, bbox,
+    modified, and any added by enrichment) are kept in extra.
+    """
+
+    __slots__ = ("id", "uri", "title", "summary", "extra")
+
+    def __init__(self, id: int, uri: str, title: str, summary: str, extra=None):
+        self.id = id
+        self.uri = uri
+        self.title = title
+        self.summary = summary
+        self.extra = extra
+
+    @classmethod
+    def from_dict(cls, hit: dict):
+        extra = {
+            k: v for k, v in hit.items() if k not in {"id", "uri", "title", "summary"}
+        }
+        return cls(
+            int(hit["id"]),
+            hit.get("uri") or f"{PLACES_URI}{hit['id']}",
+            hit.get("title", ""),
+            hit.get("summary", ""),
+            extra or None,
+        )
+
+    def __getitem__(self, key):
+        if key == "id":
+            return str(self.id)
+        if key in {"uri", "title", "summary"}:
+            return getattr(self, key)
+        if self.extra is None:
+            raise KeyError(key)
+        return self.extra[key]
+
+    def __iter__(self):
+        yield from ("id", "uri", "title", "summary")
+        if self.extra:
+            yield from self.extra
+
+    def __len__(self):
+        return 4 + len(self.extra or ())
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.id}, {self.title!r})"
+
+    def to_dict(self):
+        return dict(self)
+
+
+class ResultSet(Mapping):
+    """Search results stored in columns, readable like a results dictionary.
+
+    Ids are kept in an array of integers, titles, summaries and modification
+    dates as interned strings, and reprPoint and bbox coordinates in arrays
+    of doubles; a URI is only stored if it is not the usual place URI for the
+    id. results["hits"] is a sequence of Hit objects made on demand, so
+    existing code reading results["query"] and results["hits"] keeps working.
+    Hits are unique by id. Result sets can be combined by id with union (|),
+    intersection (&) and difference (-).
+    """
+
+    def __init__(self, hits=(), query: str = None, **fields):
+        """Make a result set from hits (dictionaries or Hits) and a query URI."""
+        self.query = query
+        self.fields = fields  # other top-level fields, e.g. "truncated"
+        self.ids = array("q")
+        self.titles = list()
+        self.summaries = list()
+        self.modified = list()  # None where unknown
+        self.points = array("d")  # x, y per row; NaN where unknown
+        self.bboxes = array("d")  # minx, miny, maxx, maxy per row; NaN where unknown
+        self.extras = dict()  # row -> dict of any other fields
+        self._rows = dict()  # id -> row
+        for hit in hits:
+            self.add(hit)
+
+    @classmethod
+    def from_results(cls, results: dict):
+        """Make a result set from a results dictionary, as returned by search()."""
+        fields = {k: v for k, v in results.items() if k not in {"query", "hits"}}
+        return cls(results["hits"], results.get("query"), **fields)
+
+    def add(self, hit):
+        """Add a hit (dictionary or Hit) unless one with its id is already here."""
+        if not isinstance(hit, Hit):
+            hit = Hit.from_dict(hit)
+        if hit.id in self._rows:
+            return
+        row = len(self.ids)
+        self.ids.append(hit.id)
+        self.titles.append(sys.intern(hit.title))
+        self.summaries.append(sys.intern(hit.summary))
+        extra = dict(hit.extra or ())
+        modified = extra.get("modified")
+        if isinstance(modified, str):
+            del extra["modified"]
+            modified = sys.intern(modified)
+        else:
+            modified = None
+        self.modified.append(modified)
+        self.points.extend(_pop_coordinates(extra, "reprPoint", 2))
+        self.bboxes.extend(_pop_coordinates(extra, "bbox", 4))
+        if hit.uri != f"{PLACES_URI}{hit.id}":
+            extra["uri"] = hit.uri
+        if extra:
+            self.extras[row] = extra
+        self._rows[hit.id] = row
+
+    def hit(self, row: int):
+        """Return the Hit in a row."""
+        pid = self.ids[row]
+        extra = dict()
+        point = self.points[2 * row : 2 * row + 2]
+        if not math.isnan(point[0]):
+            extra["reprPoint"] = point.tolist()
+        bbox = self.bboxes[4 * row : 4 * row + 4]
+        if not math.isnan(bbox[0]):
+            extra["bbox"] = bbox.tolist()
+        if self.modified[row] is not None:
+            extra["modified"] = self.modified[row]
+        extra.update(self.extras.get(row, ()))
+        uri = extra.pop("uri", f"{PLACES_URI}{pid}")
+        return Hit(pid, uri, self.titles[row], self.summaries[row], extra or None)
+
+    def get_hit(self, pid: int):
+        """Return the Hit with an id, or None."""
+        try:
+            return self.hit(self._rows[int(pid)])
+        except KeyError:
+            return None
+
+    @property
+    def hits(self):
+        return HitSequence(self)
+
+    def id_set(self):
+        """Return the set of integer ids."""
+        return set(self._rows)
+
+    def __getitem__(self, key):
+        if key == "query":
+            return self.query
+        if key == "hits":
+            return self.hits
+        return self.fields[key]
+
+    def __iter__(self):
+        yield from ("query", "hits")
+        yield from self.fields
+
+    def __len__(self):
+        return 2 + len(self.fields)
+
+    def __contains__(self, key):
+        return key in {"query", "hits"} or key in self.fields
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({len(self.ids)} hits, query={self.query!r})"
+
+    def to_dict(self):
+        """Return a plain results dictionary (with hit dictionaries)."""
+        results = {"query": self.query, "hits": [hit.to_dict() for hit in self.hits]}
+        results.update(self.fields)
+        return results
+
+    def union(self, other):
+        """Return the hits in either result set (this one's first)."""
+        result = self._select(range(len(self.ids)))
+        for row in range(len(other.ids)):
+            if other.ids[row] not in self._rows:
+                result.add(other.hit(row))
+        return result
+
+    def intersection(self, other):
+        """Return the hits in this result set whose ids are also in the other."""
+        rows = other._rows
+        return self._select(i for i, pid in enumerate(self.ids) if pid in rows)
+
+    def difference(self, other):
+        """Return the hits in this result set whose ids are not in the other."""
+        rows = other._rows
+        return self._select(i for i, pid in enumerate(self.ids) if pid not in rows)
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
+
+    def _select(self, rows):
+        """Return a new result set (with no query) holding the given rows."""
+        result = ResultSet()
+        for row in rows:
+            pid = self.ids[row]
+            result._rows[pid] = len(result.ids)
+            if row in self.extras:
+                result.extras[len(result.ids)] = self.extras[row]
+            result.ids.append(pid)
+            result.titles.append(self.titles[row])
+            result.summaries.append(self.summaries[row])
+            result.modified.append(self.modified[row])
+            result.points.extend(self.points[2 * row : 2 * row + 2])
+            result.bboxes.extend(self.bboxes[4 * row : 4 * row + 4])
+        return result
+
+
+class HitSequence(Sequence):
+    """A read-only sequence of the hits in a ResultSet, made as they are read."""
+
+    __slots__ = ("results",)
+
+    def __init__(self, results: ResultSet):
+        self.results = results
+
+    def __len__(self):
+        return len(self.results.ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.results.hit(row) for row in range(len(self))[index]]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self.results.hit(index)
+
+    def __eq__(self, other):
+        if not isinstance(other, Sequence):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+
+def encode_results(results) -> bytes:
+    """Encode a results dictionary (or ResultSet) as compact, compressed bytes.
+
+    Ids are packed as integers, coordinates as doubles, and the usual place
+    URI is left out; fields of other kinds are kept as JSON. decode_results
+    reverses this.
+    """
+    out = bytearray()
+    fields = {k: v for k, v in results.items() if k not in {"query", "hits"}}
+    hits = results["hits"]
+    out += _HEADER.pack(ENCODING_VERSION, len(hits))
+    _pack_str(out, json.dumps([results.get("query"), fields], ensure_ascii=False))
+    for hit in hits:
+        hit = dict(hit)
+        flags = 0
+        strings = list()
+        pid = hit.pop("id")
+        number = _id_number(pid)
+        if number is None:
+            flags |= _ID_STR
+            number = 0
+            strings.append(str(pid))
+        if hit.get("uri") == f"{PLACES_URI}{pid}":
+            flags |= _URI
+            del hit["uri"]
+        for flag, key in _STRING_FIELDS:
+            if isinstance(hit.get(key), str):
+                flags |= flag
+                strings.append(hit.pop(key))
+        coordinates = bytearray()
+        for flag, key, packer in _COORDINATE_FIELDS:
+            try:
+                coordinates += packer.pack(*hit[key])
+            except (KeyError, TypeError, struct.error):
+                continue
+            flags |= flag
+            del hit[key]
+        if hit:
+            flags |= _EXTRA
+            strings.append(json.dumps(hit, ensure_ascii=False))
+        out += _HIT.pack(number, flags)
+        for s in strings:
+            _pack_str(out, s)
+        out += coordinates
+    return zlib.compress(bytes(out), 1)
+
+
+def decode_results(data: bytes) -> dict:
+    """Decode bytes made by encode_results back into a results dictionary."""
+    data = zlib.decompress(data)
+    version, count = _HEADER.unpack_from(data, 0)
+    if version != ENCODING_VERSION:
+        raise ValueError(f"Unknown results encoding version {version}.")
+    offset = _HEADER.size
+    header, offset = _unpack_str(data, offset)
+    query, fields = json.loads(header)
+    hits = list()
+    for _ in range(count):
+        number, flags = _HIT.unpack_from(data, offset)
+        offset += _HIT.size
+        if flags & _ID_STR:
+            pid, offset = _unpack_str(data, offset)
+        else:
+            pid = str(number)
+        hit = {"id": pid}
+        if flags & _URI:
+            hit["uri"] = f"{PLACES_URI}{pid}"
+        for flag, key in _STRING_FIELDS:
+            if flags & flag:
+                hit[key], offset = _unpack_str(data, offset)
+        extra = None
+        if flags & _EXTRA:
+            extra, offset = _unpack_str(data, offset)
+        for flag, key, packer in _COORDINATE_FIELDS:
+            if flags & flag:
+                hit[key] = list(packer.unpack_from(data, offset))
+                offset += packer.size
+        if extra is not None:
+            hit.update(json.loads(extra))
+        hits.append(hit)
+    results = {"query": query, "hits": hits}
+    results.update(fields)
+    return results
+
+
+def _pop_coordinates(extra: dict, key: str, n: int):
+    """Remove and return a list of n floats from extra, or return n NaNs.
+
+    Values of any other shape are left in extra, so that they read back as
+    they were given.
+    """
+    value = extra.get(key)
+    if (
+        isinstance(value, list)
+        and len(value) == n
+        and all(type(v) is float and not math.isnan(v) for v in value)
+    ):
+        del extra[key]
+        return value
+    return [math.nan] * n
+
+
+def _id_number(pid):
+    """Return an id as an unsigned 64-bit integer, or None if it cannot be one."""
+    try:
+        number = int(pid)
+    except (TypeError, ValueError):
+        return None
+    if str(number) != pid or not 0 <= number < 2**64:
+        return None
+    return number
+
+
+def _pack_str(out: bytearray, s: str):
+    b = s.encode("utf-8")
+    out += _LENGTH.pack(len(b))
+    out += b
+
+
+def _unpack_str(data: bytes, offset: int):
+    (n,) = _LENGTH.unpack_from(data, offset)
+    offset += _LENGTH.size
+    return data[offset : offset + n].decode("utf-8"), offset + n
@@ -0,0 +1,69 @@
+#
+# This file is part of pleiades_search_api
+# by Tom Elliott for the Institute for the Study of the Ancient World
+# (c) Copyright 2024 by New York University
+# Licensed under the AGPL-3.0; see LICENSE.txt file.
+#
+"""
+Lightweight incremental parser for the RSS returned by Pleiades /search_rss
+"""
+
+import logging
+from xml.etree.ElementTree import XMLPullParser
+
+ITEM_FIELDS = {"title", "link", "description", "date", "point", "box"}
+logger = logging.getLogger(__name__)
+
+
+def iter_rss_items(chunks):
+    """Parse RSS from an iterable of byte chunks, yielding each item as it closes.
+
+    Each item is a dictionary of the stripped text of the item's title, link and
+    description child elements, plus Dublin Core date and GeoRSS point and box
+    if the feed has them (RSS 1.0 or 2.0, namespaces ignored). If an item
+    has no link element, its rdf:about attribute is used instead. Items are
+    detached from the parse tree once yielded, so memory use does not grow with
+    the length of the feed.
+    """
+    reader = _ItemReader()
+    for chunk in chunks:
+        reader.parser.feed(chunk)
+        yield from reader.read_items()
+    reader.parser.close()
+    yield from reader.read_items()
+
+
+class _ItemReader:
+    """Track where the pull parser is in the feed and collect item fields."""
+
+    def __init__(self):
+        self.parser = XMLPullParser(events=("start", "end"))
+        self.stack = list()
+        self.item = None
+
+    def read_items(self):
+        for event, elem in self.parser.read_events():
+            name = _local_name(elem.tag)
+            if event == "start":
+                self.stack.append(elem)
+                if name == "item":
+                    self.item = dict()
+                    for k, v in elem.attrib.items():
+                        if _local_name(k) == "about":
+                            self.item["link"] = v.strip()
+                continue
+            self.stack.pop()
+            if self.item is None:
+                continue
+            if name == "item":
+                if self.stack:
+                    self.stack[-1].remove(elem)
+                item = self.item
+                self.item = None
+                yield item
+            elif name in ITEM_FIELDS and _local_name(self.stack[-1].tag) == "item":
+                self.item[name] = (elem.text or "").strip()
+
+
+def _local_name(tag: str):
+    return tag.rsplit("}", 1)[-1]
@@ -8,71 +8,125 @@
 Defines the SearchInterface class: handle interactions with Pleiades
 """
 
-import feedparser
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 import logging
+from threading import Lock
+import time
+from types import MappingProxyType
 from urllib.parse import urlencode, urlunparse
-from pleiades_search_api.text import normtext
+from pleiades_search_api.deadline import DeadlineExceeded, NO_RETRY, make_deadline
+from pleiades_search_api.metrics import phase
+from pleiades_search_api.results import ResultSet
+from pleiades_search_api.rss import iter_rss_items
+from pleiades_search_api.text import normtext, normtext_many
 from pleiades_search_api.web import Web, DEFAULT_USER_AGENT
-from pprint import pformat
 
+BBOX_SHAVE = 0.0001  # Pleiades shrinks each bbox by this much on every side
+BATCH_MEMO_SIZE = 1000
+COALESCIBLE_PARAMETERS = ("tag", "feature_type", "text")
+DEFAULT_GROUP_SIZE = 8
+DEFAULT_MAX_FETCHES = 32  # requests in flight at once for deadline-bounded searches
+DEFAULT_MAX_TILE_DEPTH = 12
+DEFAULT_MAX_WORKERS = 4
+PLEIADES_NETLOC = "pleiades.stoa.org"
+MAX_HITS = 100  # Pleiades RSS search never returns more hits than this
+RSS_CHUNK_SIZE = 16384
+TILE_OVERLAP = 1e-9  # absorbs float rounding so that adjacent tiles never leave a gap
 logger = logging.getLogger(__name__)
 
 
 class Query:
+    # rules are shared by all queries; "behavior" names a preprocessing method
+    _supported_parameters = {
+        "bbox": {"expected": (tuple), "behavior": "_preprocess_bbox"},
+        "description": {
+            "expected": (str, list),
+            "list_behavior": "join",
+            "rename": "Description",
+        },
+        "feature_type": {
+            "expected": (str, list),
+            "list_behavior": "noseq",
+            "list_additional": {"AND": {"get_usage:ignore_empty": "operator:and"}},
+            "rename": "getFeatureType",
+        },
+        "tag": {
+            "expected": (str, list),
+            "list_behavior": "noseq",
+            "list_additional": {"AND": {"Subject_usage:ignore_empty": "operator:and"}},
+            "rename": "Subject:list",
+        },
+        "text": {
+            "expected": (str, list),
+            "list_behavior": "join",
+            "rename": "SearchableText",
+        },
+        "title": {"expected": str, "rename": "Title"},
+    }
+    _default_web_parameters = {
+        "portal_type:list": "Place",
+        "review_state:list": "published",
+    }
+
     def __init__(self):
-        self.parameters = dict()
-        self._supported_parameters = {
-            "bbox": {"expected": (tuple), "behavior": self._preprocess_bbox},
-            "description": {
-                "expected": (str, list),
-                "list_behavior": "join",
-                "rename": "Description",
-            },
-            "feature_type": {
-                "expected": (str, list),
-                "list_behavior": "noseq",
-                "list_additional": {"AND": {"get_usage:ignore_empty": "operator:and"}},
-                "rename": "getFeatureType",
-            },
-            "tag": {
-                "expected": (str, list),
-                "list_behavior": "noseq",
-                "list_additional": {
-                    "AND": {"Subject_usage:ignore_empty": "operator:and"}
-                },
-                "rename": "Subject:list",
-            },
-            "text": {
-                "expected": (str, list),
-                "list_behavior": "join",
-                "rename": "SearchableText",
-            },
-            "title": {"expected": str, "rename": "Title"},
-        }
-        self._default_web_parameters = {
-            "portal_type:list": "Place",
-            "review_state:list": "published",
-        }
+        self._parameters = dict()  # name -> (value, operator, is_list)
+        self._version = 0
+        self._compiled = None
 
     @property
     def supported(self):
         """List supported parameters"""
         return list(self._supported_parameters.keys())
 
+    @property
+    def parameters(self):
+        """A read-only view of the parameters, name -> (value, operator).
+
+        List values are copies, so change parameters with set_parameter,
+        remove_parameter or clear_parameters.
+        """
+        return MappingProxyType(
+            {
+                name: (list(value) if is_list else value, operator)
+                for name, (value, operator, is_list) in self._parameters.items()
+            }
+        )
+
     def clear_parameters(self):
         """Reset all parameters for the query."""
-        self.parameters = dict()
+        self._parameters = dict()
+        self._version += 1
+
+    def remove_parameter(self, name):
+        """Remove a single parameter from the query."""
+        del self._parameters[name]
+        self._version += 1
+
+    def copy(self):
+        """Return a new query with the same parameters."""
+        q = Query()
+        q._parameters = dict(self._parameters)  # values are immutable
+        return q
+
+    def compile(self):
+        """Return an immutable CompiledQuery for the current parameters.
+
+        The compiled query is cached until the parameters are changed with
+        set_parameter, remove_parameter or clear_parameters.
+        """
+        if self._compiled is None or self._compiled[0] != self._version:
+            self._compiled = (self._version, CompiledQuery(self))
+        return self._compiled[1]
+
+    @property
+    def canonical_key(self):
+        """A string identifying the search this query performs (see CompiledQuery)."""
+        return self.compile().key
 
     @property
     def parameters_for_web(self):
-        p = dict()
-        for k, v in self._default_web_parameters.items():
-            p[k] = v
-        for k, v in self.parameters.items():
-            these_web_params = self._convert_for_web(k, *v)
-            for webk, webv in these_web_params.items():
-                p[webk] = webv
-        return p
+        return self.compile().parameters_for_web
 
     def set_parameter(self, name, value, operator=None):
         """Set a single parameter on the query."""
@@ -86,7 +140,21 @@ class Query:
             raise TypeError(
                 f"Unexpected type {type(value)} for parameter '{name}'. Expected type(s): {rules['expected']}."
             )
-        self.parameters[name] = (value, operator)
+        # keep a tuple, so that changing the caller's list changes nothing here
+        is_list = isinstance(value, list)
+        self._parameters[name] = (tuple(value) if is_list else value, operator, is_list)
+        self._version += 1
+
+    def _web_parameters(self, parameters: dict):
+        """Convert a dictionary of our parameters to the web parameters Pleiades uses."""
+        p = dict()
+        for k, v in self._default_web_parameters.items():
+            p[k] = v
+        for k, v in parameters.items():
+            these_web_params = self._convert_for_web(k, *v)
+            for webk, webv in these_web_params.items():
+                p[webk] = webv
+        return p
 
     def _convert_for_web(self, name, value, operator):
         """Convert our generic parameters to the specific ones Pleiades uses"""
@@ -139,7 +207,7 @@ class Query:
                 raise TypeError(type(value))
             web_params[cooked_key] = cooked_value
         else:
-            these_params = preprocess_func(value)
+            these_params = getattr(self, preprocess_func)(value)
             for this_k, this_v in these_params.items():
                 web_params[this_k] = this_v
         return web_params
@@ -147,9 +215,9 @@ class Query:
     def _preprocess_bbox(self, bounds: tuple):
         shaved_bounds = list()  # pleiades is weird
         for i in [0, 1]:
-            shaved_bounds.append(bounds[i] + 0.0001)
+            shaved_bounds.append(bounds[i] + BBOX_SHAVE)
         for i in [2, 3]:
-            shaved_bounds.append(bounds[i] - 0.0001)
+            shaved_bounds.append(bounds[i] - BBOX_SHAVE)
         return {
             "lowerLeft": f"{shaved_bounds[0]},{shaved_bounds[1]}",
             "upperRight": f"{shaved_bounds[2]},{shaved_bounds[3]}",
@@ -158,47 +226,1003 @@ class Query:
         }
 
 
+class CompiledQuery:
+    """An immutable, hashable snapshot of a Query, compiled once for the web.
+
+    Compiled queries compare equal when they perform the same search: their
+    canonical keys (web parameters sorted by name, list values sorted and
+    de-duplicated) are the same. hash() is only stable within a process; use
+    digest to shard work across processes or machines.
+    """
+
+    __slots__ = ("_parameters", "_web_parameters", "encoded", "key", "_hash")
+
+    def __init__(self, query: Query):
+        parameters = list()
+        canonical = dict()
+        for name, (value, operator, is_list) in sorted(query._parameters.items()):
+            parameters.append((name, value, operator, is_list))
+            if is_list:
+                canonical[name] = (sorted(set(value)), operator)
+            else:
+                canonical[name] = (value, operator)
+        web_parameters = query._web_parameters(query.parameters)
+        canonical_web_parameters = query._web_parameters(canonical)
+        set_ = object.__setattr__
+        set_(self, "_parameters", tuple(parameters))
+        set_(
+            self,
+            "_web_parameters",
+            tuple(
+                (k, tuple(v) if isinstance(v, list) else v)
+                for k, v in web_parameters.items()
+            ),
+        )
+        set_(self, "encoded", encode_web_parameters(**web_parameters))
+        set_(
+            self,
+            "key",
+            encode_web_parameters(
+                **{
+                    k: canonical_web_parameters[k]
+                    for k in sorted(canonical_web_parameters)
+                }
+            ),
+        )
+        set_(self, "_hash", hash(self.key))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{self.__class__.__name__} is immutable.")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{self.__class__.__name__} is immutable.")
+
+    def __eq__(self, other):
+        if not isinstance(other, CompiledQuery):
+            return NotImplemented
+        return self.key == other.key
+
+    def __hash__(self):
+        return self._hash
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.key!r})"
+
+    @property
+    def canonical_key(self):
+        return self.key
+
+    @property
+    def digest(self):
+        """A hex digest of the canonical key that is stable across processes."""
+        from hashlib import sha1
+
+        return sha1(self.key.encode("utf-8")).hexdigest()
+
+    @property
+    def parameters(self):
+        """A new dictionary of the compiled parameters, shaped like Query.parameters."""
+        return {
+            name: (list(value) if is_list else value, operator)
+            for name, value, operator, is_list in self._parameters
+        }
+
+    @property
+    def parameters_for_web(self):
+        """A new dictionary of the compiled web parameters."""
+        return {
+            k: list(v) if isinstance(v, tuple) else v for k, v in self._web_parameters
+        }
+
+    def compile(self):
+        return self
+
+    def copy(self):
+        """Return a new, mutable Query with the same parameters."""
+        q = Query()
+        for name, (value, operator) in self.parameters.items():
+            q.set_parameter(name, value, operator)
+        return q
+
+
 class SearchInterface(Web):
-    def __init__(self, user_agent=DEFAULT_USER_AGENT):
-        Web.__init__(self, netloc="pleiades.stoa.org", user_agent=user_agent)
+    def __init__(
+        self,
+        user_agent=DEFAULT_USER_AGENT,
+        cache=None,
+        spatial_cache=None,
+        place_cache=None,
+        scheme: str = "https",
+        netloc: str = PLEIADES_NETLOC,
+        timeout: float = None,
+        retry=None,
+        hedge=None,
+        **kwargs,
+    ):
+        """Optionally pass caches for parsed results and limits on search time.
+
+        cache (e.g. cache.ResultCache) answers repeats of equivalent queries;
+        spatial_cache (cache.SpatialCache) answers bbox queries that fall inside
+        the box of an earlier complete search (fetching the JSON of places
+        found without coordinates, as enrich_hits does, to learn where they
+        are); place_cache (e.g.
+        cache.LRUCache) keeps place JSON documents for enrich_hits. timeout is
+        the default time budget in seconds for each search, retry a
+        deadline.RetryPolicy for transient failures and hedge a deadline.Hedge
+        for sending duplicates of slow requests (see search). scheme and
+        netloc point the interface at another host serving the Pleiades search
+        interface (such as a test server); other keyword arguments (such as
+        transport and metrics) are passed on to Web.
+        """
+        Web.__init__(self, netloc=netloc, user_agent=user_agent, **kwargs)
+        self.scheme = scheme
+        self.netloc = netloc
         self._terms = {"title": str}
+        self.cache = cache
+        self.spatial_cache = spatial_cache
+        self.place_cache = place_cache
+        self.timeout = timeout
+        self.retry = retry
+        self.hedge = hedge
+        self._fetch_executor = None
+        self._fetch_executor_lock = Lock()
 
-    def search(self, query: Query):
-        """Search Pleiades for the query."""
-        params = self._prep_params(**query.parameters_for_web)
-        return self._search_rss(params)
+    def search(
+        self,
+        query: Query,
+        enrich: bool = False,
+        timeout: float = None,
+        deadline=None,
+    ):
+        """Search Pleiades for the query (a Query or CompiledQuery).
 
-    def _search_rss(self, params):
-        """Use Pleiades RSS search interface since it gives us back structured data."""
-        uri = urlunparse(("https", "pleiades.stoa.org", "/search_rss", "", params, ""))
+        With enrich, the hits are passed through enrich_hits. timeout (by
+        default the interface's timeout) is a time budget in seconds, and
+        deadline a deadline.Deadline (which may be shared by many searches);
+        the search ends at whichever comes first. Results of a bounded search
+        have a "status": "complete", or "timed_out" (and no hits) if time ran
+        out first, instead of an exception being raised. Enrichment is not
+        bounded, and neither are iter_search, paginate and search_coalesced,
+        which take no timeout (the retry policy and hedging apply to them
+        too). Raises RuntimeError if Pleiades answers with anything but a
+        200 response; such answers are never cached.
+        """
+        if self.metrics is not None:
+            self.metrics.count("searches")
+        with phase(self.metrics, "compile"):
+            query = query.compile()
+        results = self._search_within(query, query.encoded, timeout, deadline)
+        if enrich:
+            results["hits"] = self.enrich_hits(results["hits"])
+        return results
+
+    def search_set(self, query: Query, enrich: bool = False):
+        """Search as with search, but return a compact results.ResultSet.
+
+        Use this instead of search when holding many results in memory.
+        """
+        return ResultSet.from_results(self.search(query, enrich=enrich))
+
+    def enrich_hits(self, hits: list, max_workers: int = DEFAULT_MAX_WORKERS):
+        """Return copies of hits with details from each place's JSON added.
+
+        The details are reprPoint, bbox, names, placeTypes and timePeriods.
+        Place documents are fetched on a pool of worker threads through the
+        same web client as searches (so robots.txt and crawl-delay apply),
+        once per distinct id. With a place_cache, documents are kept under the
+        place id and the hit's modification date, so an edited place is
+        fetched afresh. Hits whose document cannot be fetched are returned
+        unchanged.
+        """
+        if max_workers < 1:
+            raise ValueError(
+                f"max_workers must be a positive integer (got {max_workers})."
+            )
+        keys = OrderedDict()  # place cache key -> place id
+        for hit in hits:
+            keys[_place_cache_key(hit)] = hit["id"]
+        places = dict()
+        missing = list()
+        for key, pid in keys.items():
+            place = None if self.place_cache is None else self.place_cache.get(key)
+            if self.place_cache is not None:
+                self._count_cache("place_cache", place)
+            if place is None:
+                missing.append(key)
+            else:
+                places[key] = place
+        if missing:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                fetched = executor.map(lambda key: self._get_place(keys[key]), missing)
+                for key, place in zip(missing, fetched):
+                    if place is None:
+                        continue
+                    places[key] = place
+                    if self.place_cache is not None:
+                        self.place_cache.put(key, place)
+        enriched = list()
+        for hit in hits:
+            hit = dict(hit)
+            try:
+                place = places[_place_cache_key(hit)]
+            except KeyError:
+                pass
+            else:
+                hit.update(_place_details(place))
+            enriched.append(hit)
+        return enriched
+
+    def iter_search(self, query: Query):
+        """Search Pleiades for the query, yielding each hit as soon as it is parsed.
+
+        Unlike search(), the response is parsed incrementally with a lightweight
+        parser made for the /search_rss format instead of feedparser. Raises
+        RuntimeError if the response is not a 200. The interface's retry
+        policy and hedging apply, but not its timeout.
+        """
+        if self.metrics is not None:
+            self.metrics.count("searches")
+        with phase(self.metrics, "compile"):
+            query = query.compile()
+        uri = self._search_uri(query.encoded)
+        if self.cache is not None:
+            key = query.key
+            with phase(self.metrics, "cache"):
+                results = self.cache.get(key)
+            self._count_cache("cache", results)
+            if results is not None:
+                yield from results["hits"]
+                return
         logger.debug(uri)
-        r = self.get(uri)
+        r = self._fetch(uri)
+        _check_status(uri, r)
         hits = list()
-        data = feedparser.parse(r.text)
-        for entry in data.entries:
-            hits.append(
-                {
-                    "id": entry.link.split("/")[-1],
-                    "uri": entry.link,
-                    "title": entry.title,
-                    "summary": entry.description,
-                }
+        for item in iter_rss_items(r.iter_content(chunk_size=RSS_CHUNK_SIZE)):
+            hit = self._make_hit(
+                item.get("link", ""),
+                *normtext_many([item.get("title", ""), item.get("description", "")]),
+                *_georss_coordinates(item.get("point"), item.get("box")),
+                modified=item.get("date"),
+            )
+            hits.append(hit)
+            yield hit
+        if self.metrics is not None:
+            self.metrics.count("hits", len(hits))
+        if self.cache is not None:
+            self.cache.put(key, {"query": uri, "hits": hits})
+
+    def paginate(self, query: Query, page_size: int = MAX_HITS, prefetch: bool = True):
+        """Yield every hit for the query, walking through the results a page at a time.
+
+        Pages are requested with the Plone batching parameters b_start and
+        b_size. With prefetch, the next page is requested in the background
+        as soon as a page arrives, while the caller works through it. Iteration
+        stops at the first page shorter than page_size, or at a page holding
+        only hits already seen (as when the server ignores b_start). Pages are
+        not cached.
+        """
+        if not 1 <= page_size <= MAX_HITS:
+            raise ValueError(
+                f"page_size must be between 1 and {MAX_HITS} (got {page_size})."
+            )
+        if self.metrics is not None:
+            self.metrics.count("searches")
+        with phase(self.metrics, "compile"):
+            query = query.compile()
+        seen = set()
+        with ThreadPoolExecutor(max_workers=1) as executor:
+
+            def fetch(start):
+                return self._search_rss(_page_params(query.encoded, start, page_size))
+
+            start = 0
+            future = executor.submit(fetch, start)
+            while future is not None:
+                hits = future.result()["hits"]
+                last = len(hits) < page_size
+                start += page_size
+                future = None
+                if prefetch and not last:
+                    future = executor.submit(fetch, start)
+                new_hits = [hit for hit in hits if hit["id"] not in seen]
+                if hits and not new_hits:
+                    logger.warning(
+                        f"Page at b_start={start - page_size} only repeats earlier "
+                        "hits; stopping."
+                    )
+                    if future is not None:
+                        future.cancel()
+                    return
+                for hit in new_hits:
+                    seen.add(hit["id"])
+                    yield hit
+                if not prefetch and not last:
+                    future = executor.submit(fetch, start)
+
+    def search_many(
+        self,
+        queries,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        timeout: float = None,
+        deadline=None,
+    ):
+        """Search Pleiades for each of the queries on a pool of worker threads.
+
+        Yields (query, results) tuples in the order the searches finish. Queries
+        with identical web parameters share a single request (and a single
+        results dictionary), whether the first one is still in flight or
+        finished recently. Queries are read lazily, so an iterator of any
+        length may be passed. timeout bounds each search (from when it
+        starts) and deadline (a deadline.Deadline) the whole batch, as for
+        search: searches still unfinished when time runs out are yielded with
+        "timed_out" results.
+        """
+        if max_workers < 1:
+            raise ValueError(
+                f"max_workers must be a positive integer (got {max_workers})."
+            )
+        queries = iter(queries)
+        exhausted = False
+        in_flight = dict()  # future -> params
+        waiting = dict()  # params -> list of queries waiting on that request
+        finished = OrderedDict()  # params -> results, most recent last
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while True:
+                while not exhausted and len(in_flight) < 2 * max_workers:
+                    try:
+                        query = next(queries)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    compiled = query.compile()
+                    params = compiled.encoded
+                    try:
+                        results = finished[params]
+                    except KeyError:
+                        pass
+                    else:
+                        finished.move_to_end(params)
+                        yield query, results
+                        continue
+                    try:
+                        waiting[params].append(query)
+                    except KeyError:
+                        waiting[params] = [query]
+                        in_flight[
+                            executor.submit(
+                                self._search_within, compiled, params, timeout, deadline
+                            )
+                        ] = params
+                if not in_flight:
+                    break
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    params = in_flight.pop(future)
+                    results = future.result()
+                    if results.get("status") != "timed_out":
+                        finished[params] = results
+                        if len(finished) > BATCH_MEMO_SIZE:
+                            finished.popitem(last=False)
+                    for query in waiting.pop(params):
+                        yield query, results
+
+    def search_coalesced(
+        self,
+        queries,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        group_size: int = DEFAULT_GROUP_SIZE,
+    ):
+        """Search for many single-term queries with fewer requests, by OR-ing them together.
+
+        Queries that differ only in a single tag, feature_type or single-word
+        text term are merged, up to group_size at a time, into one OR query.
+        RSS hits do not say which term they matched, so a merged search can
+        only settle its members when it comes back empty: then every member
+        has no hits. Otherwise (and always when it reaches MAX_HITS) the
+        group is split in half and each half searched again, down to single
+        queries, which are searched exactly as they are. This saves requests
+        when most queries match nothing (e.g. probing many candidate tags) and
+        costs extra requests when most match something; use search_many then.
+
+        Yields (query, results) tuples in the order they are settled. Unlike
+        search_many, all queries are read before the first request is made.
+        """
+        if max_workers < 1:
+            raise ValueError(
+                f"max_workers must be a positive integer (got {max_workers})."
+            )
+        if group_size < 1:
+            raise ValueError(
+                f"group_size must be a positive integer (got {group_size})."
             )
+        waiting = OrderedDict()  # compiled -> list of queries asking for it
+        for query in queries:
+            waiting.setdefault(query.compile(), list()).append(query)
+        groups = OrderedDict()  # (name, key of other parameters) -> [(compiled, term)]
+        singles = list()
+        for compiled in waiting:
+            if self.cache is not None:
+                results = self.cache.get(compiled.key)
+                self._count_cache("cache", results)
+                if results is not None:
+                    results = {
+                        "query": self._search_uri(compiled.encoded),
+                        "hits": list(results["hits"]),
+                    }
+                    for query in waiting[compiled]:
+                        yield query, results
+                    continue
+            coalescing = _coalescing_term(compiled)
+            if coalescing is None:
+                singles.append([(compiled, None)])
+            else:
+                group_key, term = coalescing
+                groups.setdefault(group_key, list()).append((compiled, term))
+        batches = list(singles)
+        for members in groups.values():
+            for i in range(0, len(members), group_size):
+                batches.append(members[i : i + group_size])
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            in_flight = dict()  # future -> (members, sibling)
+
+            def submit(members, sibling=None):
+                if len(members) == 1:
+                    compiled = members[0][0]
+                else:
+                    compiled = _merge_queries(members)
+                future = executor.submit(
+                    self._search_cached, compiled, compiled.encoded
+                )
+                in_flight[future] = (members, sibling)
+
+            def bisect(members, results, own=False):
+                """Narrow down members whose hits together are results; return any settled.
+
+                Settled queries are returned as (compiled, hits, own) tuples;
+                own is True if the hits came from the query's own search.
+                """
+                if len(members) == 1:
+                    return [(members[0][0], results["hits"], own)]
+                half = len(members) // 2
+                # the second half is searched only if it has to be (see below)
+                submit(members[:half], (members[half:], results))
+                return []
+
+            for members in batches:
+                submit(members)
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    members, sibling = in_flight.pop(future)
+                    results = future.result()
+                    if results["hits"]:
+                        settled = bisect(members, results, own=True)
+                        if sibling is not None:
+                            submit(sibling[0])
+                    else:
+                        settled = [
+                            (compiled, [], len(members) == 1) for compiled, _ in members
+                        ]
+                        if sibling is not None:
+                            sibling_members, parent = sibling
+                            if len(parent["hits"]) < MAX_HITS:
+                                # the parent's hits must all be the sibling's
+                                settled.extend(bisect(sibling_members, parent))
+                            else:
+                                submit(sibling_members)
+                    for compiled, hits, own in settled:
+                        uri = self._search_uri(compiled.encoded)
+                        settled_results = {"query": uri, "hits": list(hits)}
+                        # results of a query's own search are already cached
+                        if not own:
+                            if self.metrics is not None:
+                                self.metrics.count("coalesced_queries")
+                            if self.cache is not None:
+                                self.cache.put(compiled.key, settled_results)
+                        for query in waiting[compiled]:
+                            yield query, settled_results
+
+    def search_exhaustive(
+        self,
+        query: Query,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        max_depth: int = DEFAULT_MAX_TILE_DEPTH,
+        timeout: float = None,
+        deadline=None,
+    ):
+        """Search Pleiades for a bbox query, tiling the bbox to get past MAX_HITS.
+
+        Any tile whose search comes back with MAX_HITS hits is split into four
+        quadrants, which are searched in turn; tiles are searched in parallel.
+        Hits are de-duplicated by id. If a tile still comes back full after
+        max_depth splits, its hits are kept and "truncated" is set to True in
+        the results. timeout (seconds) and deadline (a deadline.Deadline)
+        bound the whole search, and the interface's timeout each tile; if
+        time runs out, the results hold the hits found so far and their
+        "status" is "partial" (or "timed_out" if the first tile timed out).
+        """
+        try:
+            bounds, _ = query.parameters["bbox"]
+        except KeyError:
+            raise ValueError(
+                "search_exhaustive requires a query with a 'bbox' parameter."
+            )
+        if max_workers < 1:
+            raise ValueError(
+                f"max_workers must be a positive integer (got {max_workers})."
+            )
+        # Pleiades searches the shaved box, so tile the shaved box and expand
+        # each tile by the shave again before sending it
+        shaved = (
+            bounds[0] + BBOX_SHAVE,
+            bounds[1] + BBOX_SHAVE,
+            bounds[2] - BBOX_SHAVE,
+            bounds[3] - BBOX_SHAVE,
+        )
+        deadline = make_deadline(timeout, deadline)
+        bounded = deadline is not None or self.timeout is not None
+        hits = dict()
+        truncated = False
+        timed_out = 0  # tiles
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            root = executor.submit(self.search, query, deadline=deadline)
+            in_flight = {root: (shaved, 0)}
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    tile, depth = in_flight.pop(future)
+                    results = future.result()
+                    if results.get("status") == "timed_out":
+                        timed_out += 1
+                        continue
+                    for hit in results["hits"]:
+                        hits.setdefault(hit["id"], hit)
+                    if len(results["hits"]) < MAX_HITS:
+                        continue
+                    if depth >= max_depth:
+                        logger.warning(
+                            f"Tile {tile} still has {MAX_HITS} hits at depth {depth}; "
+                            "results are truncated."
+                        )
+                        truncated = True
+                        continue
+                    for quadrant in self._split_tile(tile):
+                        tile_query = query.copy()
+                        tile_query.set_parameter(
+                            "bbox",
+                            (
+                                quadrant[0] - BBOX_SHAVE - TILE_OVERLAP,
+                                quadrant[1] - BBOX_SHAVE - TILE_OVERLAP,
+                                quadrant[2] + BBOX_SHAVE + TILE_OVERLAP,
+                                quadrant[3] + BBOX_SHAVE + TILE_OVERLAP,
+                            ),
+                        )
+                        in_flight[
+                            executor.submit(self.search, tile_query, deadline=deadline)
+                        ] = (quadrant, depth + 1)
+        results = {
+            "query": root.result()["query"],
+            "hits": list(hits.values()),
+            "truncated": truncated,
+        }
+        if bounded:
+            if root.result().get("status") == "timed_out":
+                results["status"] = "timed_out"
+            else:
+                results["status"] = "partial" if timed_out else "complete"
+        if self.spatial_cache is not None and not timed_out:
+            self.spatial_cache.put(query, results)
+        return results
+
+    def _split_tile(self, tile: tuple):
+        """Split a (minx, miny, maxx, maxy) tile into four quadrants."""
+        midx = (tile[0] + tile[2]) / 2
+        midy = (tile[1] + tile[3]) / 2
+        return [
+            (tile[0], tile[1], midx, midy),
+            (midx, tile[1], tile[2], midy),
+            (tile[0], midy, midx, tile[3]),
+            (midx, midy, tile[2], tile[3]),
+        ]
+
+    def _search_within(
+        self, query: CompiledQuery, params: str, timeout=None, deadline=None
+    ):
+        """Search as _search_cached, within a time budget starting now (see search)."""
+        deadline = make_deadline(self.timeout if timeout is None else timeout, deadline)
+        try:
+            results = self._search_cached(query, params, deadline)
+        except DeadlineExceeded:
+            if self.metrics is not None:
+                self.metrics.count("timeouts")
+            logger.warning(f"Search timed out: {self._search_uri(params)}")
+            return {
+                "query": self._search_uri(params),
+                "hits": [],
+                "status": "timed_out",
+            }
+        if deadline is not None:
+            results["status"] = "complete"
+        return results
+
+    def _search_cached(self, query: CompiledQuery, params: str, deadline=None):
+        """Search for params, consulting the results caches (if any) first.
+
+        Raises deadline.DeadlineExceeded if the deadline passes first.
+        """
+        if self.cache is None and self.spatial_cache is None:
+            return self._search_rss_within(params, deadline)
+        if hasattr(self.cache, "get_or_fetch"):
+            # the cache looks key up once and, on a miss, calls fetch (once
+            # across threads and processes, for a single-flight cache)
+            fetched = list()  # seconds spent fetching, if the cache missed
+
+            def fetch():
+                start = time.perf_counter()
+                try:
+                    return self._search_spatial_or_rss(query, params, deadline)
+                finally:
+                    fetched.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            results = self.cache.get_or_fetch(query.key, fetch, deadline)
+            if self.metrics is not None:
+                # time the cache's own work as the "cache" phase
+                self.metrics.observe(
+                    "cache", time.perf_counter() - start - sum(fetched)
+                )
+            self._count_cache("cache", None if fetched else results)
+        else:
+            results = None
+            if self.cache is not None:
+                key = query.key
+                with phase(self.metrics, "cache"):
+                    results = self.cache.get(key)
+                self._count_cache("cache", results)
+            if results is None:
+                results = self._search_spatial_or_rss(query, params, deadline)
+                if self.cache is not None:
+                    self.cache.put(key, results)
+        # callers get their own top-level containers; cached hits are shared
+        return {"query": self._search_uri(params), "hits": list(results["hits"])}
+
+    def _get_place(self, pid: str):
+        """Fetch the JSON document for a place, or return None on failure."""
+        uri = urlunparse((self.scheme, self.netloc, f"/places/{pid}/json", "", "", ""))
+        try:
+            r = self.get(uri)
+        except Exception as err:
+            logger.warning(f"Could not get {uri}: {err}")
+            return None
+        if r.status_code != 200:
+            logger.warning(f"Could not get {uri}: HTTP {r.status_code}")
+            return None
+        if self.metrics is not None:
+            self.metrics.count("places")
+        try:
+            return r.json()
+        except ValueError as err:
+            logger.warning(f"Could not parse JSON from {uri}: {err}")
+            return None
+
+    def _search_spatial_or_rss(self, query: CompiledQuery, params: str, deadline=None):
+        """Answer from the spatial cache (if any), or search and add to it."""
+        if self.spatial_cache is not None:
+            with phase(self.metrics, "cache"):
+                results = self.spatial_cache.get(query)
+            self._count_cache("spatial_cache", results)
+            if results is not None:
+                return results
+        results = self._search_rss_within(params, deadline)
+        if self.spatial_cache is not None:
+            self.spatial_cache.put(query, results, self._locate_hits)
+        return results
+
+    def _locate_hits(self, hits: list):
+        """Return the extent of each hit, from its place's JSON (see enrich_hits)."""
+        return [hit_extent(hit) for hit in self.enrich_hits(hits)]
+
+    def _search_rss_within(self, params, deadline=None):
+        if deadline is None:
+            return self._search_rss(params)
+        return self._search_rss(params, deadline=deadline)
+
+    def _search_rss(self, params, deadline=None):
+        """Use Pleiades RSS search interface since it gives us back structured data."""
+        uri = self._search_uri(params)
+        logger.debug(uri)
+        r = self._fetch(uri, deadline)
+        _check_status(uri, r)
+        with phase(self.metrics, "parse"):
+            hits = self._parse_rss(r.text)
+        if self.metrics is not None:
+            self.metrics.count("hits", len(hits))
         return {"query": uri, "hits": hits}
 
+    def _fetch(self, uri: str, deadline=None):
+        """Get uri, with the interface's retry policy and hedging, before the deadline.
+
+        Raises deadline.DeadlineExceeded if the deadline passes first (or has
+        already passed: then no request is made). A response with a retryable
+        status is returned once retries run out, for the caller to reject.
+        """
+        if deadline is None and self.retry is None and self.hedge is None:
+            return self.get(uri)
+        if deadline is not None and deadline.expired:
+            raise DeadlineExceeded(f"No time left to get {uri}")
+        retry = NO_RETRY if self.retry is None else self.retry
+        attempt = 0
+        while True:
+            error = r = None
+            try:
+                r = self._fetch_hedged(uri, deadline)
+            except retry.exceptions as err:
+                if isinstance(err, (DeadlineExceeded, PermissionError)):
+                    raise  # retrying would not help
+                error = err
+            else:
+                if r.status_code not in retry.statuses:
+                    return r
+            if attempt >= retry.retries:
+                if error is not None:
+                    raise error
+                return r
+            delay = retry.delay(attempt)
+            if deadline is not None and delay >= deadline.remaining():
+                raise DeadlineExceeded(f"No time left to retry {uri}")
+            reason = repr(error) if error is not None else f"HTTP {r.status_code}"
+            logger.info(f"Retrying {uri} in {delay:.3f} s after {reason}")
+            if self.metrics is not None:
+                self.metrics.count("retries")
+            time.sleep(delay)
+            attempt += 1
+
+    def _fetch_hedged(self, uri: str, deadline=None):
+        """Get uri once, or twice if the first request is slow, before the deadline.
+
+        Requests are made on a shared pool of threads so that waiting for
+        them can be bounded; one that is given up on runs on (up to the
+        transport's own timeout) but its response is discarded.
+        """
+        hedge_after = None if self.hedge is None else self.hedge.delay()
+        if deadline is None and hedge_after is None:
+            start = time.monotonic()
+            r = self.get(uri)
+            if self.hedge is not None:
+                self.hedge.observe(time.monotonic() - start)
+            return r
+        executor = self._get_fetch_executor()
+        start = time.monotonic()
+        pending = {executor.submit(self.get, uri)}
+        hedged = False
+        while True:
+            timeout = None if deadline is None else deadline.remaining()
+            if hedge_after is not None and not hedged:
+                until_hedge = max(0.0, hedge_after - (time.monotonic() - start))
+                timeout = until_hedge if timeout is None else min(timeout, until_hedge)
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None or not pending:
+                    if self.hedge is not None:
+                        self.hedge.observe(time.monotonic() - start)
+                    for other in pending:
+                        other.cancel()
+                    return future.result()
+            if done:
+                continue  # one request failed; wait for the other
+            if deadline is not None and deadline.expired:
+                for future in pending:
+                    future.cancel()
+                raise DeadlineExceeded(f"Timed out getting {uri}")
+            if hedge_after is not None and not hedged:
+                hedged = True
+                if self.metrics is not None:
+                    self.metrics.count("hedged_requests")
+                pending.add(executor.submit(self.get, uri))
+
+    def _get_fetch_executor(self):
+        if self._fetch_executor is None:
+            with self._fetch_executor_lock:
+                if self._fetch_executor is None:
+                    self._fetch_executor = ThreadPoolExecutor(
+                        max_workers=DEFAULT_MAX_FETCHES,
+                        thread_name_prefix="pleiades_fetch",
+                    )
+        return self._fetch_executor
+
+    def _count_cache(self, name: str, results):
+        if self.metrics is not None:
+            self.metrics.count(f"{name}_{'misses' if results is None else 'hits'}")
+
+    def _parse_rss(self, text):
+        """Parse the hits out of the text of a /search_rss response."""
+        import feedparser  # slow to import, so not imported until needed
+
+        entries = feedparser.parse(text).entries
+        titles = normtext_many(entry.title for entry in entries)
+        summaries = normtext_many(entry.description for entry in entries)
+        return [
+            self._make_hit(
+                entry.link,
+                title,
+                summary,
+                *_where_coordinates(entry.get("where")),
+                modified=entry.get("updated"),
+            )
+            for entry, title, summary in zip(entries, titles, summaries)
+        ]
+
+    def _search_uri(self, params):
+        return search_rss_uri(params, self.scheme, self.netloc)
+
+    def _make_hit(
+        self, link, title, summary, repr_point=None, bbox=None, modified=None
+    ):
+        hit = {
+            "id": link.split("/")[-1],
+            "uri": link,
+            "title": title,
+            "summary": summary,
+        }
+        # coordinates are only available if the feed carries GeoRSS
+        if repr_point is not None:
+            hit["reprPoint"] = repr_point
+        if bbox is not None:
+            hit["bbox"] = bbox
+        if modified:
+            hit["modified"] = modified
+        return hit
+
     def _prep_params(self, **kwargs):
-        ready_kwargs = dict()
-        for k, v in kwargs.items():
-            if v is None:
-                ready_kwargs[k] = ""
-            elif isinstance(v, str):
+        return encode_web_parameters(**kwargs)
+
+
+def encode_web_parameters(**kwargs):
+    """Encode web parameters as a query string for the Pleiades search interface."""
+    ready_kwargs = dict()
+    for k, v in kwargs.items():
+        if v is None:
+            ready_kwargs[k] = ""
+        elif isinstance(v, str):
+            ready_kwargs[k] = v
+        elif isinstance(v, list):
+            if k in ["getFeatureType", "Subject:list"]:
                 ready_kwargs[k] = v
-            elif isinstance(v, list):
-                if k in ["getFeatureType", "Subject:list"]:
-                    ready_kwargs[k] = v
-                else:
-                    ready_kwargs[f"{k}:list"] = ",".join(v)
             else:
-                raise TypeError(type(v))
-        params = urlencode(ready_kwargs, doseq=True)
-        return params
+                ready_kwargs[f"{k}:list"] = ",".join(v)
+        else:
+            raise TypeError(type(v))
+    params = urlencode(ready_kwargs, doseq=True)
+    return params
+
+
+def _coalescing_term(query: CompiledQuery):
+    """Return ((name, key of the other parameters), term) for a query that can be merged.
+
+    Returns None if the query has no single tag, feature_type or one-word text term.
+    """
+    parameters = query.parameters
+    for name in COALESCIBLE_PARAMETERS:
+        try:
+            value, _ = parameters[name]
+        except KeyError:
+            continue
+        if isinstance(value, list):
+            if len(value) != 1:
+                continue
+            value = value[0]
+        if name == "text" and (
+            len(value.split()) != 1
+            or value.upper() in {"AND", "OR", "NOT"}
+            or any(c in value for c in '"()')
+        ):
+            continue
+        rest = query.copy()
+        rest.remove_parameter(name)
+        return (name, rest.canonical_key), value
+    return None
+
+
+def _merge_queries(members: list):
+    """Return a CompiledQuery OR-ing together the terms of queries from one group."""
+    compiled, _ = members[0]
+    name, _ = _coalescing_term(compiled)[0]
+    merged = compiled.copy()
+    merged.set_parameter(name, [term for _, term in members], "OR")
+    return merged.compile()
+
+
+def hit_extent(hit: dict):
+    """Return a hit's (minx, miny, maxx, maxy) extent, or None if it has no coordinates."""
+    try:
+        return tuple(hit["bbox"])
+    except (KeyError, TypeError):
+        pass
+    try:
+        x, y = hit["reprPoint"]
+    except (KeyError, TypeError):
+        return None
+    return (x, y, x, y)
+
+
+def _check_status(uri: str, r):
+    """Raise RuntimeError unless r is a 200 response, so errors are never cached."""
+    if r.status_code != 200:
+        raise RuntimeError(f"Could not get {uri}: HTTP {r.status_code}")
+
+
+def _georss_coordinates(point: str = None, box: str = None):
+    """Convert GeoRSS "lat lon" point and box text to reprPoint and bbox lists."""
+    repr_point = bbox = None
+    try:
+        if point:
+            lat, lon = [float(v) for v in point.split()]
+            repr_point = [lon, lat]
+        if box:
+            lat0, lon0, lat1, lon1 = [float(v) for v in box.split()]
+            bbox = [lon0, lat0, lon1, lat1]
+    except ValueError:
+        logger.warning(f"Ignoring malformed GeoRSS point {point!r} or box {box!r}")
+    return repr_point, bbox
+
+
+def _where_coordinates(where: dict = None):
+    """Convert feedparser's GeoJSON-like "where" to reprPoint and bbox lists."""
+    if not where:
+        return None, None
+    if where.get("type") == "Point":
+        return list(where["coordinates"]), None
+    xs = list()
+    ys = list()
+    stack = [where.get("coordinates", ())]
+    while stack:
+        c = stack.pop()
+        if len(c) == 2 and all(isinstance(v, (int, float)) for v in c):
+            xs.append(c[0])
+            ys.append(c[1])
+        else:
+            stack.extend(c)
+    if not xs:
+        return None, None
+    return None, [min(xs), min(ys), max(xs), max(ys)]
+
+
+def _place_cache_key(hit: dict):
+    """Return the place cache key for a hit: its id, and modification date if known."""
+    try:
+        return f"{hit['id']}@{hit['modified']}"
+    except KeyError:
+        return hit["id"]
+
+
+def _place_details(place: dict):
+    """Pick the details enrich_hits adds to a hit out of a place's JSON document."""
+    details = dict()
+    for k in ["reprPoint", "bbox"]:
+        if place.get(k) is not None:
+            details[k] = place[k]
+    names = list()
+    for name in place.get("names") or []:
+        for k in ["romanized", "attested"]:
+            names.extend((name.get(k) or "").split(","))
+    details["names"] = list(OrderedDict.fromkeys(n for n in normtext_many(names) if n))
+    details["placeTypes"] = list(place.get("placeTypes") or [])
+    periods = list()
+    for section in ["names", "locations"]:
+        for item in place.get(section) or []:
+            for attestation in item.get("attestations") or []:
+                period = attestation.get("timePeriod")
+                if period and period not in periods:
+                    periods.append(period)
+    details["timePeriods"] = periods
+    return details
+
+
+def _page_params(params: str, start: int, size: int):
+    """Add Plone batching parameters for one page of results to encoded parameters."""
+    return "&".join((params, urlencode({"b_start": start, "b_size": size})))
+
+
+def search_rss_uri(params: str, scheme: str = "https", netloc: str = PLEIADES_NETLOC):
+    """Return the URI of the Pleiades RSS search for the encoded parameters."""
+    return urlunparse((scheme, netloc, "/search_rss", "", params, ""))
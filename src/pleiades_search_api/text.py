@@ -8,11 +8,31 @@
 Utilities for working with text
 """
 
+from functools import lru_cache
 import logging
+import sys
 from textnorm import normalize_space, normalize_unicode
 
+NORMTEXT_CACHE_SIZE = 65536
 logger = logging.getLogger(__name__)
 
 
 def normtext(s: str):
+    # ASCII is unchanged by Unicode normalization, so only the space needs fixing
+    if isinstance(s, str) and s.isascii():
+        return " ".join(s.split())
     return normalize_space(normalize_unicode(s))
+
+
+def normtext_many(values):
+    """Return a list of normtext of each value, reusing results for repeated values.
+
+    Results are memoized in a bounded cache and interned, so repeated values
+    (common in titles and summaries across searches) share a single string.
+    """
+    return [_normtext_cached(v) for v in values]
+
+
+@lru_cache(maxsize=NORMTEXT_CACHE_SIZE)
+def _normtext_cached(s: str):
+    return sys.intern(normtext(s))
@@ -9,10 +9,20 @@ Basic web capabilities using the webiquette package
 """
 
 from copy import deepcopy
+import json
 import logging
+from pathlib import Path
 from pleiades_search_api.text import normtext
-from webiquette.webi import Webi, DEFAULT_HEADERS
+from threading import Lock
+import time
+from urllib.parse import urlunparse
 
+# requests and webiquette are slow to import, so they are imported where they
+# are first needed: importing this module and making a transport stay cheap
+
+DEFAULT_CRAWL_DELAY = 1.0  # seconds, if robots.txt does not say
+DEFAULT_POOL_MAXSIZE = 10
+DEFAULT_TIMEOUT = 30.0  # seconds
 DEFAULT_USER_AGENT = (
     "pleiades_search_api/0.0.1 (+https://github.com/isawnyu/pleiades_search_api)"
 )
@@ -22,33 +32,350 @@ logger = logging.getLogger(__name__)
 class Web:
     """Base mixin for providing web-aware functionality to API interface classes."""
 
+    def __init__(
+        self,
+        netloc: str,
+        user_agent=DEFAULT_USER_AGENT,
+        transport=None,
+        metrics=None,
+        **kwargs,
+    ):
+        """Set up the web client for netloc.
+
+        By default each instance gets its own WebiTransport, which sets up its
+        web client on the first request. Pass transport to
+        use another implementation, or to share one transport (and with it the
+        connection pool and politeness state) among several instances; the
+        transport's own headers are then used. Pass a metrics.Metrics to count
+        requests and bytes and time each request; it is also given to a
+        transport that can record its own metrics but has none yet.
+        """
+        if transport is None:
+            transport = WebiTransport(netloc, user_agent=user_agent, **kwargs)
+        self.transport = transport
+        self.metrics = metrics
+        if metrics is not None and getattr(transport, "metrics", False) is None:
+            transport.metrics = metrics
+
+    @property
+    def web(self):
+        """The HTTP client in use (a Transport)."""
+        return self.transport
+
+    def get(self, uri: str, headers: dict = None):
+        """HTTP get using caching, robots:crawl-delay, etc."""
+        if self.metrics is None:
+            return self.transport.get(uri, headers=headers)
+        with self.metrics.phase("fetch"):
+            r = self.transport.get(uri, headers=headers)
+        self.metrics.count("requests")
+        self.metrics.count(f"status_{r.status_code}")
+        _count_bytes_received(self.metrics, r)
+        if getattr(r, "from_cache", False):
+            self.metrics.count("responses_from_cache")
+        return r
+
+
+def _count_bytes_received(metrics, r):
+    """Count the bytes of a response body without reading a streamed body early.
+
+    Content-Length is used if the response has it; otherwise a body not yet
+    read is counted as it is read.
+    """
+    length = r.headers.get("Content-Length", "")
+    if length.isdigit():
+        metrics.count("bytes_received", int(length))
+    elif getattr(r, "_content_consumed", True):
+        metrics.count("bytes_received", len(r.content))
+    else:
+        iter_content = r.iter_content  # also used by r.content
+
+        def counting_iter_content(*args, **kwargs):
+            for chunk in iter_content(*args, **kwargs):
+                metrics.count("bytes_received", len(chunk))
+                yield chunk
+
+        r.iter_content = counting_iter_content
+
+
+def make_headers(user_agent=DEFAULT_USER_AGENT, accept=None):
+    """Return default request headers with the user agent (and accept) set."""
+    return _headers(check_user_agent(user_agent), accept)
+
+
+def check_user_agent(user_agent=DEFAULT_USER_AGENT):
+    """Return the normalized user agent, warning if it is the default."""
+    ua = None
+    try:
+        ua = normtext(user_agent)
+    except TypeError:
+        pass
+    if not ua:
+        ua = DEFAULT_USER_AGENT
+    if ua == DEFAULT_USER_AGENT:
+        logger.warning(
+            f'Using default HTTP Request header for User-Agent = "{ua}". '
+            "We strongly prefer you define your own unique user-agent string."
+        )
+    return ua
+
+
+def _headers(user_agent: str, accept=None):
+    from webiquette.webi import DEFAULT_HEADERS
+
+    headers = deepcopy(DEFAULT_HEADERS)
+    headers["User-Agent"] = user_agent
+    if accept is not None:
+        headers["accept"] = accept
+    return headers
+
+
+class Transport:
+    """Interface for the HTTP clients Web can use.
+
+    Implementations provide get() and netloc and user_agent attributes.
+    """
+
+    def get(self, uri: str, headers: dict = None):
+        """Return a requests.Response for an HTTP GET of uri."""
+        raise NotImplementedError
+
+
+class WebiTransport(Transport):
+    """Transport using webiquette, with caching and robots.txt handling (default).
+
+    The webiquette.webi.Webi client is only made when it is first needed.
+    Attributes not defined here are those of the Webi client.
+    """
+
     def __init__(self, netloc: str, user_agent=DEFAULT_USER_AGENT, **kwargs):
-        headers = deepcopy(DEFAULT_HEADERS)
-        ua = None
-        try:
-            ua = normtext(user_agent)
-        except TypeError:
-            pass
-        if not ua:
-            ua = DEFAULT_USER_AGENT
-        if ua == DEFAULT_USER_AGENT:
-            logger.warning(
-                f'Using default HTTP Request header for User-Agent = "{ua}". '
-                "We strongly prefer you define your own unique user-agent string."
-            )
-        headers["User-Agent"] = ua
-        try:
-            headers["accept"] = kwargs["accept"]
-        except KeyError:
-            pass
-        web_kwargs = dict()
+        self.netloc = netloc
+        self.user_agent = check_user_agent(user_agent)
+        self.accept = kwargs.get("accept")
+        self.respect_robots_txt = kwargs.get("respect_robots_txt", True)
+        self._web_kwargs = dict()
         if kwargs:
             for k, v in kwargs.items():
                 if k in {"respect_robots_txt", "cache_control", "expire_after"}:
-                    web_kwargs[k] = v
+                    self._web_kwargs[k] = v
+        self._webi = None
+        self._webi_lock = Lock()
 
-        self.web = Webi(netloc=netloc, headers=headers, **web_kwargs)
+    @property
+    def webi(self):
+        """The webiquette.webi.Webi client, made on first use."""
+        if self._webi is None:
+            with self._webi_lock:
+                if self._webi is None:
+                    from webiquette.webi import Webi
 
-    def get(self, uri: str):
-        """HTTP get using caching, robots:crawl-delay, etc."""
-        return self.web.get(uri)
+                    self._webi = Webi(
+                        netloc=self.netloc,
+                        headers=_headers(self.user_agent, self.accept),
+                        **self._web_kwargs,
+                    )
+        return self._webi
+
+    def __getattr__(self, name):
+        if name.startswith("_") or name == "webi":
+            raise AttributeError(name)
+        return getattr(self.webi, name)
+
+    def get(self, uri: str, headers: dict = None):
+        if headers:
+            return self.webi.get(uri, additional_headers=headers)
+        return self.webi.get(uri)
+
+
+class SessionTransport(Transport):
+    """Transport using one pooled, keep-alive requests session for a host.
+
+    Honors robots.txt (fetched once, on first use) and its crawl-delay, which is
+    enforced across all threads and all Web instances sharing the transport.
+    Pass a ratelimit.RateLimiter as rate_limiter to pace requests with it
+    instead: it is seeded from the crawl-delay, adapts to the responses, and
+    can be shared with other processes. No response caching is done. Time
+    spent sleeping for the crawl-delay is recorded as "crawl_delay_sleep" if
+    metrics are given.
+    """
+
+    def __init__(
+        self,
+        netloc: str,
+        user_agent=DEFAULT_USER_AGENT,
+        scheme: str = "https",
+        respect_robots_txt: bool = True,
+        crawl_delay: float = None,
+        pool_maxsize: int = DEFAULT_POOL_MAXSIZE,
+        timeout: float = DEFAULT_TIMEOUT,
+        accept: str = None,
+        metrics=None,
+        rate_limiter=None,
+    ):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.netloc = netloc
+        self.scheme = scheme
+        self.metrics = metrics
+        self.rate_limiter = rate_limiter
+        self._rate_limiter_seeded = False
+        self.headers = make_headers(user_agent, accept)
+        self.user_agent = self.headers["User-Agent"]
+        self.respect_robots_txt = respect_robots_txt
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update(self.headers)
+        self._crawl_delay = crawl_delay
+        self._robots = None
+        self._robots_lock = Lock()
+        self._politeness_lock = Lock()
+        self._next_request = 0.0
+
+    @property
+    def crawl_delay(self):
+        """Seconds to wait between requests (explicit, from robots.txt, or default)."""
+        if self._crawl_delay is not None:
+            return self._crawl_delay
+        if self.respect_robots_txt:
+            delay = self._get_robots().crawl_delay(self.user_agent)
+            if delay is not None:
+                return float(delay)
+        return DEFAULT_CRAWL_DELAY
+
+    def get(self, uri: str, headers: dict = None):
+        if self.respect_robots_txt and not self._get_robots().can_fetch(
+            self.user_agent, uri
+        ):
+            raise PermissionError(f"robots.txt for {self.netloc} disallows {uri}")
+        if self.rate_limiter is None:
+            self._wait_politely()
+            return self.session.get(uri, headers=headers, timeout=self.timeout)
+        if not self._rate_limiter_seeded:
+            self.rate_limiter.seed(self.crawl_delay)
+            self._rate_limiter_seeded = True
+        wait = self.rate_limiter.acquire()
+        if wait > 0 and self.metrics is not None:
+            self.metrics.observe("crawl_delay_sleep", wait)
+        start = time.monotonic()
+        r = self.session.get(uri, headers=headers, timeout=self.timeout)
+        self.rate_limiter.record(
+            r.status_code, time.monotonic() - start, r.headers.get("Retry-After")
+        )
+        return r
+
+    def close(self):
+        """Close pooled connections."""
+        self.session.close()
+
+    def _get_robots(self):
+        with self._robots_lock:
+            if self._robots is None:
+                from urllib.robotparser import RobotFileParser
+
+                robots = RobotFileParser()
+                uri = urlunparse((self.scheme, self.netloc, "/robots.txt", "", "", ""))
+                try:
+                    r = self.session.get(uri, timeout=self.timeout)
+                except OSError as err:  # includes requests.RequestException
+                    logger.warning(f"Could not read {uri}: {err}")
+                    robots.parse([])
+                else:
+                    if r.status_code in {401, 403}:
+                        robots.disallow_all = True
+                    elif r.status_code >= 400:
+                        robots.allow_all = True
+                    else:
+                        robots.parse(r.text.splitlines())
+                self._robots = robots
+            return self._robots
+
+    def _wait_politely(self):
+        delay = self.crawl_delay
+        with self._politeness_lock:
+            now = time.monotonic()
+            wait = self._next_request - now
+            if wait > 0:
+                time.sleep(wait)
+                now += wait
+            self._next_request = now + delay
+        if wait > 0 and self.metrics is not None:
+            self.metrics.observe("crawl_delay_sleep", wait)
+
+
+class ReplayTransport(Transport):
+    """In-memory transport that answers from stored responses.
+
+    Responses can be added directly, loaded from a JSON file written by save(),
+    or recorded by passing another transport as record_from: requests for URIs
+    not yet stored are then made through it and the responses kept. Without
+    record_from, unknown URIs get a 404 response.
+    """
+
+    def __init__(self, netloc: str = None, record_from: Transport = None):
+        self.netloc = netloc
+        self.record_from = record_from
+        self.user_agent = getattr(record_from, "user_agent", None)
+        self.responses = dict()  # uri -> (status, headers, body bytes)
+        self.requests = list()
+        self._lock = Lock()
+
+    def add(self, uri: str, body, status: int = 200, headers: dict = None):
+        """Store a response for uri; body may be bytes or str (stored as UTF-8)."""
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        with self._lock:
+            self.responses[uri] = (status, dict(headers or {}), body)
+
+    def get(self, uri: str, headers: dict = None):
+        with self._lock:
+            self.requests.append(uri)
+            try:
+                status, response_headers, body = self.responses[uri]
+            except KeyError:
+                stored = False
+            else:
+                stored = True
+        if stored:
+            return _make_response(uri, status, response_headers, body)
+        if self.record_from is None:
+            return _make_response(uri, 404, {}, b"")
+        r = self.record_from.get(uri, headers=headers)
+        self.add(uri, r.content, r.status_code, dict(r.headers))
+        return r
+
+    def load(self, path):
+        """Add the responses stored in a JSON file written by save()."""
+        data = json.loads(Path(path).read_text(encoding="utf-8"))
+        for uri, response in data.items():
+            self.add(uri, response["body"], response["status"], response["headers"])
+
+    def save(self, path):
+        """Write the stored responses to a JSON file."""
+        with self._lock:
+            data = {
+                uri: {
+                    "status": status,
+                    "headers": headers,
+                    "body": body.decode("utf-8", errors="replace"),
+                }
+                for uri, (status, headers, body) in self.responses.items()
+            }
+        Path(path).write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+
+
+def _make_response(uri: str, status: int, headers: dict, body: bytes):
+    import requests
+    from requests.structures import CaseInsensitiveDict
+
+    r = requests.Response()
+    r.url = uri
+    r.status_code = status
+    r.headers = CaseInsensitiveDict(headers)
+    r._content = body
+    r._content_consumed = True
+    r.encoding = requests.utils.get_encoding_from_headers(r.headers) or "utf-8"
+    return r
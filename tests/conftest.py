@@ -0,0 +1,123 @@
+#
+# This file is part of pleiades_search_api
+# by Tom Elliott for the Institute for the Study of the Ancient World
+# (c) Copyright 2024 by New York University
+# Licensed under the AGPL-3.0; see LICENSE.txt file.
+#
+
+"""
+Fixtures shared by the test modules: canned searches, transports and a server
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from pleiades_search_api.search import PLEIADES_NETLOC, search_rss_uri
+from pleiades_search_api.web import ReplayTransport
+import pytest
+from threading import Thread
+import time
+
+# RSS 1.0 as served by /search_rss (no GeoRSS)
+RSS_HEAD = """<?xml version="1.0" encoding="utf-8" ?>
+<rdf:RDF
+  xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+  xmlns:dc="http://purl.org/dc/elements/1.1/"
+  xmlns="http://purl.org/rss/1.0/">
+<channel rdf:about="https://pleiades.stoa.org/search_rss"><title>Pleiades</title></channel>
+"""
+RSS_ITEM = """<item rdf:about="https://pleiades.stoa.org/places/{pid}">
+  <title>{title}</title>
+  <link>https://pleiades.stoa.org/places/{pid}</link>
+  <description>{title} was an ancient place.</description>
+  <dc:date>2024-01-01T00:00:00Z</dc:date>
+</item>
+"""
+ZUCCHABAR = (("295374", "Zucchabar"),)
+
+
+def make_rss(places=ZUCCHABAR):
+    """Return a /search_rss response for (place id, title) pairs."""
+    items = "".join(RSS_ITEM.format(pid=pid, title=title) for pid, title in places)
+    return RSS_HEAD + items + "</rdf:RDF>\n"
+
+
+class SearchTransport(ReplayTransport):
+    """A ReplayTransport for Pleiades that can also store search responses."""
+
+    def __init__(self):
+        super().__init__(netloc=PLEIADES_NETLOC)
+
+    def add_search(self, query, places=ZUCCHABAR, status=200, headers=None):
+        """Store a response listing places for query; return the search URI."""
+        uri = search_rss_uri(query.compile().encoded)
+        self.add(uri, make_rss(places), status, headers)
+        return uri
+
+
+class ScriptedTransport(SearchTransport):
+    """Answer each request with RSS after a delay and with a status, in turn."""
+
+    def __init__(self, script):
+        super().__init__()
+        self.script = list(script)  # (seconds, status); the last one repeats
+        self._count = count()
+
+    def get(self, uri, headers=None):
+        n = next(self._count)
+        seconds, status = self.script[min(n, len(self.script) - 1)]
+        time.sleep(seconds)
+        self.add(uri, make_rss(), status)
+        return super().get(uri, headers)
+
+
+@pytest.fixture
+def rss():
+    """Return a function making /search_rss responses (see make_rss)."""
+    return make_rss
+
+
+@pytest.fixture
+def replay():
+    """Return an empty SearchTransport."""
+    return SearchTransport()
+
+
+@pytest.fixture
+def scripted():
+    """Return a function making a ScriptedTransport from (seconds, status) pairs."""
+    return ScriptedTransport
+
+
+@pytest.fixture
+def server():
+    """Serve HTTP on localhost; yield its netloc and the (path, port) requested.
+
+    Searches (/search_rss?...) are answered with make_rss(), robots.txt with a
+    zero crawl-delay, and any other path with the User-Agent it was sent.
+    """
+    requests_seen = list()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            requests_seen.append((self.path, self.client_address[1]))
+            if self.path == "/robots.txt":
+                body = b"User-agent: *\nCrawl-delay: 0\nDisallow: /private\n"
+            elif self.path.startswith("/search_rss?"):
+                body = make_rss().encode("utf-8")
+            else:
+                body = self.headers.get("User-Agent", "").encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield "{}:{}".format(*httpd.server_address), requests_seen
+    httpd.shutdown()
+    httpd.server_close()
@@ -0,0 +1,101 @@
+#
+# This file is part of pleiades_search_api
+# by Tom Elliott for the Institute for the Study of the Ancient World
+# (c) Copyright 2024 by New York University
+# Licensed under the AGPL-3.0; see LICENSE.txt file.
+#
+
+"""
+Test the pleiades_search_api.async_search module
+"""
+import asyncio
+import logging
+from pathlib import Path
+from pleiades_search_api.async_search import AsyncSearchInterface
+from pleiades_search_api.metrics import Metrics
+from pleiades_search_api.search import Query, SearchInterface
+from pleiades_search_api.web import SessionTransport
+import pytest
+import time
+
+fn = Path(__file__).name
+logger = logging.getLogger(fn)
+
+UA = "CosmicBurritoBot/7.3 (+http://nowhere.com/cosmicburritobot)"
+
+
+class TestAsyncSearch:
+    asi = AsyncSearchInterface(max_in_flight=2)
+
+    def test_init_max_in_flight(self):
+        with pytest.raises(ValueError):
+            AsyncSearchInterface(max_in_flight=0)
+
+    def test_init_shares_web(self):
+        assert self.asi.web is self.asi.search_interface.web
+        assert self.asi.web.netloc == "pleiades.stoa.org"
+        assert isinstance(self.asi.web, SessionTransport)
+
+    def test_search_title(self):
+        q = Query()
+        q.set_parameter("title", "Zucchabar")
+        results = asyncio.run(self.asi.search(q))
+        assert len(results["hits"]) == 1
+        assert results["hits"][0]["id"] == "295374"
+
+    def test_search_many(self):
+        queries = list()
+        for title in ["Zucchabar", "Luxmanda"]:
+            q = Query()
+            q.set_parameter("title", title)
+            queries.append(q)
+        results = asyncio.run(self.asi.search_many(queries))
+        assert len(results) == 2
+        assert results[0]["hits"][0]["id"] == "295374"
+        assert results[1]["hits"][0]["id"] == "896643025"
+
+    def test_search_offline(self, replay):
+        m = Metrics()
+        si = SearchInterface(transport=replay, metrics=m)
+        q = Query()
+        q.set_parameter("title", "Zucchabar")
+        replay.add_search(q)
+
+        async def search():
+            async with AsyncSearchInterface(search_interface=si) as asi:
+                return await asi.search(q, timeout=10.0)
+
+        results = asyncio.run(search())
+        assert results["status"] == "complete"
+        assert results["hits"][0]["id"] == "295374"
+        assert m.snapshot()["counters"]["searches"] == 1
+
+
+class TestAsyncCrawlDelay:
+    def test_requests_spaced(self, server):
+        netloc, seen = server
+        t = SessionTransport(netloc, user_agent=UA, scheme="http", crawl_delay=0.2)
+        sent = list()
+        get = t.session.get
+
+        def timed_get(uri, **kwargs):
+            sent.append(time.monotonic())
+            return get(uri, **kwargs)
+
+        t.session.get = timed_get
+        si = SearchInterface(transport=t, scheme="http", netloc=netloc)
+        queries = list()
+        for title in ["Zucchabar", "Luxmanda", "Roma", "Gadir"]:
+            q = Query()
+            q.set_parameter("title", title)
+            queries.append(q)
+
+        async def search_many():
+            async with AsyncSearchInterface(search_interface=si) as asi:
+                return await asi.search_many(queries)
+
+        results = asyncio.run(search_many())
+        assert [r["hits"][0]["id"] for r in results] == ["295374"] * 4
+        assert [path.split("?")[0] for path, port in seen].count("/search_rss") == 4
+        sent = sorted(sent[1:])  # the first request is for robots.txt
+        assert min(b - a for a, b in zip(sent, sent[1:])) >= 0.15
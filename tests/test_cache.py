@@ -0,0 +1,292 @@
+#
+# This file is part of pleiades_search_api
+# by Tom Elliott for the Institute for the Study of the Ancient World
+# (c) Copyright 2024 by New York University
+# Licensed under the AGPL-3.0; see LICENSE.txt file.
+#
+
+"""
+Test the pleiades_search_api.cache module
+"""
+import json
+import logging
+import multiprocessing
+from pathlib import Path
+from pleiades_search_api.cache import (
+    DiskCache,
+    LRUCache,
+    ResultCache,
+    SharedCache,
+    SpatialCache,
+)
+from pleiades_search_api.deadline import Deadline, DeadlineExceeded
+from pleiades_search_api.results import decode_results, encode_results
+from pleiades_search_api.search import Query
+import pytest
+import sys
+from threading import Thread
+import time
+
+fn = Path(__file__).name
+logger = logging.getLogger(fn)
+
+RESULTS = {
+    "query": "https://pleiades.stoa.org/search_rss?Title=Zucchabar",
+    "hits": [{"id": "295374", "title": "Zucchabar"}],
+}
+
+
+class TestLRUCache:
+    def test_get_put(self):
+        c = LRUCache(maxsize=2)
+        assert c.get("a") is None
+        c.put("a", RESULTS)
+        assert c.get("a") is RESULTS
+        assert c.stats["hits"] == 1
+        assert c.stats["misses"] == 1
+
+    def test_eviction(self):
+        c = LRUCache(maxsize=2)
+        c.put("a", 1)
+        c.put("b", 2)
+        assert c.get("a") == 1  # b is now least recently used
+        c.put("c", 3)
+        assert c.get("b") is None
+        assert c.get("a") == 1
+        assert c.get("c") == 3
+        assert c.stats["evictions"] == 1
+        assert len(c) == 2
+
+    def test_ttl(self):
+        c = LRUCache(ttl=-1)
+        c.put("a", 1)
+        assert c.get("a") is None
+        assert c.stats["expirations"] == 1
+
+    def test_maxsize(self):
+        with pytest.raises(ValueError):
+            LRUCache(maxsize=0)
+
+
+class TestDiskCache:
+    def test_persistent(self, tmp_path):
+        path = tmp_path / "results.db"
+        c = DiskCache(path)
+        c.put("a", RESULTS)
+        assert c.get("a") == RESULTS
+        assert DiskCache(path).get("a") == RESULTS
+
+    def test_ttl(self, tmp_path):
+        c = DiskCache(tmp_path / "results.db", ttl=-1)
+        c.put("a", RESULTS)
+        assert c.get("a") is None
+        assert len(c) == 0
+
+
+def slow_fetch(calls_path):
+    """Return a fetch function that records its calls in a file and takes a while."""
+
+    def fetch():
+        with open(calls_path, "a") as f:
+            f.write("fetch\n")
+        time.sleep(0.3)
+        return RESULTS
+
+    return fetch
+
+
+def shared_get_or_fetch(args):
+    path, calls_path = args
+    return SharedCache(path).get_or_fetch("a", slow_fetch(calls_path))
+
+
+class TestSharedCache:
+    def test_encoding(self):
+        results = {
+            "query": RESULTS["query"],
+            "hits": [
+                {
+                    "id": "295374",
+                    "uri": "https://pleiades.stoa.org/places/295374",
+                    "title": "Zucchabar",
+                    "summary": "An ancient city",
+                    "reprPoint": [2.223758, 36.304939],
+                    "bbox": [2.2, 36.3, 2.25, 36.31],
+                    "modified": "2024-01-02T03:04:05Z",
+                    "names": ["Zucchabar", "Succabar"],
+                },
+                {"id": "x-1", "uri": "https://example.org/x-1"},
+            ],
+            "truncated": False,
+        }
+        assert decode_results(encode_results(results)) == results
+        hits = [dict(results["hits"][0], id=str(i)) for i in range(100)]
+        for hit in hits:
+            hit["uri"] = f"https://pleiades.stoa.org/places/{hit['id']}"
+        many = {"query": RESULTS["query"], "hits": hits}
+        assert len(encode_results(many)) < len(json.dumps(many)) / 4
+
+    def test_get_put(self, tmp_path):
+        path = tmp_path / "shared.db"
+        c = SharedCache(path)
+        assert c.get("a") is None
+        c.put("a", RESULTS)
+        assert c.get("a") == RESULTS
+        assert SharedCache(path).get("a") == RESULTS
+        assert len(c) == 1
+
+    def test_ttl(self, tmp_path):
+        c = SharedCache(tmp_path / "shared.db", ttl=-1)
+        c.put("a", RESULTS)
+        assert c.get("a") is None
+        assert c.stats["expirations"] == 1
+
+    def test_single_flight(self, tmp_path):
+        # separate caches on one file stand in for separate processes
+        path = tmp_path / "shared.db"
+        calls_path = tmp_path / "calls"
+        caches = [SharedCache(path, poll=0.01) for _ in range(4)]
+        values = list()
+        threads = [
+            Thread(
+                target=lambda c: values.append(
+                    c.get_or_fetch("a", slow_fetch(calls_path))
+                ),
+                args=(c,),
+            )
+            for c in caches
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert values == [RESULTS] * 4
+        assert calls_path.read_text().count("fetch") == 1
+        assert sum(c.stats["waits"] for c in caches) == 3
+        assert sum(c.stats["misses"] for c in caches) == 4
+
+    def test_failed_fetch(self, tmp_path):
+        c = SharedCache(tmp_path / "shared.db")
+
+        def fail():
+            raise OSError("no connection")
+
+        with pytest.raises(OSError):
+            c.get_or_fetch("a", fail)
+        assert c.get_or_fetch("a", lambda: RESULTS) == RESULTS
+
+    def test_lease_deadline(self, tmp_path):
+        path = tmp_path / "shared.db"
+        holder = SharedCache(path)
+        assert holder._acquire("a", "someone else")
+        with pytest.raises(DeadlineExceeded):
+            SharedCache(path).get_or_fetch("a", lambda: RESULTS, deadline=Deadline(0.1))
+        # a lapsed lease is taken over
+        waiter = SharedCache(path, lease=0.0)
+        assert waiter._acquire("a", "me") is False
+        holder.lease = 0.0
+        holder._release("a", "someone else")
+        assert holder._acquire("a", "someone else")
+        time.sleep(0.01)
+        assert waiter.get_or_fetch("a", lambda: RESULTS) == RESULTS
+
+    @pytest.mark.skipif(sys.platform == "win32", reason="needs fork")
+    def test_processes(self, tmp_path):
+        path = tmp_path / "shared.db"
+        calls_path = tmp_path / "calls"
+        SharedCache(path).get("warm")  # connect before forking
+        with multiprocessing.get_context("fork").Pool(3) as pool:
+            values = pool.map(shared_get_or_fetch, [(path, calls_path)] * 3)
+        assert values == [RESULTS] * 3
+        assert calls_path.read_text().count("fetch") == 1
+
+
+class TestResultCache:
+    def test_promotion(self, tmp_path):
+        disk = DiskCache(tmp_path / "results.db")
+        disk.put("a", RESULTS)
+        c = ResultCache(memory=LRUCache(), disk=disk)
+        assert c.get("a") == RESULTS
+        assert c.stats["memory"]["misses"] == 1
+        assert c.get("a") == RESULTS
+        assert c.stats["memory"]["hits"] == 1
+        assert c.stats["disk"]["hits"] == 1
+
+    def test_get_or_fetch(self, tmp_path):
+        c = ResultCache(memory=LRUCache(), disk=SharedCache(tmp_path / "shared.db"))
+        assert c.get_or_fetch("a", lambda: RESULTS) == RESULTS
+        assert c.memory.get("a") == RESULTS
+        assert c.disk.stats["fetches"] == 1
+
+    def test_default_memory(self):
+        c = ResultCache()
+        c.put("a", RESULTS)
+        assert c.get("a") is RESULTS
+        assert c.stats["disk"] is None
+
+
+def bbox_query(bounds, **kwargs):
+    q = Query()
+    q.set_parameter("bbox", bounds)
+    for k, v in kwargs.items():
+        q.set_parameter(k, v)
+    return q
+
+
+SPATIAL_RESULTS = {
+    "query": "https://pleiades.stoa.org/search_rss?lowerLeft=2.0001%2C36.0001",
+    "hits": [
+        {"id": "295374", "reprPoint": [2.25, 36.35]},
+        {"id": "295304", "bbox": [2.1, 36.1, 2.2, 36.2]},
+        {"id": "289924", "reprPoint": [2.45, 36.05]},
+    ],
+}
+
+
+class TestSpatialCache:
+    def test_contained(self):
+        c = SpatialCache()
+        assert c.put(bbox_query((2.0, 36.0, 2.5, 36.5)), SPATIAL_RESULTS)
+        results = c.get(bbox_query((2.15, 36.15, 2.3, 36.4)))
+        assert [hit["id"] for hit in results["hits"]] == ["295374", "295304"]
+        assert "lowerLeft=2.1501" in results["query"]
+        assert c.stats["hits"] == 1
+
+    def test_not_contained(self):
+        c = SpatialCache()
+        c.put(bbox_query((2.0, 36.0, 2.5, 36.5)), SPATIAL_RESULTS)
+        assert c.get(bbox_query((2.15, 36.15, 2.6, 36.4))) is None
+        assert c.stats["misses"] == 1
+
+    def test_other_parameters(self):
+        c = SpatialCache()
+        c.put(bbox_query((2.0, 36.0, 2.5, 36.5), title="Zucchabar"), SPATIAL_RESULTS)
+        assert c.get(bbox_query((2.1, 36.1, 2.4, 36.4))) is None
+        assert c.get(bbox_query((2.1, 36.1, 2.4, 36.4), title="Zucchabar"))
+
+    def test_rejections(self):
+        c = SpatialCache()
+        hits = [{"id": str(i), "reprPoint": [2.1, 36.1]} for i in range(100)]
+        full = {"query": "", "hits": hits}
+        assert not c.put(bbox_query((2.0, 36.0, 2.5, 36.5)), full)
+        full["truncated"] = False
+        assert c.put(bbox_query((2.0, 36.0, 2.5, 36.5)), full)
+        no_coordinates = {"query": "", "hits": [{"id": "295374"}]}
+        assert not c.put(bbox_query((2.0, 36.0, 2.5, 36.5)), no_coordinates)
+        assert not c.put(Query(), SPATIAL_RESULTS)
+        assert c.stats["rejections"] == 2
+
+    def test_incomplete(self):
+        c = SpatialCache()
+        for status in ("timed_out", "partial"):
+            results = dict(SPATIAL_RESULTS, hits=[], status=status)
+            assert not c.put(bbox_query((2.0, 36.0, 2.5, 36.5)), results)
+        assert c.stats["rejections"] == 2
+
+    def test_eviction(self):
+        c = SpatialCache(maxsize=1)
+        c.put(bbox_query((2.0, 36.0, 2.5, 36.5)), SPATIAL_RESULTS)
+        c.put(bbox_query((3.0, 36.0, 3.5, 36.5)), {"query": "", "hits": []})
+        assert len(c) == 1
+        assert c.get(bbox_query((2.1, 36.1, 2.4, 36.4))) is None
+        assert c.get(bbox_query((3.1, 36.1, 3.4, 36.4)))["hits"] == []
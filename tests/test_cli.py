@@ -0,0 +1,109 @@
+#
+# This file is part of pleiades_search_api
+# by Tom Elliott for the Institute for the Study of the Ancient World
+# (c) Copyright 2024 by New York University
+# Licensed under the AGPL-3.0; see LICENSE.txt file.
+#
+
+"""
+Test the pleiades_search_api.cli module
+"""
+import io
+import json
+import logging
+from pathlib import Path
+from pleiades_search_api.cli import Checkpoint, main, parse_query, run
+import pytest
+
+fn = Path(__file__).name
+logger = logging.getLogger(fn)
+
+UA = "CosmicBurritoBot/7.3 (+http://nowhere.com/cosmicburritobot)"
+PLACES = {"295374": "Zucchabar", "896643025": "Luxmanda", "423025": "Roma"}
+
+
+@pytest.fixture
+def transport(replay):
+    for pid, title in PLACES.items():
+        replay.add_search(parse_query({"title": title}), [(pid, title)])
+    return replay
+
+
+def input_lines(n=30):
+    titles = list(PLACES.values())
+    return [
+        json.dumps({"id": f"q{i}", "title": titles[i % len(titles)]}) + "\n"
+        for i in range(n)
+    ]
+
+
+class TestCLI:
+    def test_parse_query(self):
+        q = parse_query(
+            {
+                "id": "x",
+                "text": {"value": ["Punic", "Phoenician"], "operator": "OR"},
+                "bbox": [-4.0, 33.0, 2.0, 40.0],
+            }
+        )
+        assert q.parameters["text"] == (["Punic", "Phoenician"], "OR")
+        assert q.parameters["bbox"] == ((-4.0, 33.0, 2.0, 40.0), None)
+
+    def test_run_ordered(self, transport):
+        out = io.StringIO()
+        lines = input_lines() + ["\n", "not json\n", '{"colour": "red"}\n']
+        checkpoint = Checkpoint()
+        run(lines, out, checkpoint=checkpoint, user_agent=UA, transport=transport)
+        results = [json.loads(line) for line in out.getvalue().splitlines()]
+        assert [r["line"] for r in results] == list(range(1, 31)) + [32, 33]
+        assert checkpoint.done == 33
+        assert results[0]["id"] == "q0"
+        assert results[1]["hits"][0]["id"] == "896643025"
+        assert results[-2]["error"].startswith("JSONDecodeError")
+        assert results[-1]["error"].startswith("ValueError")
+
+    def test_run_unordered(self, transport):
+        out = io.StringIO()
+        run(input_lines(), out, ordered=False, user_agent=UA, transport=transport)
+        results = [json.loads(line) for line in out.getvalue().splitlines()]
+        assert sorted(r["line"] for r in results) == list(range(1, 31))
+
+    def test_resume(self, transport, tmp_path):
+        checkpoint = Checkpoint(tmp_path / "checkpoint.json")
+        for n in [1, 2, 3, 5]:
+            checkpoint.add(n)
+        checkpoint.save()
+        checkpoint = Checkpoint(tmp_path / "checkpoint.json")
+        assert checkpoint.done == 3
+        out = io.StringIO()
+        run(
+            input_lines(6),
+            out,
+            checkpoint=checkpoint,
+            user_agent=UA,
+            transport=transport,
+        )
+        assert [json.loads(line)["line"] for line in out.getvalue().splitlines()] == [
+            4,
+            6,
+        ]
+        assert Checkpoint(tmp_path / "checkpoint.json").done == 6
+
+    def test_main_processes(self, tmp_path):
+        # lines that fail before any request is made
+        infile = tmp_path / "in.jsonl"
+        infile.write_text("not json\n" + '{"colour": "red"}\n' * 3, encoding="utf-8")
+        outfile = tmp_path / "out.jsonl"
+        args = [str(infile), "-o", str(outfile), "-p", "2", "--user-agent", UA]
+        assert main(args) == 0
+        results = [json.loads(line) for line in outfile.read_text().splitlines()]
+        assert [r["line"] for r in results] == [1, 2, 3, 4]
+        assert all("error" in r for r in results)
+
+    def test_workers_and_processes(self, capsys):
+        with pytest.raises(SystemExit) as excinfo:
+            main(["-w", "4", "-p", "2", "--user-agent", UA])
+        assert excinfo.value.code == 2
+        assert "--workers or --processes" in capsys.readouterr().err
+        with pytest.raises(ValueError):
+            run([], io.StringIO(), workers=4, processes=2, user_agent=UA)
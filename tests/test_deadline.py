@@ -0,0 +1,65 @@
+#
+# This file is part of pleiades_search_api
+# by Tom Elliott for the Institute for the Study of the Ancient World
+# (c) Copyright 2024 by New York University
+# Licensed under the AGPL-3.0; see LICENSE.txt file.
+#
+
+"""
+Test the pleiades_search_api.deadline module
+"""
+import logging
+from pathlib import Path
+from pleiades_search_api.deadline import Deadline, Hedge, RetryPolicy, make_deadline
+import pytest
+
+fn = Path(__file__).name
+logger = logging.getLogger(fn)
+
+
+class TestDeadline:
+    def test_deadline(self):
+        d = Deadline(10.0)
+        assert 9.0 < d.remaining() <= 10.0
+        assert not d.expired
+        assert d.within(20.0) is d
+        assert d.within(1.0).remaining() <= 1.0
+        assert Deadline(-1.0).remaining() == 0.0
+        assert Deadline(0.0).expired
+
+    def test_make_deadline(self):
+        assert make_deadline() is None
+        assert make_deadline(1.0).remaining() <= 1.0
+        d = Deadline(0.5)
+        assert make_deadline(None, d) is d
+        assert make_deadline(5.0, d) is d
+
+
+class TestRetryPolicy:
+    def test_delay(self):
+        policy = RetryPolicy(backoff=0.1, max_backoff=0.3)
+        for attempt, ceiling in [(0, 0.1), (1, 0.2), (2, 0.3), (5, 0.3)]:
+            delays = [policy.delay(attempt) for _ in range(100)]
+            assert all(0.0 <= d <= ceiling for d in delays)
+        assert len(set(delays)) > 1
+
+
+class TestHedge:
+    def test_delay(self):
+        hedge = Hedge(percentile=90.0, min_samples=10)
+        for i in range(9):
+            hedge.observe(i / 100)
+        assert hedge.delay() is None
+        hedge.observe(0.09)
+        assert hedge.delay() == 0.09
+        hedge = Hedge(percentile=90.0, min_samples=10)
+        for i in range(100):
+            hedge.observe(i / 100)
+        assert hedge.delay() == pytest.approx(0.9)
+        assert Hedge(min_samples=1, min_delay=5.0).delay() is None
+
+    def test_window(self):
+        hedge = Hedge(percentile=100.0, min_samples=1, window=2)
+        for latency in (5.0, 0.1, 0.2):
+            hedge.observe(latency)
+        assert hedge.delay() == 0.2
@@ -0,0 +1,118 @@
+#
+# This file is part of pleiades_search_api
+# by Tom Elliott for the Institute for the Study of the Ancient World
+# (c) Copyright 2024 by New York University
+# Licensed under the AGPL-3.0; see LICENSE.txt file.
+#
+
+"""
+Test the pleiades_search_api.export module
+"""
+import json
+import logging
+from pathlib import Path
+from pleiades_search_api.export import ArrowWriter, GeoJSONSeqWriter, ParquetWriter
+from pleiades_search_api.results import ResultSet
+import pytest
+
+fn = Path(__file__).name
+logger = logging.getLogger(fn)
+
+QUERY = "https://pleiades.stoa.org/search_rss?Title=Zucchabar"
+HITS = [
+    {
+        "id": "295374",
+        "uri": "https://pleiades.stoa.org/places/295374",
+        "title": "Zucchabar",
+        "summary": "An ancient place, cited: BAtlas 30 D4 Zucchabar",
+        "reprPoint": [2.223758, 36.304939],
+        "bbox": [2.2, 36.3, 2.25, 36.31],
+        "modified": "2024-01-02T03:04:05Z",
+    },
+    {
+        "id": "423025",
+        "uri": "https://pleiades.stoa.org/places/423025",
+        "title": "Roma",
+        "summary": "The capital of the Roman Empire.",
+    },
+    {
+        "id": "1",
+        "uri": "https://pleiades.stoa.org/places/1",
+        "title": "Boxed",
+        "summary": "",
+        "bbox": [1.0, 2.0, 3.0, 4.0],
+    },
+]
+RESULTS = {"query": QUERY, "hits": HITS}
+
+
+class TestArrowWriters:
+    def test_parquet(self, tmp_path):
+        pq = pytest.importorskip("pyarrow.parquet")
+        path = tmp_path / "hits.parquet"
+        with ParquetWriter(path, row_group_size=2) as writer:
+            writer.write(RESULTS)
+        assert writer.rows == 3
+        f = pq.ParquetFile(str(path))
+        assert f.metadata.num_row_groups == 2
+        assert f.metadata.metadata[b"query"] == QUERY.encode()
+        table = f.read()
+        assert table.column("id").to_pylist() == [295374, 423025, 1]
+        assert table.column("longitude").to_pylist() == [2.223758, None, None]
+        assert table.column("bbox").to_pylist()[2] == [1.0, 2.0, 3.0, 4.0]
+        assert table.column("modified").to_pylist()[0] == "2024-01-02T03:04:05Z"
+        assert set(table.column("query").to_pylist()) == {QUERY}
+
+    def test_arrow_many(self, tmp_path):
+        pa = pytest.importorskip("pyarrow")
+        path = tmp_path / "hits.arrow"
+        other = {"query": "https://example.org/other", "hits": HITS[:1]}
+        with ArrowWriter(path) as writer:
+            writer.write_many([(None, RESULTS), ResultSet.from_results(other)])
+        assert writer.query is None
+        table = pa.ipc.open_file(str(path)).read_all()
+        assert table.num_rows == 4
+        assert table.column("query").to_pylist()[-1] == "https://example.org/other"
+
+    def test_arrow_query(self, tmp_path):
+        pa = pytest.importorskip("pyarrow")
+        path = tmp_path / "hits.arrow"
+        with ArrowWriter(path, query=QUERY) as writer:
+            writer.write(RESULTS)
+            writer.write_hits(HITS[:1])
+            with pytest.raises(ValueError):
+                writer.write_hits(HITS[:1], "https://example.org/other")
+        table = pa.ipc.open_file(str(path)).read_all()
+        assert table.schema.metadata[b"query"] == QUERY.encode()
+        assert set(table.column("query").to_pylist()) == {QUERY}
+        pq = pytest.importorskip("pyarrow.parquet")
+        path = tmp_path / "hits.parquet"
+        with ParquetWriter(path, query=QUERY) as writer:
+            writer.write(RESULTS)
+        assert pq.ParquetFile(str(path)).metadata.metadata[b"query"] == QUERY.encode()
+
+    def test_empty(self, tmp_path):
+        pa = pytest.importorskip("pyarrow")
+        path = tmp_path / "empty.arrows"
+        with ArrowWriter(path, stream=True):
+            pass
+        table = pa.ipc.open_stream(str(path)).read_all()
+        assert table.num_rows == 0
+        assert "title" in table.column_names
+
+
+class TestGeoJSONSeqWriter:
+    def test_write(self, tmp_path):
+        path = tmp_path / "hits.geojsonl"
+        with GeoJSONSeqWriter(path) as writer:
+            writer.write_hits(iter(HITS), QUERY)
+        assert (writer.rows, writer.skipped) == (2, 1)
+        features = [json.loads(line) for line in path.read_text().splitlines()]
+        assert features[0]["geometry"] == {
+            "type": "Point",
+            "coordinates": [2.223758, 36.304939],
+        }
+        assert features[0]["properties"]["query"] == QUERY
+        assert features[0]["properties"]["modified"] == "2024-01-02T03:04:05Z"
+        assert features[1]["geometry"]["type"] == "Polygon"
+        assert features[1]["bbox"] == [1.0, 2.0, 3.0, 4.0]
@@ -0,0 +1,187 @@
+#
+# This file is part of pleiades_search_api
+# by Tom Elliott for the Institute for the Study of the Ancient World
+# (c) Copyright 2024 by New York University
+# Licensed under the AGPL-3.0; see LICENSE.txt file.
+#
+
+"""
+Test the pleiades_search_api.local module
+"""
+import json
+import logging
+from pathlib import Path
+from pleiades_search_api.local import LocalSearchInterface
+from pleiades_search_api.search import Query
+import pytest
+
+fn = Path(__file__).name
+logger = logging.getLogger(fn)
+
+PLACES = [
+    {
+        "id": "295374",
+        "title": "Zucchabar",
+        "description": "An ancient city of Mauretania Caesariensis with Punic origins.",
+        "details": "<p>The modern community of Miliana lies atop the site.</p>",
+        "names": [{"romanized": "Zucchabar", "attested": ""}],
+        "subject": ["dare:ancient=1", "Veterans"],
+        "placeTypes": ["settlement"],
+        "bbox": [2.2, 36.3, 2.3, 36.4],
+        "reprPoint": [2.25, 36.35],
+    },
+    {
+        "id": "265849",
+        "title": "Carthago Nova/Col. Urbs Iulia",
+        "description": "A Punic and then Roman city.",
+        "subject": ["dare:ancient=1"],
+        "placeTypes": ["settlement", "port"],
+        "bbox": [-0.99, 37.59, -0.98, 37.61],
+        "reprPoint": [-0.98, 37.60],
+    },
+    {
+        "id": "482947334",
+        "title": "Sa Caleta",
+        "description": "A Phoenician settlement of the eighth and seventh centuries B.C.",
+        "subject": [],
+        "placeTypes": ["settlement"],
+        "bbox": None,
+    },
+]
+
+
+class TestLocalSearch:
+    lsi = LocalSearchInterface()
+    lsi.load_places(PLACES)
+
+    def ids(self, query):
+        return {hit["id"] for hit in self.lsi.search(query)["hits"]}
+
+    def test_load(self):
+        assert len(self.lsi) == 3
+
+    def test_reload_replaces(self):
+        lsi = LocalSearchInterface()
+        lsi.load_places(PLACES)
+        lsi.load_places([dict(PLACES[0], title="Zucchabar Again")])
+        assert len(lsi) == 3
+        q = Query()
+        q.set_parameter("title", "Again")
+        assert [hit["id"] for hit in lsi.search(q)["hits"]] == ["295374"]
+
+    def test_title(self):
+        q = Query()
+        q.set_parameter("title", "Zucchabar")
+        results = self.lsi.search(q)
+        assert results["query"] == (
+            "https://pleiades.stoa.org/search_rss?"
+            "portal_type%3Alist=Place&review_state%3Alist=published&Title=Zucchabar"
+        )
+        assert len(results["hits"]) == 1
+        hit = results["hits"][0]
+        assert hit["id"] == "295374"
+        assert hit["uri"] == "https://pleiades.stoa.org/places/295374"
+        assert hit["summary"].startswith("An ancient city")
+        assert hit["reprPoint"] == [2.25, 36.35]
+
+    def test_title_prefix(self):
+        q = Query()
+        q.set_parameter("title", "Zucch*")
+        assert self.ids(q) == {"295374"}
+
+    def test_description_or(self):
+        q = Query()
+        q.set_parameter("description", ["Punic", "Phoenician"], "OR")
+        assert self.ids(q) == {"295374", "265849", "482947334"}
+
+    def test_description_and(self):
+        q = Query()
+        q.set_parameter("description", ["Punic", "Roman"], "AND")
+        assert self.ids(q) == {"265849"}
+
+    def test_text(self):
+        q = Query()
+        q.set_parameter("text", "Miliana")
+        assert self.ids(q) == {"295374"}
+
+    def test_text_not(self):
+        q = Query()
+        q.set_parameter("text", "Punic AND NOT Roman")
+        assert self.ids(q) == {"295374"}
+
+    def test_text_leading_not(self):
+        q = Query()
+        for text in ["NOT Punic", "Punic OR NOT Roman"]:
+            q.set_parameter("text", text)
+            with pytest.raises(ValueError):
+                self.lsi.search(q)
+
+    def test_text_phrase(self):
+        q = Query()
+        q.set_parameter("text", '"Punic origins"')
+        assert self.ids(q) == {"295374"}
+        q.set_parameter("text", '"Punic city"')
+        assert self.ids(q) == set()
+        q.set_parameter("text", '"Roman city" OR "Phoenician settlement"')
+        assert self.ids(q) == {"265849", "482947334"}
+
+    def test_tag_or(self):
+        q = Query()
+        q.set_parameter("tag", ["Veterans", "dare:ancient=1"], "OR")
+        assert self.ids(q) == {"295374", "265849"}
+
+    def test_tag_and(self):
+        q = Query()
+        q.set_parameter("tag", ["Veterans", "dare:ancient=1"], "AND")
+        assert self.ids(q) == {"295374"}
+
+    def test_feature_type(self):
+        q = Query()
+        q.set_parameter("feature_type", "port")
+        assert self.ids(q) == {"265849"}
+
+    def test_bbox(self):
+        q = Query()
+        q.set_parameter("bbox", (2.0, 36.0, 2.5, 36.5))
+        assert self.ids(q) == {"295374"}
+        q.set_parameter("feature_type", ["settlement", "port"], "OR")
+        assert self.ids(q) == {"295374"}
+
+    def test_bbox_shaved(self):
+        q = Query()
+        q.set_parameter("bbox", (2.30005, 36.0, 2.5, 36.5))
+        assert self.ids(q) == set()
+
+    def test_no_terms(self):
+        q = Query()
+        q.set_parameter("text", "AND")
+        with pytest.raises(ValueError):
+            self.lsi.search(q)
+
+    def test_load_json(self, tmp_path):
+        path = tmp_path / "pleiades-places.json"
+        path.write_text(json.dumps({"@graph": PLACES}), encoding="utf-8")
+        lsi = LocalSearchInterface(tmp_path / "places.db")
+        assert lsi.load(path) == 3
+        q = Query()
+        q.set_parameter("tag", "Veterans")
+        assert [hit["id"] for hit in lsi.search(q)["hits"]] == ["295374"]
+
+    def test_load_csv(self, tmp_path):
+        path = tmp_path / "pleiades-places.csv"
+        path.write_text(
+            "id,title,description,bbox,featureTypes,tags,locationPrecision,reprLat,reprLong\n"
+            '295374,Zucchabar,A Punic city,"2.2, 36.3, 2.3, 36.4",settlement,"Veterans",precise,36.35,2.25\n'
+            "482947334,Sa Caleta,A Phoenician settlement,,settlement,,unlocated,,\n",
+            encoding="utf-8",
+        )
+        lsi = LocalSearchInterface()
+        assert lsi.load(path) == 2
+        q = Query()
+        q.set_parameter("bbox", (2.0, 36.0, 2.5, 36.5))
+        hits = lsi.search(q)["hits"]
+        assert [hit["id"] for hit in hits] == ["295374"]
+        assert hits[0]["bbox"] == [2.2, 36.3, 2.3, 36.4]
+        q = Query()
+        q.set_parameter("feature_type", "settlement")
+        assert len(lsi.search(q)["hits"]) == 2
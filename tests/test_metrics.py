@@ -0,0 +1,110 @@
+#
+# This file is part of pleiades_search_api
+# by Tom Elliott for the Institute for the Study of the Ancient World
+# (c) Copyright 2024 by New York University
+# Licensed under the AGPL-3.0; see LICENSE.txt file.
+#
+
+"""
+Test the pleiades_search_api.metrics module
+"""
+import io
+import logging
+from pathlib import Path
+from pleiades_search_api.cache import ResultCache
+from pleiades_search_api.metrics import Histogram, Metrics, NO_PHASE, phase
+from pleiades_search_api.search import Query, SearchInterface
+from pleiades_search_api.web import Transport, Web
+import requests
+
+fn = Path(__file__).name
+logger = logging.getLogger(fn)
+
+
+class TestHistogram:
+    def test_observe(self):
+        h = Histogram(buckets=(0.1, 1.0))
+        for v in [0.05, 0.5, 0.5, 2.0]:
+            h.observe(v)
+        snap = h.snapshot()
+        assert snap["count"] == 4
+        assert snap["buckets"] == {"0.1": 1, "1.0": 2, "inf": 1}
+        assert snap["min"] == 0.05
+        assert snap["max"] == 2.0
+        assert h.quantile(0.5) == 1.0
+        assert h.quantile(0.99) == 2.0
+
+    def test_empty(self):
+        assert Histogram().quantile(0.5) is None
+
+
+class TestMetrics:
+    def test_counters_and_hooks(self):
+        m = Metrics()
+        events = list()
+        m.add_hook(lambda kind, name, value: events.append((kind, name, value)))
+        m.count("requests")
+        m.count("bytes_received", 100)
+        with m.phase("fetch"):
+            pass
+        snap = m.snapshot()
+        assert snap["counters"] == {"requests": 1, "bytes_received": 100}
+        assert snap["histograms"]["fetch"]["count"] == 1
+        assert [e[:2] for e in events] == [
+            ("count", "requests"),
+            ("count", "bytes_received"),
+            ("observe", "fetch"),
+        ]
+        m.reset()
+        assert m.snapshot() == {"counters": {}, "histograms": {}}
+
+    def test_failing_hook(self):
+        m = Metrics()
+        m.add_hook(lambda kind, name, value: 1 / 0)
+        m.count("requests")
+        assert m.snapshot()["counters"]["requests"] == 1
+
+    def test_phase_off(self):
+        assert phase(None, "fetch") is NO_PHASE
+
+    def test_search(self, replay, rss):
+        m = Metrics()
+        si = SearchInterface(transport=replay, metrics=m, cache=ResultCache())
+        q = Query()
+        q.set_parameter("title", "Zucchabar")
+        replay.add_search(q)
+        si.search(q)
+        si.search(q)
+        snap = m.snapshot()
+        assert snap["counters"] == {
+            "searches": 2,
+            "cache_misses": 1,
+            "cache_hits": 1,
+            "requests": 1,
+            "status_200": 1,
+            "bytes_received": len(rss().encode("utf-8")),
+            "hits": 1,
+        }
+        for name in ["compile", "cache", "fetch", "parse"]:
+            assert snap["histograms"][name]["count"] >= 1
+
+    def test_bytes_streamed(self, rss):
+        body = rss().encode("utf-8")
+
+        class StreamingTransport(Transport):
+            def get(self, uri, headers=None):
+                r = requests.Response()
+                r.status_code = 200
+                r.raw = io.BytesIO(body)
+                if uri.endswith("/sized"):
+                    r.headers["Content-Length"] = "10"
+                return r
+
+        m = Metrics()
+        web = Web("pleiades.stoa.org", transport=StreamingTransport(), metrics=m)
+        r = web.get("https://pleiades.stoa.org/streamed")
+        assert "bytes_received" not in m.snapshot()["counters"]
+        assert b"".join(r.iter_content(chunk_size=16)) == body
+        assert m.snapshot()["counters"]["bytes_received"] == len(body)
+        web.get("https://pleiades.stoa.org/sized")
+        assert m.snapshot()["counters"]["bytes_received"] == len(body) + 10
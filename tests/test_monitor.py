@@ -0,0 +1,89 @@
+#
+# This file is part of pleiades_search_api
+# by Tom Elliott for the Institute for the Study of the Ancient World
+# (c) Copyright 2024 by New York University
+# Licensed under the AGPL-3.0; see LICENSE.txt file.
+#
+
+"""
+Test the pleiades_search_api.monitor module
+"""
+import logging
+from pathlib import Path
+from pleiades_search_api.monitor import QueryMonitor
+from pleiades_search_api.search import Query, SearchInterface
+from pleiades_search_api.web import ReplayTransport, _make_response
+
+fn = Path(__file__).name
+logger = logging.getLogger(fn)
+
+
+class ConditionalTransport(ReplayTransport):
+    """Answer If-None-Match requests for the current ETag with 304."""
+
+    def get(self, uri, headers=None):
+        status, response_headers, body = self.responses[uri]
+        self.requests.append((uri, dict(headers or {})))
+        if (headers or {}).get("If-None-Match") == response_headers.get("ETag"):
+            return _make_response(uri, 304, response_headers, b"")
+        return _make_response(uri, status, response_headers, body)
+
+
+class TestQueryMonitor:
+    def setup_monitor(self, path=None):
+        t = ConditionalTransport(netloc="pleiades.stoa.org")
+        si = SearchInterface(transport=t)
+        monitor = QueryMonitor(search_interface=si, path=path)
+        q = Query()
+        q.set_parameter("text", "Punic")
+        q.set_parameter("bbox", (-4.0, 33.0, 2.0, 40.0))
+        monitor.watch("punic", q)
+        uri = si._search_uri(q.compile().encoded)
+        return t, monitor, uri
+
+    def test_check(self, rss):
+        t, monitor, uri = self.setup_monitor()
+        t.add(uri, rss([("1", "Gadir"), ("2", "Malaka")]), headers={"ETag": "a"})
+        report = monitor.check("punic")
+        assert report["status"] == "new"
+        assert [hit["id"] for hit in report["added"]] == ["1", "2"]
+        assert t.requests[-1][1] == {}
+        # same ETag: not modified
+        report = monitor.check("punic")
+        assert report["status"] == "unchanged"
+        assert t.requests[-1][1] == {"If-None-Match": "a"}
+        # new body, same hits: unchanged
+        t.add(uri, rss([("1", "Gadir"), ("2", "Malaka")]) + " ", headers={"ETag": "b"})
+        assert monitor.check("punic")["status"] == "unchanged"
+        t.add(uri, rss([("1", "Gades"), ("3", "Sexi")]), headers={"ETag": "c"})
+        report = monitor.check("punic")
+        assert report["status"] == "changed"
+        assert [hit["id"] for hit in report["added"]] == ["3"]
+        assert [hit["id"] for hit in report["removed"]] == ["2"]
+        assert [hit["title"] for hit in report["changed"]] == ["Gades"]
+
+    def test_save_load(self, tmp_path, rss):
+        path = tmp_path / "monitor.json"
+        t, monitor, uri = self.setup_monitor(path)
+        t.add(uri, rss([("1", "Gadir")]), headers={"ETag": "a"})
+        assert [r["status"] for r in monitor.check_all()] == ["new"]
+        monitor = QueryMonitor(search_interface=monitor.search_interface, path=path)
+        assert monitor.query("punic").parameters["bbox"] == (
+            (-4.0, 33.0, 2.0, 40.0),
+            None,
+        )
+        assert [r["status"] for r in monitor.check_all()] == ["unchanged"]
+        assert t.requests[-1][1] == {"If-None-Match": "a"}
+
+    def test_check_all_error(self, tmp_path, rss):
+        path = tmp_path / "monitor.json"
+        t, monitor, uri = self.setup_monitor(path)
+        t.add(uri, rss([("1", "Gadir")]), headers={"ETag": "a"})
+        q = Query()
+        q.set_parameter("title", "Tarshish")
+        monitor.watch("tarshish", q)
+        t.add(monitor._uri("tarshish"), "", status=503, headers={"ETag": "b"})
+        reports = list(monitor.check_all())
+        assert [r["status"] for r in reports] == ["new", "error"]
+        assert "503" in reports[1]["error"]
+        assert QueryMonitor(path=path, user_agent="x").watches["punic"]["etag"] == "a"
@@ -0,0 +1,84 @@
+#
+# This file is part of pleiades_search_api
+# by Tom Elliott for the Institute for the Study of the Ancient World
+# (c) Copyright 2024 by New York University
+# Licensed under the AGPL-3.0; see LICENSE.txt file.
+#
+
+"""
+Test the pleiades_search_api.ratelimit module
+"""
+import logging
+from pathlib import Path
+from pleiades_search_api.ratelimit import RateLimiter
+import pytest
+from threading import Thread
+import time
+
+fn = Path(__file__).name
+logger = logging.getLogger(fn)
+
+
+class TestRateLimiter:
+    def test_seed(self):
+        limiter = RateLimiter()
+        with pytest.raises(RuntimeError):
+            limiter.acquire()
+        limiter.seed(0.5)
+        assert limiter.max_rate == 2.0
+        assert limiter.rate == 2.0
+        limiter = RateLimiter(max_rate=5.0)
+        limiter.seed(0.5)
+        assert limiter.rate == 5.0
+
+    def test_token_bucket(self):
+        limiter = RateLimiter(max_rate=20.0)
+        start = time.monotonic()
+        waits = [limiter.acquire() for _ in range(5)]
+        assert waits[0] == 0.0
+        assert time.monotonic() - start >= 4 / 20.0 * 0.9
+
+    def test_aimd(self):
+        limiter = RateLimiter(max_rate=10.0, increase=1.0, min_rate=1.0)
+        limiter.acquire()
+        limiter.record(429, 0.1)
+        assert limiter.rate == 5.0
+        # only one decrease per request interval
+        limiter.record(503, 0.1)
+        assert limiter.rate == 5.0
+        limiter.record(200, 0.1)
+        assert limiter.rate == 6.0
+        for _ in range(10):
+            limiter.record(200, 0.1)
+        assert limiter.rate == 10.0
+
+    def test_latency_target(self):
+        limiter = RateLimiter(max_rate=10.0, latency_target=1.0)
+        limiter.acquire()
+        limiter.record(200, 2.0)
+        assert limiter.rate == 5.0
+
+    def test_retry_after(self):
+        limiter = RateLimiter(max_rate=100.0)
+        limiter.acquire()
+        limiter.record(503, 0.01, "0.2")
+        assert limiter.acquire() >= 0.2
+
+    def test_shared_file(self, tmp_path):
+        path = tmp_path / "rate.json"
+        limiters = [RateLimiter(max_rate=20.0, path=path) for _ in range(2)]
+        start = time.monotonic()
+
+        def take(limiter):
+            for _ in range(3):
+                limiter.acquire()
+
+        threads = [Thread(target=take, args=(limiter,)) for limiter in limiters]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # six tokens between them, one available at once
+        assert time.monotonic() - start >= 5 / 20.0 * 0.9
+        limiters[0].record(429, 0.1)
+        assert limiters[1].rate == 10.0
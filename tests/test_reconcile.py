@@ -0,0 +1,81 @@
+#
+# This file is part of pleiades_search_api
+# by Tom Elliott for the Institute for the Study of the Ancient World
+# (c) Copyright 2024 by New York University
+# Licensed under the AGPL-3.0; see LICENSE.txt file.
+#
+
+"""
+Test the pleiades_search_api.reconcile module
+"""
+import logging
+from pathlib import Path
+from pleiades_search_api.reconcile import Reconciler, name_key
+from pleiades_search_api.search import SearchInterface
+from urllib.parse import parse_qs
+
+fn = Path(__file__).name
+logger = logging.getLogger(fn)
+
+UA = "CosmicBurritoBot/7.3 (+http://nowhere.com/cosmicburritobot)"
+TITLES = {"295374": "Zucchabar", "896643025": "Luxmanda", "423025": "Roma"}
+
+
+def fake_search_interface(monkeypatch):
+    si = SearchInterface(user_agent=UA)
+    calls = list()
+
+    def fake_search_rss(params):
+        title = parse_qs(params)["Title"][0]
+        calls.append(title)
+        hits = [
+            {"id": pid, "uri": f"https://pleiades.stoa.org/places/{pid}", "title": t}
+            for pid, t in TITLES.items()
+            if title.casefold() in t.casefold()
+        ]
+        return {"query": params, "hits": hits}
+
+    monkeypatch.setattr(si, "_search_rss", fake_search_rss)
+    return si, calls
+
+
+class TestReconciler:
+    def test_name_key(self):
+        assert name_key("  Zúcchabar\n") == "zucchabar"
+
+    def test_reconcile(self, monkeypatch):
+        si, calls = fake_search_interface(monkeypatch)
+        r = Reconciler(search_interface=si)
+        names = ["Zucchabar", "ZUCCHABAR", "Luxmanda", "Atlantis"]
+        results = dict(r.reconcile(names))
+        assert results["Zucchabar"]["source"] == "search"
+        assert results["Zucchabar"]["matches"][0]["id"] == "295374"
+        assert results["Zucchabar"]["matches"][0]["score"] == 1.0
+        assert results["ZUCCHABAR"]["matches"][0]["id"] == "295374"
+        assert results["Atlantis"] == {"matches": [], "source": None}
+        assert sorted(calls) == ["Atlantis", "Luxmanda", "Zucchabar"]
+        # everything is now answered locally, including the miss
+        results = dict(r.reconcile(["zucchabar", "Atlantis", "Luxmandá"]))
+        assert len(calls) == 3
+        assert results["zucchabar"]["source"] == "index"
+        assert results["Luxmandá"]["matches"][0]["id"] == "896643025"
+        assert r.stats["local_answers"] == 3
+
+    def test_similar(self, monkeypatch):
+        si, calls = fake_search_interface(monkeypatch)
+        r = Reconciler(search_interface=si)
+        r.add_places(
+            [
+                {
+                    "id": "295374",
+                    "title": "Zucchabar",
+                    "names": [{"romanized": "Zucchabar, Succabar", "attested": ""}],
+                }
+            ]
+        )
+        assert r.match("Succabar")[0]["score"] == 1.0
+        assert r.match("Zuccabar")[0]["id"] == "295374"
+        results = dict(r.reconcile(["Zuccabar"]))
+        assert calls == ["Zuccabar"]
+        assert results["Zuccabar"]["source"] == "similar"
+        assert 0.5 <= results["Zuccabar"]["matches"][0]["score"] < 1.0
@@ -0,0 +1,90 @@
+#
+# This file is part of pleiades_search_api
+# by Tom Elliott for the Institute for the Study of the Ancient World
+# (c) Copyright 2024 by New York University
+# Licensed under the AGPL-3.0; see LICENSE.txt file.
+#
+
+"""
+Test the pleiades_search_api.results module
+"""
+import json
+import logging
+from pathlib import Path
+from pleiades_search_api.results import Hit, ResultSet
+
+fn = Path(__file__).name
+logger = logging.getLogger(fn)
+
+
+def hit(pid, title, **extra):
+    h = {
+        "id": pid,
+        "uri": f"https://pleiades.stoa.org/places/{pid}",
+        "title": title,
+        "summary": f"About {title}",
+    }
+    h.update(extra)
+    return h
+
+
+ZUCCHABAR = hit("295374", "Zucchabar", reprPoint=(2.223758, 36.304939))
+LUXMANDA = hit("896643025", "Luxmanda")
+ROMA = hit("423025", "Roma", modified="2024-01-02T03:04:05Z")
+
+
+class TestHit:
+    def test_dict_view(self):
+        h = Hit.from_dict(ZUCCHABAR)
+        assert h.id == 295374
+        assert h["id"] == "295374"
+        assert h == ZUCCHABAR
+        assert h.to_dict() == ZUCCHABAR
+        assert h.get("bbox") is None
+        assert not hasattr(h, "__dict__")
+
+
+class TestResultSet:
+    def test_results_view(self):
+        results = {"query": "https://example.org", "hits": [ZUCCHABAR, LUXMANDA]}
+        rs = ResultSet.from_results(results)
+        assert rs["query"] == results["query"]
+        assert len(rs["hits"]) == 2
+        assert rs["hits"] == results["hits"]
+        assert [h["title"] for h in rs["hits"]] == ["Zucchabar", "Luxmanda"]
+        assert rs["hits"][-1]["id"] == "896643025"
+        assert rs.to_dict() == results
+        assert json.loads(json.dumps(rs.to_dict())) == json.loads(json.dumps(results))
+        assert list(rs.ids) == [295374, 896643025]
+
+    def test_duplicates_and_uris(self):
+        odd = hit("1", "Odd")
+        odd["uri"] = "https://example.org/1"
+        rs = ResultSet([ROMA, ROMA, odd])
+        assert len(rs.hits) == 2
+        assert rs.get_hit(1)["uri"] == "https://example.org/1"
+        assert rs.get_hit("423025") == ROMA
+        assert rs.get_hit(2) is None
+
+    def test_columns(self):
+        point = hit("1", "Point", reprPoint=[1.5, 2.5], modified="2024-01-02")
+        box = hit("2", "Box", bbox=[1.0, 2.0, 3.0, 4.0], colour="red")
+        rs = ResultSet([point, box, ZUCCHABAR])
+        assert 0 not in rs.extras
+        assert rs.extras[1] == {"colour": "red"}
+        assert rs.extras[2] == {"reprPoint": ZUCCHABAR["reprPoint"]}  # not a list
+        assert list(rs.points[:2]) == [1.5, 2.5]
+        assert rs.modified == ["2024-01-02", None, None]
+        assert rs.hits == [point, box, ZUCCHABAR]
+        assert (rs - ResultSet([point])).hits == [box, ZUCCHABAR]
+
+    def test_set_operations(self):
+        a = ResultSet([ZUCCHABAR, LUXMANDA], query="a")
+        b = ResultSet([LUXMANDA, ROMA], query="b")
+        assert list((a | b).ids) == [295374, 896643025, 423025]
+        assert (a | b).hits == [ZUCCHABAR, LUXMANDA, ROMA]
+        assert list((a & b).ids) == [896643025]
+        assert (a - b).hits == [ZUCCHABAR]
+        assert (b - a).hits == [ROMA]
+        assert (a | b).id_set() == {295374, 896643025, 423025}
+        assert (a & b)["query"] is None
@@ -0,0 +1,80 @@
+#
+# This file is part of pleiades_search_api
+# by Tom Elliott for the Institute for the Study of the Ancient World
+# (c) Copyright 2024 by New York University
+# Licensed under the AGPL-3.0; see LICENSE.txt file.
+#
+
+"""
+Test the pleiades_search_api.rss module
+"""
+import logging
+from pathlib import Path
+from pleiades_search_api.rss import iter_rss_items
+
+fn = Path(__file__).name
+logger = logging.getLogger(fn)
+
+RSS = """<?xml version="1.0" encoding="utf-8" ?>
+<rdf:RDF
+  xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+  xmlns:dc="http://purl.org/dc/elements/1.1/"
+  xmlns:georss="http://www.georss.org/georss"
+  xmlns="http://purl.org/rss/1.0/">
+<channel rdf:about="https://pleiades.stoa.org/search_rss">
+  <title>Pleiades</title>
+  <link>https://pleiades.stoa.org</link>
+  <description>Search results</description>
+</channel>
+<item rdf:about="https://pleiades.stoa.org/places/295374">
+  <title>Zucchabar</title>
+  <link>https://pleiades.stoa.org/places/295374</link>
+  <description>Zucchabar was an ancient city of Mauretania Caesariensis with Punic origins.</description>
+  <dc:subject>dare:ancient=1</dc:subject>
+  <dc:date>2024-01-01T00:00:00Z</dc:date>
+  <georss:point>36.35 2.25</georss:point>
+</item>
+<item rdf:about="https://pleiades.stoa.org/places/896643025">
+  <title>Luxmanda</title>
+  <description>A pastoral Neolithic site in Tanzania &amp; its environs.</description>
+</item>
+</rdf:RDF>
+""".encode("utf-8")
+
+
+class TestRSS:
+    def test_items(self):
+        items = list(iter_rss_items([RSS]))
+        assert len(items) == 2
+        assert items[0] == {
+            "link": "https://pleiades.stoa.org/places/295374",
+            "title": "Zucchabar",
+            "description": "Zucchabar was an ancient city of Mauretania Caesariensis with Punic origins.",
+            "date": "2024-01-01T00:00:00Z",
+            "point": "36.35 2.25",
+        }
+
+    def test_link_from_about(self):
+        items = list(iter_rss_items([RSS]))
+        assert items[1]["link"] == "https://pleiades.stoa.org/places/896643025"
+        assert items[1]["description"].endswith("Tanzania & its environs.")
+
+    def test_incremental(self):
+        # the first item must be available before the rest of the feed is read
+        end_of_first = RSS.index(b"</item>") + len(b"</item>")
+        fed = list()
+
+        def chunks():
+            for i in range(0, len(RSS), 7):
+                fed.append(i)
+                yield RSS[i : i + 7]
+
+        items = iter_rss_items(chunks())
+        first = next(items)
+        assert first["title"] == "Zucchabar"
+        assert fed[-1] < end_of_first + 7
+        assert [item["title"] for item in items] == ["Luxmanda"]
+
+    def test_empty(self):
+        rss = RSS[: RSS.index(b"<item")] + b"</rdf:RDF>"
+        assert list(iter_rss_items([rss])) == []
@@ -8,14 +8,35 @@
 """
 Test the pleiades_search_api.search module
 """
+import json
 import logging
+import os
 from pathlib import Path
-from pleiades_search_api.search import Query, SearchInterface
+from pleiades_search_api.cache import LRUCache, ResultCache, SharedCache, SpatialCache
+from pleiades_search_api.deadline import (
+    Deadline,
+    DeadlineExceeded,
+    Hedge,
+    RetryPolicy,
+)
+from pleiades_search_api.search import CompiledQuery, Query, SearchInterface
+from pleiades_search_api.web import ReplayTransport
 from pprint import pformat
+import pytest
+import requests
+import subprocess
+import sys
+from threading import Thread
+import time
+from urllib.parse import parse_qs
 
 fn = Path(__file__).name
 logger = logging.getLogger(fn)
 
+# cold-start budgets in seconds, generous enough for slow CI machines
+IMPORT_BUDGET = 0.5
+FIRST_REQUEST_BUDGET = 2.0
+
 
 class TestQuery:
     def test_bounding_box(self):
@@ -109,6 +130,75 @@ class TestQuery:
         assert q.parameters["text"] == (["Zucchabar", "Miliana"], "AND")
         assert q.parameters_for_web["SearchableText"] == "Zucchabar AND Miliana"
 
+    def test_canonical_key(self):
+        q1 = Query()
+        q1.set_parameter("tag", ["Ammon", "Amun"], "OR")
+        q1.set_parameter("text", ["Zucchabar", "Luxmanda"], "OR")
+        q2 = Query()
+        q2.set_parameter("text", ["Luxmanda", "Zucchabar"], "OR")
+        q2.set_parameter("tag", ["Amun", "Ammon"], "OR")
+        assert q1.canonical_key == q2.canonical_key
+        q2.set_parameter("text", ["Luxmanda", "Zucchabar"], "AND")
+        assert q1.canonical_key != q2.canonical_key
+
+    def test_compile(self):
+        q = Query()
+        q.set_parameter("tag", ["Ammon", "Amun"], "OR")
+        c = q.compile()
+        assert isinstance(c, CompiledQuery)
+        assert c is q.compile()
+        assert c.encoded == (
+            "portal_type%3Alist=Place&review_state%3Alist=published"
+            "&Subject%3Alist=Ammon&Subject%3Alist=Amun"
+        )
+        assert c.parameters == {"tag": (["Ammon", "Amun"], "OR")}
+        assert c.parameters_for_web == q.parameters_for_web
+        q.set_parameter("title", "Siwa")
+        assert q.compile() is not c
+        assert "Title" not in c.parameters_for_web
+
+    def test_compiled_immutable(self):
+        q = Query()
+        q.set_parameter("tag", ["Ammon", "Amun"], "OR")
+        c = q.compile()
+        with pytest.raises(AttributeError):
+            c.encoded = "foo"
+        c.parameters_for_web["Subject:list"].append("Zeus")
+        c.parameters["tag"][0].append("Zeus")
+        assert c.parameters_for_web["Subject:list"] == ["Ammon", "Amun"]
+        assert c.parameters["tag"] == (["Ammon", "Amun"], "OR")
+
+    def test_parameters_not_shared(self):
+        q = Query()
+        tags = ["Ammon", "Amun"]
+        q.set_parameter("tag", tags, "OR")
+        c = q.compile()
+        tags.append("Zeus")
+        q.parameters["tag"][0].append("Zeus")
+        with pytest.raises(TypeError):
+            q.parameters["title"] = ("Siwa", None)
+        assert q.parameters["tag"] == (["Ammon", "Amun"], "OR")
+        assert q.compile() is c
+        assert "Zeus" not in c.encoded
+
+    def test_compiled_hashable(self):
+        q1 = Query()
+        q1.set_parameter("tag", ["Ammon", "Amun"], "OR")
+        q2 = Query()
+        q2.set_parameter("tag", ["Amun", "Ammon"], "OR")
+        assert q1.compile() == q2.compile()
+        assert len({q1.compile(), q2.compile()}) == 1
+        assert q1.compile().digest == q2.compile().digest
+        assert q1.compile().encoded != q2.compile().encoded
+
+    def test_compiled_copy(self):
+        q = Query()
+        q.set_parameter("bbox", (2.0, 36.0, 2.5, 36.5))
+        q.set_parameter("text", ["Punic", "Phoenician"], "OR")
+        copy = q.compile().copy()
+        assert copy.parameters == q.parameters
+        assert copy.compile() == q.compile()
+
 
 class TestSearch:
     si = SearchInterface()
@@ -139,6 +229,19 @@ class TestSearch:
             "Zucchabar was an ancient city of Mauretania Caesariensis with Punic origins."
         )
 
+    def test_iter_search(self):
+        q = Query()
+        q.set_parameter("title", "Zucchabar")
+        hits = list(self.si.iter_search(q))
+        assert len(hits) == 1
+        hit = hits[0]
+        assert hit["id"] == "295374"
+        assert hit["title"] == "Zucchabar"
+        assert hit["uri"] == "https://pleiades.stoa.org/places/295374"
+        assert hit["summary"].startswith(
+            "Zucchabar was an ancient city of Mauretania Caesariensis with Punic origins."
+        )
+
     def test_prep_params_str(self):
         kwargs = {"foo": "bar"}
         params = self.si._prep_params(**kwargs)
@@ -289,3 +392,549 @@ class TestSearchCombinations:
         expected = {"589700", "590099", "630398334", "414067217"}
         ids = {hit["id"] for hit in results["hits"]}
         assert expected == ids
+
+
+class TestSearchMany:
+    si = SearchInterface()
+
+    def test_search_many(self):
+        queries = list()
+        for title in ["Zucchabar", "Luxmanda"]:
+            q = Query()
+            q.set_parameter("title", title)
+            queries.append(q)
+        results = {q: r for q, r in self.si.search_many(queries, max_workers=2)}
+        assert len(results) == 2
+        assert results[queries[0]]["hits"][0]["id"] == "295374"
+        assert results[queries[1]]["hits"][0]["id"] == "896643025"
+
+    def test_search_many_deduplicates(self, monkeypatch):
+        calls = list()
+
+        def fake_search_rss(params):
+            calls.append(params)
+            return {"query": params, "hits": []}
+
+        monkeypatch.setattr(self.si, "_search_rss", fake_search_rss)
+        queries = list()
+        for title in ["Zucchabar", "Zucchabar", "Luxmanda"] * 10:
+            q = Query()
+            q.set_parameter("title", title)
+            queries.append(q)
+        results = list(self.si.search_many(iter(queries), max_workers=3))
+        assert len(results) == 30
+        assert {q for q, r in results} == set(queries)
+        assert len(calls) == 2
+
+
+class TestSearchCoalesced:
+    def test_search_coalesced(self, monkeypatch):
+        si = SearchInterface(cache=ResultCache())
+        calls = list()
+
+        def fake_search_rss(params):
+            calls.append(params)
+            tags = parse_qs(params).get("Subject:list", [])
+            hits = [{"id": "1"}] if "Cybele" in tags else []
+            return {"query": params, "hits": hits}
+
+        monkeypatch.setattr(si, "_search_rss", fake_search_rss)
+        queries = list()
+        tags = [f"tag{i}" for i in range(16)] + ["Cybele"]
+        for tag in tags:
+            q = Query()
+            q.set_parameter("tag", tag)
+            q.set_parameter("feature_type", "temple-2")
+            queries.append(q)
+        results = {q: r for q, r in si.search_coalesced(queries, group_size=16)}
+        assert len(results) == 17
+        assert [len(results[q]["hits"]) for q in queries] == [0] * 16 + [1]
+        assert "Subject%3Alist=Cybele&" in results[queries[-1]]["query"]
+        assert len(calls) == 2
+        assert parse_qs(calls[0])["Subject:list"] == tags[:16]
+        # settled queries are cached individually
+        assert si.search(queries[3])["hits"] == []
+        assert len(calls) == 2
+
+    def test_search_coalesced_bisects(self, monkeypatch):
+        si = SearchInterface()
+        calls = list()
+
+        def fake_search_rss(params):
+            calls.append(params)
+            tags = parse_qs(params).get("Subject:list", [])
+            hits = [{"id": tag} for tag in tags if tag in {"tag2", "tag5"}]
+            return {"query": params, "hits": hits}
+
+        monkeypatch.setattr(si, "_search_rss", fake_search_rss)
+        queries = list()
+        for i in range(16):
+            q = Query()
+            q.set_parameter("tag", f"tag{i}")
+            queries.append(q)
+        results = {
+            q: r for q, r in si.search_coalesced(queries, group_size=16, max_workers=1)
+        }
+        hits = {q.parameters["tag"][0]: r["hits"] for q, r in results.items()}
+        assert hits["tag2"] == [{"id": "tag2"}]
+        assert hits["tag5"] == [{"id": "tag5"}]
+        assert sum(len(h) for h in hits.values()) == 2
+        assert len(calls) < len(queries)
+
+    def test_search_coalesced_not_mergeable(self, monkeypatch):
+        si = SearchInterface()
+        calls = list()
+
+        def fake_search_rss(params):
+            calls.append(params)
+            return {"query": params, "hits": []}
+
+        monkeypatch.setattr(si, "_search_rss", fake_search_rss)
+        queries = list()
+        for text in ["Punic", "Punic OR Phoenician", "Roman colony"]:
+            q = Query()
+            q.set_parameter("text", text)
+            queries.append(q)
+        q = Query()
+        q.set_parameter("title", "Zucchabar")
+        queries.append(q)
+        results = list(si.search_coalesced(queries))
+        assert len(results) == 4
+        assert len(calls) == 4
+
+
+class TestSearchPaginate:
+    def fake_pages(self, monkeypatch, si, total, ignore_start=False):
+        calls = list()
+
+        def fake_search_rss(params):
+            p = parse_qs(params)
+            start = 0 if ignore_start else int(p["b_start"][0])
+            size = int(p["b_size"][0])
+            calls.append((start, size))
+            ids = range(start, min(start + size, total))
+            return {"query": params, "hits": [{"id": str(i)} for i in ids]}
+
+        monkeypatch.setattr(si, "_search_rss", fake_search_rss)
+        return calls
+
+    def test_paginate(self, monkeypatch):
+        si = SearchInterface()
+        calls = self.fake_pages(monkeypatch, si, 250)
+        q = Query()
+        q.set_parameter("tag", "Cybele")
+        hits = list(si.paginate(q))
+        assert [hit["id"] for hit in hits] == [str(i) for i in range(250)]
+        assert calls == [(0, 100), (100, 100), (200, 100)]
+
+    def test_paginate_exact_multiple(self, monkeypatch):
+        si = SearchInterface()
+        calls = self.fake_pages(monkeypatch, si, 20)
+        q = Query()
+        q.set_parameter("tag", "Cybele")
+        assert len(list(si.paginate(q, page_size=10, prefetch=False))) == 20
+        assert calls == [(0, 10), (10, 10), (20, 10)]
+
+    def test_paginate_repeated_page(self, monkeypatch):
+        si = SearchInterface()
+        calls = self.fake_pages(monkeypatch, si, 250, ignore_start=True)
+        q = Query()
+        q.set_parameter("tag", "Cybele")
+        assert len(list(si.paginate(q))) == 100
+        assert len(calls) == 2
+
+    def test_paginate_page_size(self):
+        si = SearchInterface()
+        with pytest.raises(ValueError):
+            list(si.paginate(Query(), page_size=101))
+
+
+class TestEnrichHits:
+    place = {
+        "id": "295374",
+        "reprPoint": [2.224, 36.304],
+        "bbox": [2.224, 36.304, 2.224, 36.304],
+        "placeTypes": ["settlement"],
+        "names": [
+            {
+                "romanized": "Zucchabar, Succabar",
+                "attested": "",
+                "attestations": [{"timePeriod": "roman"}],
+            }
+        ],
+        "locations": [
+            {
+                "attestations": [
+                    {"timePeriod": "roman"},
+                    {"timePeriod": "late-antique"},
+                ]
+            }
+        ],
+    }
+
+    def test_enrich_hits(self):
+        t = ReplayTransport(netloc="pleiades.stoa.org")
+        t.add("https://pleiades.stoa.org/places/295374/json", json.dumps(self.place))
+        si = SearchInterface(transport=t, place_cache=LRUCache())
+        hits = [
+            {"id": "295374", "title": "Zucchabar", "modified": "2024-01-01"},
+            {"id": "295374", "title": "Zucchabar", "modified": "2024-01-01"},
+            {"id": "1", "title": "Nowhere"},
+        ]
+        enriched = si.enrich_hits(hits)
+        assert len(t.requests) == 2
+        assert enriched[0] == enriched[1]
+        assert enriched[0]["reprPoint"] == [2.224, 36.304]
+        assert enriched[0]["names"] == ["Zucchabar", "Succabar"]
+        assert enriched[0]["placeTypes"] == ["settlement"]
+        assert enriched[0]["timePeriods"] == ["roman", "late-antique"]
+        assert enriched[2] == hits[2]
+        assert "names" not in hits[0]
+        si.enrich_hits(hits[:1])
+        assert len(t.requests) == 2
+        # an edited place is fetched again
+        si.enrich_hits([dict(hits[0], modified="2024-02-01")])
+        assert len(t.requests) == 3
+
+
+class TestSearchCache:
+    def test_search_cached(self, monkeypatch):
+        si = SearchInterface(cache=ResultCache())
+        calls = list()
+
+        def fake_search_rss(params):
+            calls.append(params)
+            return {"query": params, "hits": [{"id": "295374"}]}
+
+        monkeypatch.setattr(si, "_search_rss", fake_search_rss)
+        q1 = Query()
+        q1.set_parameter("text", ["Zucchabar", "Miliana"], "AND")
+        q2 = Query()
+        q2.set_parameter("text", ["Miliana", "Zucchabar"], "AND")
+        r1 = si.search(q1)
+        r2 = si.search(q2)
+        assert len(calls) == 1
+        assert r1["hits"] == r2["hits"]
+        assert r2["query"].endswith("SearchableText=Miliana+AND+Zucchabar")
+        r2["hits"].clear()
+        assert len(si.search(q1)["hits"]) == 1
+        assert si.cache.stats["memory"]["hits"] == 2
+
+    def test_search_shared_single_flight(self, tmp_path, scripted):
+        t = scripted([(0.2, 200)])
+        path = tmp_path / "shared.db"
+        interfaces = [
+            SearchInterface(transport=t, cache=SharedCache(path, poll=0.01))
+            for _ in range(3)
+        ]
+        q = Query()
+        q.set_parameter("title", "Zucchabar")
+        results = list()
+        threads = [
+            Thread(target=lambda si: results.append(si.search(q)), args=(si,))
+            for si in interfaces
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(t.requests) == 1
+        assert [len(r["hits"]) for r in results] == [1, 1, 1]
+
+    def test_miss_counted_once(self, replay):
+        si = SearchInterface(transport=replay, cache=ResultCache(memory=LRUCache()))
+        q = Query()
+        q.set_parameter("title", "Zucchabar")
+        replay.add_search(q)
+        si.search(q)
+        si.search(q)
+        assert si.cache.memory.stats["misses"] == 1
+        assert si.cache.memory.stats["hits"] == 1
+
+    def test_error_not_cached(self, replay):
+        si = SearchInterface(transport=replay, cache=ResultCache())
+        q = Query()
+        q.set_parameter("title", "Zucchabar")
+        uri = si._search_uri(q.compile().encoded)
+        replay.add(uri, "<html>Service Unavailable</html>", 503)
+        with pytest.raises(RuntimeError):
+            si.search(q)
+        replay.add_search(q)
+        assert len(si.search(q)["hits"]) == 1
+        assert len(replay.requests) == 2
+
+
+class TestSearchExhaustive:
+    si = SearchInterface()
+
+    def test_search_exhaustive_requires_bbox(self):
+        q = Query()
+        q.set_parameter("title", "Zucchabar")
+        with pytest.raises(ValueError):
+            self.si.search_exhaustive(q)
+
+    def test_search_exhaustive_tiles(self, monkeypatch):
+        # 21 x 21 points on a 0.05 degree grid, so many lie exactly on tile edges
+        points = {
+            str(i * 100 + j): (2.0 + i * 0.05, 36.0 + j * 0.05)
+            for i in range(21)
+            for j in range(21)
+        }
+        calls = list()
+
+        def fake_search_rss(params):
+            calls.append(params)
+            p = parse_qs(params)
+            minx, miny = [float(v) for v in p["lowerLeft"][0].split(",")]
+            maxx, maxy = [float(v) for v in p["upperRight"][0].split(",")]
+            hits = [
+                {"id": pid}
+                for pid, (x, y) in points.items()
+                if minx <= x <= maxx and miny <= y <= maxy
+            ]
+            return {"query": params, "hits": hits[:100]}
+
+        monkeypatch.setattr(self.si, "_search_rss", fake_search_rss)
+        q = Query()
+        q.set_parameter("bbox", (1.9999, 35.9999, 3.0001, 37.0001))
+        results = self.si.search_exhaustive(q, max_workers=3)
+        assert results["query"] == calls[0]
+        assert not results["truncated"]
+        assert {hit["id"] for hit in results["hits"]} == set(points)
+        assert len(results["hits"]) == len(points)
+
+    def test_search_exhaustive_truncated(self, monkeypatch):
+        def fake_search_rss(params):
+            return {"query": params, "hits": [{"id": str(i)} for i in range(100)]}
+
+        monkeypatch.setattr(self.si, "_search_rss", fake_search_rss)
+        q = Query()
+        q.set_parameter("bbox", (2.0, 36.0, 2.5, 36.5))
+        results = self.si.search_exhaustive(q, max_depth=1)
+        assert results["truncated"]
+        assert len(results["hits"]) == 100
+
+
+class TestSearchSpatialCache:
+    def test_search_spatial_cached(self, monkeypatch):
+        si = SearchInterface(spatial_cache=SpatialCache())
+        calls = list()
+
+        def fake_search_rss(params):
+            calls.append(params)
+            return {
+                "query": params,
+                "hits": [
+                    {"id": "295374", "reprPoint": [2.25, 36.35]},
+                    {"id": "289924", "reprPoint": [2.45, 36.05]},
+                ],
+            }
+
+        monkeypatch.setattr(si, "_search_rss", fake_search_rss)
+        q = Query()
+        q.set_parameter("bbox", (2.0, 36.0, 2.5, 36.5))
+        assert len(si.search(q)["hits"]) == 2
+        q.set_parameter("bbox", (2.2, 36.2, 2.3, 36.4))
+        results = si.search(q)
+        assert len(calls) == 1
+        assert [hit["id"] for hit in results["hits"]] == ["295374"]
+
+    def test_rss_without_coordinates(self, replay):
+        t = replay
+        si = SearchInterface(
+            transport=t, spatial_cache=SpatialCache(), place_cache=LRUCache()
+        )
+        q = Query()
+        q.set_parameter("bbox", (2.0, 36.0, 2.5, 36.5))
+        places = [("295374", [2.25, 36.35]), ("289924", [2.45, 36.05])]
+        t.add_search(q, [(pid, f"Place {pid}") for pid, _ in places])
+        for pid, point in places:
+            t.add(
+                f"https://pleiades.stoa.org/places/{pid}/json",
+                json.dumps({"id": pid, "reprPoint": point}),
+            )
+        results = si.search(q)
+        assert [hit.get("reprPoint") for hit in results["hits"]] == [None, None]
+        assert len(si.spatial_cache) == 1
+        requests = len(t.requests)
+        q.set_parameter("bbox", (2.2, 36.2, 2.3, 36.4))
+        results = si.search(q)
+        assert len(t.requests) == requests
+        assert [hit["id"] for hit in results["hits"]] == ["295374"]
+
+    def test_error_not_spatial_cached(self):
+        t = ReplayTransport(netloc="pleiades.stoa.org")
+        si = SearchInterface(transport=t, spatial_cache=SpatialCache())
+        q = Query()
+        q.set_parameter("bbox", (0.0, 0.0, 10.0, 10.0))
+        t.add(si._search_uri(q.compile().encoded), "", 503)
+        with pytest.raises(RuntimeError):
+            si.search(q)
+        q.set_parameter("bbox", (1.0, 1.0, 2.0, 2.0))
+        with pytest.raises(RuntimeError):
+            si.search(q)  # not answered locally: a 404 from the transport
+        assert len(t.requests) == 2
+        assert len(si.spatial_cache) == 0
+
+
+class TestSearchDeadline:
+    def query(self, title="Zucchabar"):
+        q = Query()
+        q.set_parameter("title", title)
+        return q
+
+    def test_complete(self, scripted):
+        si = SearchInterface(transport=scripted([(0.0, 200)]))
+        assert "status" not in si.search(self.query())
+        results = si.search(self.query(), timeout=5.0)
+        assert results["status"] == "complete"
+        assert len(results["hits"]) == 1
+
+    def test_timed_out(self, scripted):
+        si = SearchInterface(transport=scripted([(1.0, 200)]), timeout=0.1)
+        start = time.monotonic()
+        results = si.search(self.query())
+        assert time.monotonic() - start < 0.5
+        assert results["status"] == "timed_out"
+        assert results["hits"] == []
+        assert "Zucchabar" in results["query"]
+
+    def test_retry(self, scripted):
+        t = scripted([(0.0, 503), (0.0, 503), (0.0, 200)])
+        si = SearchInterface(transport=t, retry=RetryPolicy(retries=2, backoff=0.01))
+        results = si.search(self.query())
+        assert len(t.requests) == 3
+        assert len(results["hits"]) == 1
+        t = scripted([(0.0, 503), (0.0, 200)])
+        si = SearchInterface(transport=t, retry=RetryPolicy(retries=2, backoff=0.01))
+        assert len(list(si.iter_search(self.query()))) == 1
+        assert len(t.requests) == 2
+
+    def test_retries_run_out(self, scripted):
+        t = scripted([(0.0, 503)])
+        si = SearchInterface(
+            transport=t,
+            cache=ResultCache(),
+            retry=RetryPolicy(retries=2, backoff=0.01),
+            timeout=5.0,
+        )
+        with pytest.raises(RuntimeError):
+            si.search(self.query())
+        assert len(t.requests) == 3
+        with pytest.raises(RuntimeError):
+            si.search(self.query())  # not answered from the cache
+        assert len(t.requests) == 6
+
+    def test_retry_errors(self):
+        class FailingTransport(ReplayTransport):
+            def get(self, uri, headers=None):
+                self.requests.append(uri)
+                raise self.error
+
+        t = FailingTransport(netloc="pleiades.stoa.org")
+        policy = RetryPolicy(retries=3, backoff=0.01)
+        si = SearchInterface(transport=t, retry=policy)
+        for error, attempts in [
+            (requests.ConnectionError("refused"), 4),
+            (requests.Timeout("slow"), 4),
+            (OSError("disk"), 1),
+            (PermissionError("robots.txt disallows it"), 1),
+        ]:
+            t.error = error
+            t.requests.clear()
+            with pytest.raises(type(error)):
+                si.search(self.query())
+            assert len(t.requests) == attempts
+        si.retry = RetryPolicy(retries=3, backoff=0.01, exceptions=(OSError,))
+        t.requests.clear()
+        with pytest.raises(PermissionError):
+            si.search(self.query())
+        assert len(t.requests) == 1
+
+    def test_expired_deadline(self, scripted):
+        t = scripted([(0.0, 200)])
+        si = SearchInterface(transport=t)
+        queries = [self.query(f"Place {i}") for i in range(10)]
+        for _, results in si.search_many(queries, deadline=Deadline(0.0)):
+            assert results["status"] == "timed_out"
+        assert t.requests == []
+
+    def test_hedge(self, scripted):
+        hedge = Hedge(percentile=100.0, min_samples=1)
+        hedge.observe(0.05)
+        t = scripted([(1.0, 200), (0.0, 200)])
+        si = SearchInterface(transport=t, hedge=hedge)
+        start = time.monotonic()
+        results = si.search(self.query())
+        assert time.monotonic() - start < 0.5
+        assert len(t.requests) == 1  # the first request has yet to finish
+        assert len(results["hits"]) == 1
+
+    def test_search_many_deadline(self, scripted):
+        si = SearchInterface(transport=scripted([(0.0, 200), (1.0, 200)]))
+        queries = [self.query("Zucchabar"), self.query("Roma")]
+        results = {
+            q.parameters["title"][0]: r
+            for q, r in si.search_many(queries, max_workers=1, deadline=Deadline(0.3))
+        }
+        assert results["Zucchabar"]["status"] == "complete"
+        assert results["Roma"]["status"] == "timed_out"
+
+    def test_search_exhaustive_partial(self, monkeypatch):
+        si = SearchInterface(timeout=0.1)
+
+        def fake_search_rss(params, deadline=None):
+            if "upperRight=2.4999%2C36.4999" not in params:  # tiles after the first
+                time.sleep(0.2)
+                if deadline.expired:
+                    raise DeadlineExceeded()
+            return {"query": params, "hits": [{"id": str(i)} for i in range(100)]}
+
+        monkeypatch.setattr(si, "_search_rss", fake_search_rss)
+        q = Query()
+        q.set_parameter("bbox", (2.0, 36.0, 2.5, 36.5))
+        results = si.search_exhaustive(q)
+        assert results["status"] == "partial"
+        assert len(results["hits"]) == 100
+
+
+class TestColdStart:
+    def run_python(self, code):
+        result = subprocess.run(
+            [sys.executable, "-c", code],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            env=dict(os.environ),
+            check=True,
+        )
+        return json.loads(result.stdout.decode("utf-8").splitlines()[-1])
+
+    def test_import_is_cheap(self):
+        out = self.run_python(
+            "import json, sys, time\n"
+            "t = time.perf_counter()\n"
+            "from pleiades_search_api.search import Query, SearchInterface\n"
+            "elapsed = time.perf_counter() - t\n"
+            "si = SearchInterface(user_agent='CosmicBurritoBot/7.3')\n"
+            "heavy = ['feedparser', 'requests', 'webiquette']\n"
+            "print(json.dumps([elapsed, [m for m in heavy if m in sys.modules]]))\n"
+        )
+        elapsed, imported = out
+        assert imported == []
+        assert elapsed < IMPORT_BUDGET
+
+    def test_first_request_is_cheap(self):
+        out = self.run_python(
+            "import json, time\n"
+            "from pleiades_search_api.search import Query, SearchInterface\n"
+            "from pleiades_search_api.web import ReplayTransport\n"
+            "t = time.perf_counter()\n"
+            "transport = ReplayTransport()\n"
+            "si = SearchInterface(transport=transport)\n"
+            "q = Query()\n"
+            "q.set_parameter('title', 'Zucchabar')\n"
+            "transport.add(si._search_uri(q.compile().encoded), '<rss/>')\n"
+            "si.search(q)\n"
+            "print(json.dumps(time.perf_counter() - t))\n"
+        )
+        assert out < FIRST_REQUEST_BUDGET
@@ -8,7 +8,9 @@
 Test the pleiades_search_api/text module.
 """
 import logging
-from pleiades_search_api.text import normtext
+from pleiades_search_api.text import normtext, normtext_many
+import pytest
+from textnorm import normalize_space, normalize_unicode
 
 logger = logging.getLogger(__name__)
 
@@ -35,3 +37,25 @@ class TestText:
         assert "Banana split" == normtext(s)
 
     # TBD: unicode normalization, but we know that textnorm does this
+
+    def test_normtext_unicode(self):
+        s = " Zu\u0301cchabar\u00a0 split"
+        assert normtext(s) == normalize_space(normalize_unicode(s))
+        assert normtext(s) == "Z\u00facchabar split"
+
+    def test_normtext_type(self):
+        with pytest.raises(TypeError):
+            normtext(None)
+
+
+class TestNormtextMany:
+    def test_normtext_many(self):
+        values = ["  Banana split ", "Zu\u0301cchabar", "  Banana split "]
+        results = normtext_many(values)
+        assert results == [normtext(v) for v in values]
+        assert results[0] is results[2]
+
+    def test_normtext_many_interned(self):
+        a = normtext_many(["Banana" + " split"])[0]
+        b = normtext_many([" ".join(["Banana", "split"])])[0]
+        assert a is b
@@ -0,0 +1,105 @@
+#
+# This file is part of pleiades_search_api
+# by Tom Elliott for the Institute for the Study of the Ancient World
+# (c) Copyright 2024 by New York University
+# Licensed under the AGPL-3.0; see LICENSE.txt file.
+#
+
+"""
+Test the pleiades_search_api.web module
+"""
+import logging
+from pathlib import Path
+from pleiades_search_api.ratelimit import RateLimiter
+from pleiades_search_api.search import Query, SearchInterface
+from pleiades_search_api.web import ReplayTransport, SessionTransport, Web
+import pytest
+import time
+
+fn = Path(__file__).name
+logger = logging.getLogger(fn)
+
+UA = "CosmicBurritoBot/7.3 (+http://nowhere.com/cosmicburritobot)"
+
+
+class TestReplayTransport:
+    def test_replay(self):
+        t = ReplayTransport()
+        t.add("https://pleiades.stoa.org/places/295374/json", '{"id": "295374"}')
+        r = t.get("https://pleiades.stoa.org/places/295374/json")
+        assert r.status_code == 200
+        assert r.json() == {"id": "295374"}
+        assert t.get("https://pleiades.stoa.org/nowhere").status_code == 404
+        assert len(t.requests) == 2
+
+    def test_save_load(self, tmp_path):
+        t = ReplayTransport()
+        t.add("https://pleiades.stoa.org/a", "Zucchabar", headers={"ETag": "x"})
+        t.save(tmp_path / "responses.json")
+        t2 = ReplayTransport()
+        t2.load(tmp_path / "responses.json")
+        r = t2.get("https://pleiades.stoa.org/a")
+        assert r.text == "Zucchabar"
+        assert r.headers["etag"] == "x"
+
+    def test_record(self):
+        source = ReplayTransport()
+        source.add("https://pleiades.stoa.org/a", "Zucchabar")
+        t = ReplayTransport(record_from=source)
+        assert t.get("https://pleiades.stoa.org/a").text == "Zucchabar"
+        assert t.get("https://pleiades.stoa.org/a").text == "Zucchabar"
+        assert len(source.requests) == 1
+
+    def test_search_offline(self, replay):
+        si = SearchInterface(transport=replay)
+        q = Query()
+        q.set_parameter("title", "Zucchabar")
+        replay.add_search(q)
+        results = si.search(q)
+        assert [hit["id"] for hit in results["hits"]] == ["295374"]
+        assert si.web is replay
+
+
+class TestSessionTransport:
+    def test_get(self, server):
+        netloc, seen = server
+        t = SessionTransport(netloc, user_agent=UA, scheme="http")
+        r = t.get(f"http://{netloc}/search_rss")
+        assert r.text == UA
+        assert t.crawl_delay == 0.0
+        assert [path for path, port in seen] == ["/robots.txt", "/search_rss"]
+
+    def test_robots_disallow(self, server):
+        netloc, seen = server
+        t = SessionTransport(netloc, user_agent=UA, scheme="http")
+        with pytest.raises(PermissionError):
+            t.get(f"http://{netloc}/private/things")
+
+    def test_shared_pool(self, server):
+        netloc, seen = server
+        t = SessionTransport(netloc, user_agent=UA, scheme="http")
+        webs = [Web(netloc, transport=t) for _ in range(3)]
+        for w in webs:
+            assert w.get(f"http://{netloc}/search_rss").status_code == 200
+        # one keep-alive connection served every request
+        assert len({port for path, port in seen}) == 1
+
+    def test_crawl_delay(self, server):
+        netloc, seen = server
+        t = SessionTransport(netloc, user_agent=UA, scheme="http", crawl_delay=0.2)
+        start = time.monotonic()
+        t.get(f"http://{netloc}/a")
+        t.get(f"http://{netloc}/b")
+        assert time.monotonic() - start >= 0.2
+
+    def test_rate_limiter(self, server, tmp_path):
+        netloc, seen = server
+        limiter = RateLimiter(path=tmp_path / "rate.json")
+        t = SessionTransport(
+            netloc, user_agent=UA, scheme="http", crawl_delay=0.2, rate_limiter=limiter
+        )
+        start = time.monotonic()
+        t.get(f"http://{netloc}/a")
+        t.get(f"http://{netloc}/b")
+        assert time.monotonic() - start >= 0.2
+        assert limiter.max_rate == 5.0